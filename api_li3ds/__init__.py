@@ -7,8 +7,14 @@ from pathlib import Path
 
 from flask import Flask
 from yaml import load as yload
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
 
 from api_li3ds.app import api, init_apis
+from api_li3ds.cache import cache, CACHE_SIZE
+from api_li3ds import admission, green, profiler, ratelimit, specs, timeouts, workers
 from api_li3ds.database import Database
 
 __version__ = '0.1.dev0'
@@ -28,7 +34,7 @@ def load_yaml_config(filename):
     Open Yaml file, load content for flask config and returns it as a python dict
     """
     content = io.open(filename, 'r').read()
-    return yload(content).get('flask', {})
+    return yload(content, Loader=SafeLoader).get('flask', {})
 
 
 def create_app():
@@ -67,9 +73,28 @@ def create_app():
                          'too short (at least 12 characters)')
         sys.exit(1)
 
+    for settings in app.config.get('API_KEYS') or []:
+        if len(settings.get('key') or '') < 12:
+            app.logger.fatal('API_KEYS keys must have at least 12 characters')
+            sys.exit(1)
+
     # load extensions
     # be carefull to load apis before blueprint !
     init_apis()
     api.init_app(app)
+    green.init_app(app)
     Database.init_app(app)
+    timeouts.init_app(app)
+    admission.init_app(app)
+    ratelimit.init_app(app)
+    profiler.init_app(app)
+    workers.init_app(app)
+    cache.maxsize = app.config.get('CACHE_SIZE', CACHE_SIZE)
+
+    # specifications are otherwise built on first request
+    if app.config.get('SPECS_VALIDATE'):
+        problems = specs.validate(specs.build(app, api))
+        if problems:
+            app.logger.fatal('invalid swagger specifications: {}'.format(', '.join(problems)))
+            sys.exit(1)
     return app
@@ -0,0 +1,173 @@
+'''
+Admission control of requests by cost class
+
+Each endpoint belongs to a cost class (the ``cost`` attribute of resources,
+a class name or a dict of class names by http method, overriden by endpoint
+with the ``ADMISSION_COSTS`` setting). Each class runs at most ``limit``
+requests at a time in a worker, ``queue`` other ones wait up to ``wait``
+seconds for a slot. Requests beyond are rejected with a 503 and a
+``Retry-After`` header, so that heavy requests (foreign schemas, previews)
+cannot starve cheap ones. Limits are set by class with the ``ADMISSION``
+setting, a limit of 0 meaning no limit.
+
+Only requests running their resource method take a slot: not modified and
+cached responses, followers of shared results and sub-requests of a batch
+(admitted with it) do not.
+'''
+import time
+import threading
+from contextlib import contextmanager
+
+from flask import current_app, request
+
+# default cost class of endpoints
+DEFAULT_COST = 'normal'
+
+# default settings of cost classes
+ADMISSION = {
+    'light': {'limit': 0, 'queue': 0, 'wait': 0, 'retry_after': 1},
+    'normal': {'limit': 0, 'queue': 0, 'wait': 0, 'retry_after': 1},
+    'heavy': {'limit': 4, 'queue': 8, 'wait': 5, 'retry_after': 10},
+}
+
+
+class Overloaded(Exception):
+    '''
+    Raised when a request is not admitted
+    '''
+
+    def __init__(self, cost):
+        super().__init__('too many {} requests, retry later'.format(cost.name))
+        self.retry_after = cost.retry_after
+
+
+class CostClass():
+    '''
+    Concurrency limit and queue of a cost class
+    '''
+
+    def __init__(self, name, limit=0, queue=0, wait=0, retry_after=1):
+        self.name = name
+        self.limit = limit
+        self.queue = queue
+        self.wait = wait
+        self.retry_after = retry_after
+        self.condition = threading.Condition()
+        self.running = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = 0
+
+    def acquire(self):
+        '''
+        Take a slot, waiting in the queue if all are used, raise Overloaded
+        if the queue is full or the wait too long
+        '''
+        with self.condition:
+            if self.limit and self.running >= self.limit:
+                if self.waiting >= self.queue:
+                    self.rejected += 1
+                    raise Overloaded(self)
+                self.waiting += 1
+                self.queued += 1
+                end = time.monotonic() + self.wait
+                try:
+                    while self.running >= self.limit:
+                        remaining = end - time.monotonic()
+                        if remaining <= 0:
+                            self.rejected += 1
+                            raise Overloaded(self)
+                        self.condition.wait(remaining)
+                finally:
+                    self.waiting -= 1
+            self.running += 1
+            self.admitted += 1
+
+    def release(self):
+        with self.condition:
+            self.running -= 1
+            self.condition.notify()
+
+    def stats(self):
+        with self.condition:
+            return {
+                'limit': self.limit,
+                'queue': self.queue,
+                'running': self.running,
+                'waiting': self.waiting,
+                'saturation': round(self.running / self.limit, 3) if self.limit else None,
+                'admitted': self.admitted,
+                'queued': self.queued,
+                'rejected': self.rejected,
+            }
+
+
+class Admission():
+    '''
+    Cost classes of a worker
+    '''
+
+    def __init__(self):
+        self.settings = {}
+        self.classes = {}
+        self.lock = threading.Lock()
+        self.configure()
+
+    def configure(self, settings=None):
+        '''
+        Create cost classes, settings overriding the default ones by class
+        '''
+        merged = {name: dict(values) for name, values in ADMISSION.items()}
+        for name, values in (settings or {}).items():
+            merged.setdefault(name, {}).update(values)
+        self.settings = merged
+        self.classes = {name: CostClass(name, **values) for name, values in merged.items()}
+
+    def get(self, name):
+        if name not in self.classes:
+            # unknown classes are not limited
+            with self.lock:
+                self.classes.setdefault(name, CostClass(name))
+        return self.classes[name]
+
+    @contextmanager
+    def admit(self, name):
+        '''
+        Run the block once admitted in the cost class
+        '''
+        cost = self.get(name)
+        cost.acquire()
+        try:
+            yield
+        finally:
+            cost.release()
+
+    def stats(self):
+        return {name: cost.stats() for name, cost in self.classes.items()}
+
+    def after_fork(self):
+        '''
+        Start without running requests in a forked worker
+        '''
+        self.lock = threading.Lock()
+        self.configure(self.settings)
+
+
+def cost_class(resource):
+    '''
+    Cost class of the current request handled by resource
+    '''
+    costs = current_app.config.get('ADMISSION_COSTS', {})
+    if request.endpoint in costs:
+        return costs[request.endpoint]
+    if isinstance(resource.cost, dict):
+        return resource.cost.get(request.method, DEFAULT_COST)
+    return resource.cost
+
+
+admission = Admission()
+
+
+def init_app(app):
+    admission.configure(app.config.get('ADMISSION'))
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+import re
+import json
+
+from flask import request, current_app
+from flask_restplus import fields
+from werkzeug.exceptions import HTTPException
+
+from api_li3ds.app import api, Resource, HEADER_API_KEY, SUBREQUEST_KEY
+from api_li3ds.cache import cache
+from api_li3ds.database import Database
+from api_li3ds.exc import abort
+
+nsbatch = api.namespace('batch', description='batch of api calls run in one transaction')
+
+# default maximum number of sub-requests in a batch
+MAX_BATCH_REQUESTS = 100
+
+# reference to a field of a previous sub-request result: $<index>.<field>
+REFERENCE = re.compile(r'\$(\d+)\.(\w+)')
+
+batch_request_model = nsbatch.model(
+    'Batch Request',
+    {
+        'method': fields.String(required=True, enum=['GET', 'POST', 'DELETE']),
+        'path': fields.String(
+            required=True,
+            description='path of the resource, e.g. /referentials/ or /sensors/$0.id/'),
+        'body': fields.Raw(description='payload, "$<index>.<field>" strings are '
+                                       'replaced by results of previous requests'),
+    })
+
+batch_model = nsbatch.model(
+    'Batch',
+    {
+        'requests': fields.List(fields.Nested(batch_request_model), required=True),
+    })
+
+batch_response_model = nsbatch.model(
+    'Batch Response',
+    {
+        'status': fields.Integer,
+        'body': fields.Raw,
+    })
+
+
+def lookup(match, results):
+    """Return the value referenced by a ``$<index>.<field>`` match
+    """
+    index, field = int(match.group(1)), match.group(2)
+    if index >= len(results):
+        abort(400, 'invalid reference {}, only {} requests done'
+                   .format(match.group(0), len(results)))
+    body = results[index]['body']
+    if isinstance(body, list):
+        # creation requests return a list with one element
+        body = body[0] if body else None
+    if not isinstance(body, dict) or field not in body:
+        abort(400, 'invalid reference {}, no field {}'.format(match.group(0), field))
+    return body[field]
+
+
+def resolve(value, results):
+    """Replace references to previous results in ``value``
+    """
+    if isinstance(value, dict):
+        return {key: resolve(val, results) for key, val in value.items()}
+    if isinstance(value, list):
+        return [resolve(val, results) for val in value]
+    if isinstance(value, str):
+        match = REFERENCE.fullmatch(value)
+        if match:
+            # keep the type of referenced value
+            return lookup(match, results)
+        return REFERENCE.sub(lambda match: str(lookup(match, results)), value)
+    return value
+
+
+def dispatch(method, path, body, invalidated):
+    """Run a sub-request through the api resources, namespaces it changes
+    are added to ``invalidated``
+
+    :returns: a tuple (status code, body)
+    """
+    headers = {}
+    if HEADER_API_KEY in request.headers:
+        headers[HEADER_API_KEY] = request.headers[HEADER_API_KEY]
+    data = json.dumps(body) if body is not None else None
+
+    with current_app.test_request_context(
+            path, base_url=request.url_root, method=method, headers=headers,
+            data=data, content_type='application/json',
+            environ_base={SUBREQUEST_KEY: invalidated}):
+        try:
+            resp = current_app.make_response(current_app.dispatch_request())
+        except HTTPException as exc:
+            message = getattr(exc, 'data', {}).get('message') or exc.description
+            return exc.code, {'message': message}
+
+    if resp.mimetype == 'application/json':
+        return resp.status_code, json.loads(resp.get_data(as_text=True))
+    return resp.status_code, resp.get_data(as_text=True)
+
+
+@nsbatch.route('/', endpoint='batch')
+class Batch(Resource):
+
+    @api.secure
+    @nsbatch.expect(batch_model)
+    @nsbatch.marshal_with(batch_response_model)
+    @nsbatch.response(400, 'A sub-request failed, nothing is committed')
+    def post(self):
+        '''
+        Run a list of api requests in one transaction
+
+        Requests are run in order, strings like "$0.id" in paths and bodies
+        are replaced by the field value of a previous request result.
+        If one request fails, all changes are rolled back.
+        '''
+        requests = api.payload['requests']
+        maximum = current_app.config.get('MAX_BATCH_REQUESTS', MAX_BATCH_REQUESTS)
+        if len(requests) > maximum:
+            abort(400, 'too many requests (maximum is {})'.format(maximum))
+
+        results = []
+        invalidated = set()
+        with Database.transaction():
+            for index, subrequest in enumerate(requests):
+                path = resolve(subrequest['path'], results)
+                if path.strip('/').split('/')[0] == nsbatch.name:
+                    abort(400, 'request {}: nested batches are not allowed'.format(index))
+                body = resolve(subrequest.get('body'), results)
+                status, body = dispatch(subrequest['method'].upper(), path, body, invalidated)
+                if status >= 400:
+                    # abort raises and rollbacks the transaction
+                    abort(status,
+                          'request {} ({} {}) failed: {}'.format(
+                              index, subrequest['method'], path, body.get('message')
+                              if isinstance(body, dict) else body))
+                results.append({'status': status, 'body': body})
+        # cached responses are only invalidated once changes are visible
+        for namespace in invalidated:
+            cache.invalidate(namespace)
+        return results
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+from flask import request, current_app
+from flask_restplus import fields
+
+from api_li3ds.app import api, Resource
+from api_li3ds import changes
+from api_li3ds import fields as li3ds_fields
+
+nschanges = api.namespace('changes', description='changes feed for synchronization')
+
+change_model = nschanges.model(
+    'Change',
+    {
+        'seq': fields.Integer(description='monotonic sequence of the change'),
+        'table': fields.String(description='li3ds table name'),
+        'op': fields.String(enum=['insert', 'update', 'delete', 'truncate']),
+        'id': fields.Integer(description='identifier of the changed row, 0 for truncates'),
+        'data': fields.Raw(description='row content, null for deletes'),
+        'changed_at': li3ds_fields.DateTime(dt_format='iso8601'),
+    })
+
+changes_model = nschanges.model(
+    'Changes',
+    {
+        'changes': fields.List(fields.Nested(change_model)),
+        'next': fields.String(description='token to use as since parameter of next call'),
+        'more': fields.Boolean(description='true if more changes are already available'),
+    })
+
+
+@nschanges.route('/', endpoint='changes')
+class Changes(Resource):
+
+    # tokens hold transaction snapshots, which are not comparable between
+    # replicas
+    read_replica = False
+
+    @nschanges.marshal_with(changes_model)
+    @nschanges.param('since', 'token returned by a previous call, '
+                              'all logged changes are returned if missing')
+    @nschanges.param('limit', 'maximum number of changes', type='integer')
+    def get(self):
+        '''
+        List changes on li3ds tables in commit order
+        '''
+        maximum = current_app.config.get('CHANGES_PAGE_SIZE', changes.CHANGES_PAGE_SIZE)
+        limit = min(request.args.get('limit', maximum, type=int), maximum)
+        return changes.feed(request.args.get('since'), max(limit, 1))
@@ -1,10 +1,18 @@
 # -*- coding: utf-8 -*-
-from flask import request
+import os
+
+from flask import request, current_app
 from flask_restplus import fields
+from psycopg2 import sql
 
-from api_li3ds.app import api, Resource, defaultpayload
+from api_li3ds.app import api, Resource, defaultpayload, select_fields, ids_batch
+from api_li3ds.app import bulk_insert, bulk_payload, conflict_update, ON_CONFLICT_PARAM
 from api_li3ds.database import Database
+from api_li3ds.exc import abort
+from api_li3ds import crawler
 from api_li3ds import fields as li3ds_fields
+from api_li3ds.expand import Relation
+from api_li3ds import shards
 
 
 nsds = api.namespace('datasources', description='datasources related operations')
@@ -25,6 +33,27 @@ datasource_model = nsds.inherit('Datasource Model', datasource_model_post, {
     'id': fields.Integer,
 })
 
+bulk_model = nsds.model('Datasource Bulk', {
+    'ids': fields.List(fields.Integer),
+})
+
+crawl_model = nsds.model('Datasource Crawl', {
+    'directory': fields.String(required=True, description='directory to crawl'),
+    'session': fields.Integer(required=True),
+    'referential': fields.Integer(required=True),
+})
+
+crawl_result_model = nsds.model('Datasource Crawl Result', {
+    'inserted': fields.Integer,
+    'updated': fields.Integer,
+    'skipped': fields.Integer,
+})
+
+datasource_columns = (
+    'uri', 'type', 'parameters', 'bounds', 'capture_start', 'capture_end',
+    'referential', 'session'
+)
+
 processing_model_post = nsds.model('Processing Model Post', {
     'launched': li3ds_fields.DateTime(dt_format='iso8601', default=None),
     'tool': fields.String(required=True),
@@ -37,11 +66,18 @@ processing_model = nsds.inherit('Processing Model', processing_model_post, {
     'target': fields.Integer(required=True)
 })
 
+datasource_relations = {
+    'processing': Relation('processing', 'target', processing_model, {}),
+}
+
 
 @nsds.route('/', endpoint='datasources')
 class Datasources(Resource):
 
+    tables = ('datasource', 'processing')
+
     @nsds.marshal_with(datasource_model)
+    @ids_batch('datasource', datasource_model)
     @nsds.param('uri', description='uri', type='string')
     @nsds.param('referential', description='referential')
     @nsds.param('session', description='session')
@@ -51,17 +87,21 @@ class Datasources(Resource):
         args = []
         for param in ('uri', 'referential', 'session'):
             if param in request.args:
-                cond.append(param + ' = %s')
+                cond.append(sql.SQL('{} = %s').format(sql.Identifier(param)))
                 args.append(request.args[param])
-        q = 'select * from li3ds.datasource'
+        q = sql.SQL('select {} from li3ds.datasource').format(select_fields(datasource_model))
         if cond:
-            q += ' where ' + ' AND '.join(cond)
-        return Database.query_asjson(q, args)
+            q += sql.SQL(' where ') + sql.SQL(' AND ').join(cond)
+        if 'session' in request.args:
+            with shards.on_shard(shards.id_shard(request.args['session'])):
+                return Database.query_asjson(q, args)
+        return shards.fanout(lambda: Database.query_asjson(q, args))
 
     @api.secure
     @nsds.expect(datasource_model_post)
     @nsds.marshal_with(datasource_model)
     @nsds.response(201, 'Datasource created')
+    @shards.routed(shards.by_payload('session'))
     def post(self):
         '''Create a datasource'''
         return Database.query_asdict(
@@ -78,15 +118,72 @@ class Datasources(Resource):
         ), 201
 
 
+@nsds.route('/bulk/', endpoint='datasources_bulk')
+class DatasourcesBulk(Resource):
+
+    @api.secure
+    @nsds.expect([datasource_model_post])
+    @nsds.marshal_with(bulk_model)
+    @nsds.param(ON_CONFLICT_PARAM, 'update existing datasources with the same uri and session',
+                enum=['update'])
+    @nsds.response(201, 'Datasources created')
+    def post(self):
+        '''Create or update many datasources
+
+        Returns identifiers in payload order.
+        '''
+        conflict = ('uri', 'session') if conflict_update() else None
+        # datasources are inserted on the shard of their session
+        ids = shards.scatter(
+            bulk_payload(), lambda item: shards.id_shard(item.get('session')),
+            lambda items: bulk_insert('datasource', datasource_columns, items, conflict=conflict)
+        )
+        return {'ids': ids}, 201
+
+
+@nsds.route('/crawl/', endpoint='datasources_crawl')
+class DatasourcesCrawl(Resource):
+
+    cost = 'heavy'
+
+    @api.secure
+    @nsds.expect(crawl_model)
+    @nsds.marshal_with(crawl_result_model)
+    @nsds.response(403, 'Crawling is disabled')
+    @shards.routed(shards.by_payload('session'))
+    def post(self):
+        '''Register files of an acquisition directory as datasources
+
+        Only new or modified files (size and modification time) are registered.
+        The directory must be under the CRAWLER_ROOT configured directory.
+        '''
+        root = current_app.config.get('CRAWLER_ROOT')
+        if not root:
+            abort(403, 'crawling is disabled (no CRAWLER_ROOT)')
+        root = os.path.realpath(root)
+        directory = os.path.realpath(os.path.join(root, api.payload['directory']))
+        inside = directory == root or directory.startswith(root.rstrip(os.sep) + os.sep)
+        if not inside or not os.path.isdir(directory):
+            abort(400, '{} is not a directory under {}'.format(api.payload['directory'], root))
+        return crawler.register(
+            directory, api.payload['session'], api.payload['referential'],
+            current_app.config.get('CRAWLER_WORKERS', crawler.CRAWLER_WORKERS)
+        ), 201
+
+
 @nsds.route('/<int:id>/', endpoint='datasource')
 @nsds.response(404, 'Datasource not found')
 class OneDatasource(Resource):
 
+    tables = ('datasource',)
+
     @nsds.marshal_with(datasource_model)
+    @shards.routed(shards.by_id)
     def get(self, id):
         '''Get one datasource given its identifier'''
         res = Database.query_asjson(
-            "select * from li3ds.datasource where id=%s", (id,)
+            sql.SQL("select {} from li3ds.datasource where id=%s")
+            .format(select_fields(datasource_model)), (id,)
         )
         if not res:
             nsds.abort(404, 'Datasource not found')
@@ -94,6 +191,7 @@ class OneDatasource(Resource):
 
     @api.secure
     @nsds.response(410, 'Datasource deleted')
+    @shards.routed(shards.by_id)
     def delete(self, id):
         '''Delete a datasource given its identifier'''
         res = Database.rowcount("delete from li3ds.datasource where id=%s", (id,))
@@ -107,18 +205,23 @@ class OneDatasource(Resource):
 @nsds.response(404, 'Datasource not found')
 class Processing(Resource):
 
+    tables = ('datasource', 'processing')
+
     @nsds.marshal_with(processing_model)
+    @shards.routed(shards.by_id)
     def get(self, id):
         '''Get the processing tool used to generate this datasource'''
         res = Database.query_asjson(
-            "select * from li3ds.datasource where id=%s", (id,)
+            "select id from li3ds.datasource where id=%s", (id,)
         )
         if not res:
             nsds.abort(404, 'Datasource not found')
 
         return Database.query_asjson(
-            " select p.* from li3ds.processing p"
-            " join li3ds.datasource s on s.id = p.target where s.id=%s",
+            sql.SQL(
+                " select {} from li3ds.processing p"
+                " join li3ds.datasource s on s.id = p.target where s.id=%s"
+            ).format(select_fields(processing_model, 'p')),
             (id,)
         )
 
@@ -126,6 +229,7 @@ class Processing(Resource):
     @nsds.expect(processing_model_post)
     @nsds.marshal_with(processing_model)
     @nsds.response(201, 'Datasource created')
+    @shards.routed(shards.by_id)
     def post(self, id):
         '''Add a new processing tool that has generated the given datasource'''
         return Database.query_asdict(
@@ -141,15 +245,20 @@ class Processing(Resource):
 @nsds.response(404, 'Processing not found')
 class OneProcessing(Resource):
 
+    tables = ('processing',)
+
     @nsds.marshal_with(processing_model)
+    @shards.routed(shards.by_id)
     def get(self, id):
         '''Get processing tool given its id'''
         return Database.query_asjson(
-            " select * from li3ds.processing where id = %s", (id,)
+            sql.SQL(" select {} from li3ds.processing where id = %s")
+            .format(select_fields(processing_model)), (id,)
         )
 
     @api.secure
     @nsds.response(410, 'Processing deleted')
+    @shards.routed(shards.by_id)
     def delete(self, id):
         '''Delete a processing entry'''
         res = Database.rowcount("delete from li3ds.processing where id=%s", (id,))
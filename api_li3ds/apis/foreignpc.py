@@ -185,6 +185,8 @@ schema_quat_projected = _schema_quat.format('''<pc:dimension>
 @nsfpc.route('/drivers/', endpoint='foreigndrivers')
 class ForeignDrivers(Resource):
 
+    cost = 'light'
+
     def get(self):
         '''
         Retrieve driver list (multicorn based wrappers)
@@ -196,6 +198,8 @@ class ForeignDrivers(Resource):
 @nsfpc.route('/servers/', endpoint='foreignservers')
 class ForeignServers(Resource):
 
+    cache_ttl = 60
+
     def get(self):
         '''
         Retrieve foreign server list
@@ -349,6 +353,8 @@ class ForeignTable(Resource):
 @nsfpc.route('/schema/', endpoint='foreignschema')
 class ForeignSchema(Resource):
 
+    cost = 'heavy'
+
     @api.secure
     @nsfpc.expect(foreignpc_schema_model)
     def post(self):
@@ -381,6 +387,9 @@ class ForeignSchema(Resource):
 @nsfpc.route('/views/', endpoint='foreignview')
 class ForeignViews(Resource):
 
+    # materialized views are filled on creation
+    cost = {'POST': 'heavy'}
+
     def get(self):
         '''
         Retrieve foreign view list
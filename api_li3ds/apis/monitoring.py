@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+from api_li3ds.admission import admission
+from api_li3ds.app import api, Resource
+from api_li3ds.cache import cache
+from api_li3ds.database import Database
+from api_li3ds.prepared import statements
+from api_li3ds.singleflight import flights
+from api_li3ds.slowqueries import inspector
+
+nsmonitoring = api.namespace('monitoring', description='api monitoring')
+
+
+@nsmonitoring.route('/cache/', endpoint='monitoring_cache')
+class CacheStats(Resource):
+
+    cost = 'light'
+
+    def get(self):
+        '''
+        Response cache size, hits and misses by endpoint (for this worker)
+        '''
+        return cache.stats()
+
+
+@nsmonitoring.route('/singleflight/', endpoint='monitoring_singleflight')
+class SingleFlightStats(Resource):
+
+    cost = 'light'
+
+    def get(self):
+        '''
+        Number of responses shared between identical concurrent requests
+        by endpoint (for this worker)
+        '''
+        return flights.stats()
+
+
+@nsmonitoring.route('/replicas/', endpoint='monitoring_replicas')
+class ReplicaStats(Resource):
+
+    cost = 'light'
+
+    def get(self):
+        '''
+        Health of replica databases (as seen by this worker)
+        '''
+        return [replica.stats() for replica in Database.replicas]
+
+
+@nsmonitoring.route('/statements/', endpoint='monitoring_statements')
+class StatementStats(Resource):
+
+    cost = 'light'
+
+    @api.secure
+    def get(self):
+        '''
+        Executions of prepared statements and estimated planning time saved
+        (for this worker)
+        '''
+        return statements.stats()
+
+
+@nsmonitoring.route('/admission/', endpoint='monitoring_admission')
+class AdmissionStats(Resource):
+
+    cost = 'light'
+
+    def get(self):
+        '''
+        Running, waiting and rejected requests by cost class
+        (for this worker)
+        '''
+        return admission.stats()
+
+
+@nsmonitoring.route('/slowqueries/', endpoint='monitoring_slowqueries')
+class SlowQueries(Resource):
+
+    cost = 'light'
+
+    @api.secure
+    def get(self):
+        '''
+        Plans of the slowest read-only queries, with sequential scans
+        of large li3ds tables (for this worker)
+        '''
+        return inspector.stats()
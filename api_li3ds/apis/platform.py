@@ -1,10 +1,12 @@
 # -*- coding: utf-8 -*-
 from flask import make_response
 from flask_restplus import fields
+from psycopg2 import sql
 
-from api_li3ds.app import api, Resource, defaultpayload
+from api_li3ds.app import api, Resource, defaultpayload, select_fields, ids_batch
 from api_li3ds.database import Database
 from api_li3ds import dot
+from api_li3ds import calibration
 from api_li3ds import fields as li3ds_fields
 
 from .sensor import sensor_model
@@ -42,14 +44,30 @@ platform_config = nspfm.inherit(
         'id': fields.Integer,
     })
 
+calibration_model = nspfm.model(
+    'Calibration',
+    {
+        'sensors': fields.List(fields.Raw),
+        'referentials': fields.List(fields.Raw),
+        'transfo_types': fields.List(fields.Raw),
+        'transfos': fields.List(fields.Raw),
+        'transfo_trees': fields.List(fields.Raw),
+        'platform_config': fields.Raw(required=True),
+    })
+
 
 @nspfm.route('/', endpoint='platforms')
 class Platforms(Resource):
 
+    tables = ('platform',)
+
     @nspfm.marshal_with(platform_model)
+    @ids_batch('platform', platform_model)
     def get(self):
         '''List platforms'''
-        return Database.query_asjson("select * from li3ds.platform")
+        return Database.query_asjson(
+            sql.SQL("select {} from li3ds.platform").format(select_fields(platform_model))
+        )
 
     @api.secure
     @nspfm.expect(platform_model_post)
@@ -69,11 +87,14 @@ class Platforms(Resource):
 @nspfm.response(404, 'Platform not found')
 class OnePlatform(Resource):
 
+    tables = ('platform',)
+
     @nspfm.marshal_with(platform_model)
     def get(self, id):
         '''Get one platform given its identifier'''
         res = Database.query_asjson(
-            "select * from li3ds.platform where id=%s", (id,)
+            sql.SQL("select {} from li3ds.platform where id=%s")
+            .format(select_fields(platform_model)), (id,)
         )
         if not res:
             nspfm.abort(404, 'Platform not found')
@@ -92,11 +113,14 @@ class OnePlatform(Resource):
 @nspfm.route('/<int:id>/configs/', endpoint='platform_configs')
 class PlatformConfigs(Resource):
 
+    tables = ('platform_config',)
+
     @nspfm.marshal_with(platform_config)
     def get(self, id):
         '''List all platform configurations'''
         return Database.query_asjson(
-            "select * from li3ds.platform_config where platform = %s", (id,)
+            sql.SQL("select {} from li3ds.platform_config where platform = %s")
+            .format(select_fields(platform_config)), (id,)
         )
 
     @api.secure
@@ -116,6 +140,8 @@ class PlatformConfigs(Resource):
 @nspfm.param('id', 'The platform config identifier')
 class OnePlatformConfig(Resource):
 
+    tables = ('platform_config',)
+
     def get(self, id):
         '''Get a platform configuration given its identifier'''
         return Database.query_asjson(
@@ -136,6 +162,10 @@ class OnePlatformConfig(Resource):
 @nspfm.param('id', 'The platform config identifier')
 class PlatformConfigDot(Resource):
 
+    tables = ('platform', 'platform_config', 'transfo_tree', 'transfo', 'transfo_type',
+              'referential', 'sensor')
+    coalesce = True
+
     def get(self, id):
         '''Get a preview for this platform configuration as dot
 
@@ -156,6 +186,11 @@ class PlatformConfigDot(Resource):
 @nspfm.param('id', 'The platform config identifier')
 class PlatformConfigPreview(Resource):
 
+    tables = ('platform', 'platform_config', 'transfo_tree', 'transfo', 'transfo_type',
+              'referential', 'sensor')
+    coalesce = True
+    cost = 'heavy'
+
     def get(self, id):
         '''Get a preview for this platform configuration as png
 
@@ -176,12 +211,16 @@ class PlatformConfigPreview(Resource):
 @nspfm.param('id', 'The platform config identifier')
 class PlatformConfigSensors(Resource):
 
+    tables = ('platform_config', 'transfo_tree', 'transfo', 'transfo_type',
+              'referential', 'sensor')
+    cache_ttl = 60
+
     @nspfm.marshal_with(sensor_model)
     def get(self, id):
         '''Get all sensors used in a given platform configuration'''
-        return Database.query_asjson("""
+        return Database.query_asjson(sql.SQL("""
             select
-               distinct s.*
+               distinct {}
             from li3ds.platform_config pf
             join li3ds.transfo_tree tt on tt.id = ANY(pf.transfo_trees)
             , lateral unnest(tt.transfos) as tid
@@ -189,4 +228,45 @@ class PlatformConfigSensors(Resource):
             join li3ds.referential r on r.id = t.source or r.id = t.target
             join li3ds.sensor s on s.id = r.sensor
             where pf.id = %s
-            """, (id,))
+            """).format(select_fields(sensor_model, 's')), (id,))
+
+
+@nspfm.route('/<int:id>/calibration/', endpoint='platform_calibration')
+@nspfm.param('id', 'The platform identifier')
+class PlatformCalibration(Resource):
+
+    invalidates = ('sensors', 'referentials', 'transfos', 'transfotrees')
+
+    @api.secure
+    @nspfm.expect(calibration_model)
+    @nspfm.response(201, 'Calibration imported')
+    def post(self, id):
+        '''
+        Import a full calibration document in one transaction
+
+        Objects reference each other with their "key" (strings),
+        integer references are existing identifiers.
+        Returns created identifiers by object type and key.
+        '''
+        res = Database.query_asjson("select id from li3ds.platform where id=%s", (id,))
+        if not res:
+            nspfm.abort(404, 'Platform not found')
+        return calibration.import_(id, api.payload), 201
+
+
+@nspfm.route('/configs/<int:id>/calibration/', endpoint='platform_config_calibration')
+@nspfm.param('id', 'The platform config identifier')
+class PlatformConfigCalibration(Resource):
+
+    tables = ('platform_config', 'transfo_tree', 'transfo', 'transfo_type',
+              'referential', 'sensor')
+
+    @nspfm.response(404, 'Platform configuration not found')
+    def get(self, id):
+        '''
+        Export a platform configuration with all its objects as a calibration document
+        '''
+        document = calibration.export(id)
+        if not document:
+            nspfm.abort(404, 'Platform configuration not found')
+        return document
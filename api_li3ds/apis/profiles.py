@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+import io
+import pstats
+
+from flask import make_response, request
+from flask_restplus import fields
+
+from api_li3ds.app import api, Resource
+from api_li3ds import profiler
+
+nsprofiles = api.namespace('profiles', description='profiles of requests')
+
+profile_model = nsprofiles.model(
+    'Profile',
+    {
+        'id': fields.String(description='request id, given by the X-Profile-Id header'),
+        'format': fields.String(enum=list(profiler.EXTENSIONS.values())),
+        'method': fields.String,
+        'path': fields.String,
+        'endpoint': fields.String,
+        'status': fields.Integer,
+        'duration_ms': fields.Float,
+        'created': fields.Float(description='unix timestamp'),
+    })
+
+
+@nsprofiles.route('/', endpoint='profiles')
+class Profiles(Resource):
+
+    cost = 'light'
+    read_replica = False
+
+    @api.secure
+    @nsprofiles.marshal_with(profile_model, as_list=True)
+    def get(self):
+        '''
+        List stored profiles, most recent first
+        '''
+        return profiler.profiles()
+
+
+@nsprofiles.route('/<string:id>/', endpoint='profile')
+@nsprofiles.param('id', 'The request id')
+@nsprofiles.param('format', 'text for a readable summary of a pstats profile', 'query')
+class OneProfile(Resource):
+
+    cost = 'light'
+    read_replica = False
+
+    @api.secure
+    def get(self, id):
+        '''
+        Download a profile: pstats (cProfile) or collapsed stacks (sampler)
+        '''
+        found = profiler.profile(id)
+        if found is None:
+            nsprofiles.abort(404, 'Profile not found')
+        meta, path = found
+        try:
+            if meta['format'] == 'pstats' and request.args.get('format') == 'text':
+                out = io.StringIO()
+                pstats.Stats(path, stream=out).sort_stats('cumulative').print_stats(50)
+                response = make_response(out.getvalue())
+                response.mimetype = 'text/plain'
+                return response
+            with open(path, 'rb') as profile:
+                response = make_response(profile.read())
+        except OSError:
+            nsprofiles.abort(404, 'Profile not found')
+
+        response.mimetype = 'text/plain' if meta['format'] == 'collapsed' else \
+            'application/octet-stream'
+        response.headers['Content-Disposition'] = 'attachment; filename={}.{}'.format(
+            id, meta['format'])
+        return response
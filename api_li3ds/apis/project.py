@@ -1,9 +1,12 @@
 # -*- coding: utf-8 -*-
 from flask_restplus import fields
+from psycopg2 import sql
 
 from api_li3ds.database import Database
-from api_li3ds.app import api, Resource, defaultpayload
-from .session import session_model
+from api_li3ds.app import api, Resource, defaultpayload, select_fields, ids_batch
+from api_li3ds.expand import Relation, expandable
+from api_li3ds import shards
+from .session import session_model, session_relations
 
 
 nsproject = api.namespace('projects', description='projects related operations')
@@ -30,18 +33,28 @@ project_model = nsproject.inherit('Project Model', project_model_post, {
     'extent': GeometryOutput
 })
 
+project_relations = {
+    'sessions': Relation('session', 'project', session_model, session_relations),
+}
+
 
 @nsproject.route('/', endpoint='projects')
 class Projects(Resource):
 
+    tables = ('project', 'session', 'datasource', 'processing')
+
+    @expandable(project_relations)
     @nsproject.marshal_with(project_model)
+    @ids_batch('project', project_model)
     def get(self):
         '''List all projects'''
-        return Database.query_asjson("select * from li3ds.project")
+        query = sql.SQL("select {} from li3ds.project").format(select_fields(project_model))
+        return shards.fanout(lambda: Database.query_asjson(query))
 
     @api.secure
     @nsproject.expect(project_model_post)
     @nsproject.marshal_with(project_model)
+    @shards.routed(shards.by_payload('name', shards.project_shard))
     def post(self):
         '''
         Create a project.
@@ -61,10 +74,17 @@ class Projects(Resource):
 @nsproject.param('name', 'The project name')
 class OneProject(Resource):
 
+    tables = ('project', 'session', 'datasource', 'processing')
+
+    @expandable(project_relations)
     @nsproject.marshal_with(project_model)
+    @shards.routed(shards.by_name)
     def get(self, name):
         '''Get a project given its name'''
-        res = Database.query_asjson("select * from li3ds.project where name=%s", (name,))
+        res = Database.query_asjson(
+            sql.SQL("select {} from li3ds.project where name=%s")
+            .format(select_fields(project_model)), (name,)
+        )
         if not res:
             nsproject.abort(404, 'Project not found')
         return res
@@ -72,6 +92,7 @@ class OneProject(Resource):
     @api.secure
     @nsproject.response(410, 'Session deleted')
     @nsproject.marshal_with(project_model, mask='id')
+    @shards.routed(shards.by_name)
     def delete(self, name):
         '''
         Delete a project.
@@ -88,14 +109,18 @@ class OneProject(Resource):
 @nsproject.param('name', 'The project name')
 class Sessions(Resource):
 
+    tables = ('project', 'session', 'datasource', 'processing')
+
+    @expandable(session_relations)
     @nsproject.marshal_with(session_model)
+    @shards.routed(shards.by_name)
     def get(self, name):
         '''List all sessions for a given project'''
         res = Database.query_asjson("select * from li3ds.project where name=%s", (name,))
         if not res:
             nsproject.abort(404, 'Project not found')
         return Database.query_asjson(
-            """select s.* from li3ds.session s
+            sql.SQL("""select {} from li3ds.session s
             join li3ds.project p on s.project=p.id where p.name=%s
-            """, (name,)
+            """).format(select_fields(session_model, 's')), (name,)
         )
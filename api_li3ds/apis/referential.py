@@ -1,7 +1,9 @@
 # -*- coding: utf-8 -*-
 from flask_restplus import fields
+from psycopg2 import sql
 
-from api_li3ds.app import api, Resource, defaultpayload
+from api_li3ds.app import api, Resource, defaultpayload, select_fields, ids_batch
+from api_li3ds.app import bulk_insert, bulk_payload, conflict_update, ON_CONFLICT_PARAM
 from api_li3ds.database import Database
 from api_li3ds import fields as li3ds_fields
 
@@ -23,6 +25,14 @@ referential_model = nsrf.inherit(
         'id': fields.Integer
     })
 
+bulk_model = nsrf.model(
+    'Referential Bulk',
+    {
+        'ids': fields.List(fields.Integer),
+    })
+
+referential_columns = ('name', 'description', 'srid', 'sensor')
+
 
 transfo_model = nsrf.model(
     'Transfo Model',
@@ -42,10 +52,17 @@ transfo_model = nsrf.model(
 @nsrf.route('/', endpoint='referentials')
 class Referential(Resource):
 
+    tables = ('referential',)
+    invalidates = ('platforms',)
+
     @nsrf.marshal_with(referential_model)
+    @ids_batch('referential', referential_model)
     def get(self):
         '''List Referentials'''
-        return Database.query_asjson("select * from li3ds.referential")
+        return Database.query_asjson(
+            sql.SQL("select {} from li3ds.referential")
+            .format(select_fields(referential_model))
+        )
 
     @api.secure
     @nsrf.expect(referential_model_post)
@@ -61,15 +78,42 @@ class Referential(Resource):
         ), 201
 
 
+@nsrf.route('/bulk/', endpoint='referentials_bulk')
+class ReferentialBulk(Resource):
+
+    invalidates = ('platforms',)
+
+    @api.secure
+    @nsrf.expect([referential_model_post])
+    @nsrf.marshal_with(bulk_model)
+    @nsrf.param(ON_CONFLICT_PARAM, 'update existing referentials with the same '
+                'name and sensor', enum=['update'])
+    @nsrf.response(201, 'Referentials created')
+    def post(self):
+        '''Create or update many referentials
+
+        Returns identifiers in payload order.
+        '''
+        ids = bulk_insert(
+            'referential', referential_columns, bulk_payload(),
+            conflict=('name', 'sensor') if conflict_update() else None
+        )
+        return {'ids': ids}, 201
+
+
 @nsrf.route('/<int:id>/', endpoint='referential')
 @nsrf.response(404, 'Referential not found')
 class OneReferential(Resource):
 
+    tables = ('referential',)
+    invalidates = ('platforms',)
+
     @nsrf.marshal_with(referential_model)
     def get(self, id):
         '''Get one referential given its identifier'''
         res = Database.query_asjson(
-            "select * from li3ds.referential where id=%s", (id,)
+            sql.SQL("select {} from li3ds.referential where id=%s")
+            .format(select_fields(referential_model)), (id,)
         )
         if not res:
             nsrf.abort(404, 'Referential not found')
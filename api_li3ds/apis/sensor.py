@@ -1,7 +1,8 @@
 # -*- coding: utf-8 -*-
 from flask_restplus import fields
+from psycopg2 import sql
 
-from api_li3ds.app import api, Resource, defaultpayload
+from api_li3ds.app import api, Resource, defaultpayload, select_fields, ids_batch
 from api_li3ds.database import Database
 
 
@@ -32,10 +33,17 @@ sensor_model = nssensor.inherit(
 @nssensor.route('/', endpoint='sensors')
 class Sensors(Resource):
 
+    tables = ('sensor',)
+    invalidates = ('platforms',)
+    coalesce = True
+
     @nssensor.marshal_with(sensor_model)
+    @ids_batch('sensor', sensor_model)
     def get(self):
         '''List sensors'''
-        return Database.query_asjson("select * from li3ds.sensor")
+        return Database.query_asjson(
+            sql.SQL("select {} from li3ds.sensor").format(select_fields(sensor_model))
+        )
 
     @api.secure
     @nssensor.expect(sensor_model_post)
@@ -59,11 +67,15 @@ class Sensors(Resource):
 @nssensor.response(404, 'Sensor not found')
 class OneSensor(Resource):
 
+    tables = ('sensor',)
+    invalidates = ('platforms',)
+
     @nssensor.marshal_with(sensor_model)
     def get(self, id):
         '''Get one sensor given its identifier'''
         res = Database.query_asjson(
-            "select * from li3ds.sensor where id=%s", (id,)
+            sql.SQL("select {} from li3ds.sensor where id=%s")
+            .format(select_fields(sensor_model)), (id,)
         )
         if not res:
             nssensor.abort(404, 'sensor not found')
@@ -82,6 +94,9 @@ class OneSensor(Resource):
 @nssensor.route('/types/', endpoint='sensor_types')
 class Sensor_types(Resource):
 
+    cache_ttl = 300
+    cost = 'light'
+
     def get(self):
         '''Sensor type list'''
         return Database.query_aslist(
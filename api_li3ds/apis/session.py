@@ -1,10 +1,14 @@
 # -*- coding: utf-8 -*-
 from flask_restplus import fields
+from psycopg2 import sql
 
-from api_li3ds.app import api, Resource, defaultpayload
+from api_li3ds.app import api, Resource, defaultpayload, select_fields, ids_batch
 from api_li3ds.database import Database
 from api_li3ds import fields as li3ds_fields
-from .datasource import datasource_model
+from api_li3ds.expand import Relation, expandable
+from api_li3ds import shards
+from .datasource import datasource_model, datasource_relations
+from .platform import platform_model
 
 nssession = api.namespace('sessions', description='sessions related operations')
 
@@ -21,19 +25,29 @@ session_model = nssession.inherit('Session Model', session_model_post, {
     'id': fields.Integer,
 })
 
+session_relations = {
+    'datasources': Relation('datasource', 'session', datasource_model, datasource_relations),
+}
+
 
 @nssession.route('/', endpoint='sessions')
 class AllSessions(Resource):
 
+    tables = ('session', 'datasource', 'processing')
+
+    @expandable(session_relations)
     @nssession.marshal_with(session_model)
+    @ids_batch('session', session_model)
     def get(self):
         '''Get all sessions'''
-        return Database.query_asjson("select * from li3ds.session")
+        query = sql.SQL("select {} from li3ds.session").format(select_fields(session_model))
+        return shards.fanout(lambda: Database.query_asjson(query))
 
     @api.secure
     @nssession.expect(session_model_post)
     @nssession.marshal_with(session_model)
     @nssession.response(201, 'Session created')
+    @shards.routed(shards.by_payload('project'))
     def post(self):
         '''Create a session'''
         return Database.query_asdict(
@@ -48,15 +62,21 @@ class AllSessions(Resource):
 @nssession.response(404, 'Session not found')
 class OneSession(Resource):
 
+    tables = ('session', 'datasource', 'processing')
+
+    @expandable(session_relations)
     @nssession.marshal_with(session_model)
+    @shards.routed(shards.by_id)
     def get(self, id):
         '''Get one session given its identifier'''
         return Database.query_asjson(
-            "select * from li3ds.session where id=%s", (id,)
+            sql.SQL("select {} from li3ds.session where id=%s")
+            .format(select_fields(session_model)), (id,)
         )
 
     @api.secure
     @nssession.response(410, 'Session deleted')
+    @shards.routed(shards.by_id)
     def delete(self, id):
         '''Delete a session given its identifier'''
         res = Database.rowcount("delete from li3ds.session where id=%s", (id,))
@@ -69,24 +89,31 @@ class OneSession(Resource):
 @nssession.param('id', 'The session identifier')
 class Platform(Resource):
 
-    @nssession.marshal_with(session_model)
+    tables = ('session', 'platform')
+
+    @nssession.marshal_with(platform_model)
+    @shards.routed(shards.by_id)
     def get(self, id):
         '''Get the platform used by the given session'''
         return Database.query_asjson(
-            """select p.* from li3ds.platform p
+            sql.SQL("""select {} from li3ds.platform p
             join li3ds.session s on s.platform = p.id where s.id=%s
-            """, (id,)
+            """).format(select_fields(platform_model, 'p')), (id,)
         )
 
 
 @nssession.route('/<int:id>/datasources/', endpoint='session_datasources')
-class Datasources(Resource):
+class SessionDatasources(Resource):
+
+    tables = ('session', 'datasource', 'processing')
 
+    @expandable(datasource_relations)
     @nssession.marshal_with(datasource_model)
+    @shards.routed(shards.by_id)
     def get(self, id):
         '''List session datasources'''
         return Database.query_asjson(
-            """select d.* from li3ds.session s
+            sql.SQL("""select {} from li3ds.session s
             join li3ds.datasource d on d.session = s.id
             where s.id = %s
-            """, (id,))
+            """).format(select_fields(datasource_model, 'd')), (id,))
@@ -1,8 +1,10 @@
 # -*- coding: utf-8 -*-
 from flask_restplus import fields
+from psycopg2 import sql
 from psycopg2.extras import Json
 
-from api_li3ds.app import api, Resource, defaultpayload
+from api_li3ds.app import api, Resource, defaultpayload, select_fields, ids_batch
+from api_li3ds.app import bulk_insert, bulk_payload, conflict_update, ON_CONFLICT_PARAM
 from api_li3ds.database import Database
 from api_li3ds import fields as li3ds_fields
 
@@ -31,6 +33,17 @@ transfo_model = nstf.inherit(
         'id': fields.Integer
     })
 
+bulk_model = nstf.model(
+    'Transformation Bulk',
+    {
+        'ids': fields.List(fields.Integer),
+    })
+
+transfo_columns = (
+    'name', 'source', 'target', 'transfo_type', 'description', 'parameters',
+    'parameters_column', 'tdate', 'validity_start', 'validity_end'
+)
+
 
 transfotype_model_post = nstf.model(
     'Transformation type Model Post',
@@ -51,10 +64,16 @@ transfotype_model = nstf.inherit(
 @nstf.route('/', endpoint='transfos')
 class Transfo(Resource):
 
+    tables = ('transfo',)
+    invalidates = ('platforms',)
+
     @nstf.marshal_with(transfo_model)
+    @ids_batch('transfo', transfo_model)
     def get(self):
         '''List all transformations'''
-        return Database.query_asjson("select * from li3ds.transfo")
+        return Database.query_asjson(
+            sql.SQL("select {} from li3ds.transfo").format(select_fields(transfo_model))
+        )
 
     @api.secure
     @nstf.expect(transfo_model_post)
@@ -77,15 +96,46 @@ class Transfo(Resource):
         ), 201
 
 
+@nstf.route('/bulk/', endpoint='transfos_bulk')
+class TransfoBulk(Resource):
+
+    invalidates = ('platforms',)
+
+    @api.secure
+    @nstf.expect([transfo_model_post])
+    @nstf.marshal_with(bulk_model)
+    @nstf.param(ON_CONFLICT_PARAM, 'update existing transformations with the same '
+                'source, target and tdate', enum=['update'])
+    @nstf.response(201, 'Transformations created')
+    def post(self):
+        '''Create or update many transformations
+
+        Returns identifiers in payload order.
+        '''
+        transfos = [
+            dict(transfo, parameters=Json(transfo.get('parameters')))
+            for transfo in bulk_payload()
+        ]
+        ids = bulk_insert(
+            'transfo', transfo_columns, transfos,
+            conflict=('source', 'target', 'tdate') if conflict_update() else None
+        )
+        return {'ids': ids}, 201
+
+
 @nstf.route('/<int:id>/', endpoint='transfo')
 @nstf.response(404, 'Transformation not found')
 class OneTransfo(Resource):
 
+    tables = ('transfo',)
+    invalidates = ('platforms',)
+
     @nstf.marshal_with(transfo_model)
     def get(self, id):
         '''Get one transformation given its identifier'''
         res = Database.query_asjson(
-            "select * from li3ds.transfo where id=%s", (id,)
+            sql.SQL("select {} from li3ds.transfo where id=%s")
+            .format(select_fields(transfo_model)), (id,)
         )
         if not res:
             nstf.abort(404, 'Transformation not found')
@@ -104,10 +154,18 @@ class OneTransfo(Resource):
 @nstf.route('/types/', endpoint='transfotypes')
 class TransfoType(Resource):
 
+    tables = ('transfo_type',)
+    cache_ttl = 300
+    cost = {'GET': 'light'}
+
     @nstf.marshal_with(transfotype_model)
+    @ids_batch('transfo_type', transfotype_model)
     def get(self):
         '''List all transformation types'''
-        return Database.query_asjson("select * from li3ds.transfo_type")
+        return Database.query_asjson(
+            sql.SQL("select {} from li3ds.transfo_type")
+            .format(select_fields(transfotype_model))
+        )
 
     @api.secure
     @nstf.expect(transfotype_model_post)
@@ -129,11 +187,14 @@ class TransfoType(Resource):
 @nstf.response(404, 'Transformation type not found')
 class OneTransfoType(Resource):
 
+    tables = ('transfo_type',)
+
     @nstf.marshal_with(transfotype_model)
     def get(self, id):
         '''Get one transformation type given its identifier'''
         res = Database.query_asjson(
-            "select * from li3ds.transfo_type where id=%s", (id,)
+            sql.SQL("select {} from li3ds.transfo_type where id=%s")
+            .format(select_fields(transfotype_model)), (id,)
         )
         if not res:
             nstf.abort(404, 'Transformation type not found')
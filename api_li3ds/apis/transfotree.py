@@ -1,8 +1,9 @@
 # -*- coding: utf-8 -*-
 from flask import make_response
 from flask_restplus import fields
+from psycopg2 import sql
 
-from api_li3ds.app import api, Resource, defaultpayload
+from api_li3ds.app import api, Resource, defaultpayload, select_fields, ids_batch
 from api_li3ds.database import Database
 from api_li3ds import dot
 
@@ -27,10 +28,17 @@ transfotree_model = nstft.inherit(
 @nstft.route('/', endpoint='transfotrees')
 class TransfoTree(Resource):
 
+    tables = ('transfo_tree',)
+    invalidates = ('platforms',)
+
     @nstft.marshal_with(transfotree_model)
+    @ids_batch('transfo_tree', transfotree_model)
     def get(self):
         '''List all transformation trees'''
-        return Database.query_asjson("select * from li3ds.transfo_tree")
+        return Database.query_asjson(
+            sql.SQL("select {} from li3ds.transfo_tree")
+            .format(select_fields(transfotree_model))
+        )
 
     @api.secure
     @nstft.expect(transfotree_model_post)
@@ -52,11 +60,15 @@ class TransfoTree(Resource):
 @nstft.response(404, 'Transformation tree not found')
 class OneTransfoTree(Resource):
 
+    tables = ('transfo_tree',)
+    invalidates = ('platforms',)
+
     @nstft.marshal_with(transfotree_model)
     def get(self, id):
         '''Get one transformation given its identifier'''
         res = Database.query_asjson(
-            "select * from li3ds.transfo_tree where id=%s", (id,)
+            sql.SQL("select {} from li3ds.transfo_tree where id=%s")
+            .format(select_fields(transfotree_model)), (id,)
         )
         if not res:
             nstft.abort(404, 'Transformation tree not found')
@@ -76,6 +88,8 @@ class OneTransfoTree(Resource):
 @nstft.param('id', 'The platform config identifier')
 class TransfoTreeDot(Resource):
 
+    tables = ('transfo_tree', 'transfo', 'transfo_type', 'referential', 'sensor')
+
     def get(self, id):
         '''Get a preview for this transfo tree as dot
 
@@ -96,6 +110,9 @@ class TransfoTreeDot(Resource):
 @nstft.param('id', 'The platform config identifier')
 class TransfoTreePreview(Resource):
 
+    tables = ('transfo_tree', 'transfo', 'transfo_type', 'referential', 'sensor')
+    cost = 'heavy'
+
     def get(self, id):
         '''Get a preview for this transfo tree as png
 
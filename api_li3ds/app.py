@@ -1,18 +1,238 @@
 # -*- coding: utf-8 -*-
+import time
+import hashlib
 from functools import wraps
-from collections import defaultdict
+from collections import OrderedDict, defaultdict
 
 from flask import request, current_app
-from flask_restplus import Api, Resource as OrigResource
+from flask_restplus import Api, Namespace, Resource as OrigResource
+from flask_restplus import marshal_with as orig_marshal_with
+from flask_restplus.model import ModelBase
+from flask_restplus.utils import merge, unpack
+from psycopg2 import sql, ProgrammingError
+from werkzeug.http import dump_cookie
+from werkzeug.wrappers import BaseResponse
 
-from api_li3ds.exc import pgexceptions
+from api_li3ds.admission import admission, cost_class, Overloaded
+from api_li3ds.cache import cache, freeze, thaw
+from api_li3ds.changes import table_versions
+from api_li3ds.database import Database
+from api_li3ds.exc import pgexceptions, abort
+from api_li3ds.serializer import marshal, serializer
+from api_li3ds.singleflight import coalesce
+from api_li3ds import ratelimit, shards, specs
+from api_li3ds.validation import validate_payload
 
 HEADER_API_KEY = 'X-API-KEY'
 
+# query parameter used to restrict returned fields
+FIELDS_PARAM = 'fields'
+
+# query parameter used to fetch several items at once
+IDS_PARAM = 'ids'
+
+# response header listing requested ids that were not found
+MISSING_IDS_HEADER = 'X-Missing-Ids'
+
+# default maximum number of ids fetched in one request
+MAX_BATCH_IDS = 1000
+
+# query parameter used to update existing rows on bulk insertion
+ON_CONFLICT_PARAM = 'on_conflict'
+
+# no unique index matching the on conflict columns
+INVALID_COLUMN_REFERENCE = '42P10'
+
+# cookie set on writes, the client reads from the primary database until
+# it expires (when replicas are configured)
+PRIMARY_COOKIE = 'li3ds_primary'
+
+# default seconds during which a client reads from the primary after a write
+DB_PRIMARY_AFTER_WRITE = 5
+
+# wsgi environ key of batch sub-requests: set of namespaces whose cache is
+# invalidated once the batch is committed
+SUBREQUEST_KEY = 'api_li3ds.invalidated'
+
+
+def add_headers(resp, headers):
+    """Add headers to a resource method result
+    """
+    if isinstance(resp, BaseResponse):
+        resp.headers.extend(headers)
+        return resp
+    data, code, orig_headers = unpack(resp)
+    merged = dict(orig_headers or {})
+    merged.update(headers)
+    return data, code, merged
+
+
+def resource_etag(tables):
+    """Compute the etag of the current request from versions of the tables
+    it reads, None if versions are not available
+    """
+    versions = shards.versions(table_versions, tables)
+    if versions is None:
+        return None
+    key = (
+        request.path,
+        sorted(request.args.items(multi=True)),
+        request.headers.get(current_app.config['RESTPLUS_MASK_HEADER']),
+        versions,
+    )
+    return hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+
+
+def recent_writer():
+    """Return True if the client of the current request wrote recently
+    """
+    try:
+        return float(request.cookies.get(PRIMARY_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+def primary_cookie():
+    """Header setting the cookie asking next reads of the client to use
+    the primary database
+    """
+    window = current_app.config.get('DB_PRIMARY_AFTER_WRITE', DB_PRIMARY_AFTER_WRITE)
+    return {'Set-Cookie': dump_cookie(
+        PRIMARY_COOKIE, '{:.3f}'.format(time.time() + window), max_age=window, httponly=True)}
+
+
+def status_code(resp):
+    """Return the status code of a resource method result
+    """
+    if isinstance(resp, BaseResponse):
+        return resp.status_code
+    return unpack(resp)[1]
+
 
 class Resource(OrigResource):
     # add a postgresql exception decorator for all api methods
     method_decorators = [pgexceptions]
+    # li3ds tables read by get requests, used to compute etags
+    tables = ()
+    # seconds during which get responses are cached, None to disable
+    # (overriden by endpoint with the CACHE_TTL setting)
+    cache_ttl = None
+    # namespace of the resource, set when registered
+    namespace = None
+    # other namespaces whose cache is invalidated by writes on this resource
+    invalidates = ()
+    # share get responses between identical concurrent requests,
+    # always done for cached resources
+    coalesce = False
+    # get requests may read from a replica database
+    read_replica = True
+    # milliseconds a query may run, None for the STATEMENT_TIMEOUT setting
+    # (overriden by endpoint with the STATEMENT_TIMEOUTS setting)
+    statement_timeout = None
+    # admission control class (light, normal or heavy), or a dict of
+    # classes by http method (overriden by endpoint with ADMISSION_COSTS)
+    cost = 'normal'
+
+    def dispatch_request(self, *args, **kwargs):
+        invalidated = request.environ.get(SUBREQUEST_KEY)
+        if invalidated is not None:
+            return self.dispatch_subrequest(invalidated, *args, **kwargs)
+        limit = ratelimit.check(request.headers.get(HEADER_API_KEY))
+        if limit is not None and not limit.allowed:
+            return {'message': 'rate limit exceeded'}, 429, limit.headers
+        try:
+            resp = self.dispatch_routed(*args, **kwargs)
+        except Overloaded as exc:
+            current_app.logger.warning('{} rejected: {}'.format(request.path, exc))
+            return {'message': str(exc)}, 503, {'Retry-After': str(exc.retry_after)}
+        if limit is not None:
+            resp = add_headers(resp, limit.headers)
+        return resp
+
+    def dispatch_routed(self, *args, **kwargs):
+        if request.method in ('GET', 'HEAD'):
+            if not self.read_replica or recent_writer():
+                with Database.primary():
+                    return self.dispatch_get(*args, **kwargs)
+            with Database.read_replica():
+                return self.dispatch_get(*args, **kwargs)
+
+        # writes always go to the primary
+        with Database.primary():
+            resp = self.dispatch_admitted(*args, **kwargs)
+        if status_code(resp) < 400:
+            for namespace in (self.namespace,) + tuple(self.invalidates):
+                cache.invalidate(namespace)
+            if Database.replicas:
+                resp = add_headers(resp, primary_cookie())
+        return resp
+
+    def dispatch_admitted(self, *args, **kwargs):
+        '''Run the resource method once admitted in its cost class'''
+        with admission.admit(cost_class(self)):
+            return super().dispatch_request(*args, **kwargs)
+
+    def dispatch_subrequest(self, invalidated, *args, **kwargs):
+        '''Run a sub-request in the transaction of its batch, already counted
+        and admitted, without cache nor shared results which could hold
+        uncommitted rows'''
+        resp = super().dispatch_request(*args, **kwargs)
+        if request.method not in ('GET', 'HEAD') and status_code(resp) < 400:
+            invalidated.update((self.namespace,) + tuple(self.invalidates))
+        return resp
+
+    def validate_payload(self, func):
+        '''Validate the payload against expected models with cached validators'''
+        doc = getattr(func, '__apidoc__', None)
+        if not doc:
+            return
+        validate = doc.get('validate')
+        if not (validate if validate is not None else self.api._validate):
+            return
+        for expect in doc.get('expect', []):
+            if isinstance(expect, list) and len(expect) == 1 and \
+                    isinstance(expect[0], ModelBase):
+                validate_payload(expect[0], self.api, collection=True)
+            elif isinstance(expect, ModelBase):
+                validate_payload(expect, self.api)
+
+    def dispatch_get(self, *args, **kwargs):
+        etag = None
+        if self.tables:
+            etag = pgexceptions(resource_etag)(self.tables)
+            if etag is not None and etag in request.if_none_match:
+                # answer before any row is fetched
+                response = current_app.response_class(status=304)
+                response.set_etag(etag)
+                return response
+
+        ttl = current_app.config.get('CACHE_TTL', {}).get(request.endpoint, self.cache_ttl)
+        if ttl or self.coalesce:
+            key = (
+                request.endpoint,
+                tuple(sorted(request.view_args.items())),
+                tuple(sorted(request.args.items(multi=True))),
+                request.headers.get(current_app.config['RESTPLUS_MASK_HEADER']),
+                etag,
+            )
+            resp = cache.get(key) if ttl else None
+            if resp is None:
+                resp = coalesce(key, lambda: self.compute_get(key, ttl, args, kwargs))
+            resp = thaw(resp)
+        else:
+            resp = self.dispatch_admitted(*args, **kwargs)
+
+        if etag is None:
+            return resp
+        return add_headers(resp, {'ETag': '"{}"'.format(etag)})
+
+    def compute_get(self, key, ttl, args, kwargs):
+        '''Run the get method and cache its result'''
+        resp = self.dispatch_admitted(*args, **kwargs)
+        frozen = freeze(resp)
+        if ttl and status_code(resp) == 200:
+            cache.set(key, frozen, ttl, self.namespace)
+        return frozen
 
 
 def defaultpayload(payload):
@@ -24,11 +244,236 @@ def defaultpayload(payload):
     return newpayload
 
 
+def model_fields(model):
+    """Return field names of a model, including inherited ones
+    """
+    names = list(model.keys())
+    for parent in getattr(model, '__parents__', []):
+        names.extend(name for name in model_fields(parent) if name not in names)
+    return names
+
+
+def field_names():
+    """Return field names asked with the ``fields`` query parameter, stripped,
+    or None if all fields are requested.
+    """
+    if not request.args.get(FIELDS_PARAM):
+        return None
+    return [
+        name.strip() for name in request.args[FIELDS_PARAM].split(',')
+        if name.strip()
+    ]
+
+
+def requested_fields(model):
+    """Return field names asked with the ``fields`` query parameter
+    or None if all fields are requested.
+
+    Aborts with a 400 if a field does not belong to the model.
+    """
+    names = field_names()
+    if names is None:
+        return None
+    available = model_fields(model)
+    unknown = [name for name in names if name not in available]
+    if unknown:
+        abort(400, 'unknown fields {}, available fields are {}'
+                   .format(unknown, available))
+    return names
+
+
+def select_fields(model, alias=None, required=()):
+    """Build the sql select list corresponding to the ``fields`` query parameter,
+    so that unneeded columns are never read from the database.
+
+    :param model: model used to validate requested fields
+    :param alias: table alias used to qualify columns
+    :param required: columns always selected
+    :returns: a composable sql object
+    """
+    names = requested_fields(model)
+    if names is not None:
+        names = [name for name in required if name not in names] + names
+    if names is None:
+        if alias:
+            return sql.SQL('{}.*').format(sql.Identifier(alias))
+        return sql.SQL('*')
+    if alias:
+        return sql.SQL(', ').join(
+            sql.SQL('{}.{}').format(sql.Identifier(alias), sql.Identifier(name))
+            for name in names
+        )
+    return sql.SQL(', ').join(sql.Identifier(name) for name in names)
+
+
+def requested_ids():
+    """Return identifiers asked with the ``ids`` query parameter, without duplicates,
+    or None if the parameter is not given.
+
+    Aborts with a 400 on invalid identifiers or if there are more than
+    ``MAX_BATCH_IDS`` identifiers.
+    """
+    if IDS_PARAM not in request.args:
+        return None
+    values = request.args[IDS_PARAM].split(',')
+    maximum = current_app.config.get('MAX_BATCH_IDS', MAX_BATCH_IDS)
+    if len(values) > maximum:
+        abort(400, 'too many identifiers (maximum is {})'.format(maximum))
+    ids = []
+    for value in values:
+        try:
+            ids.append(int(value))
+        except ValueError:
+            abort(400, 'invalid identifier {!r}'.format(value))
+    return list(OrderedDict.fromkeys(ids))
+
+
+def ids_batch(table, model):
+    """Decorator fetching all items of li3ds ``table`` given in the ``ids``
+    query parameter in one query.
+
+    Items are returned in request order, missing ones are listed in
+    the ``X-Missing-Ids`` response header. Must be placed below ``marshal_with``.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            ids = requested_ids()
+            if ids is None:
+                return func(*args, **kwargs)
+            query = sql.SQL("select {} from li3ds.{} where id = ANY(%s)").format(
+                select_fields(model, required=('id',)), sql.Identifier(table))
+            if table in shards.SHARDED_TABLES:
+                rows = shards.by_ids(ids, lambda ids: Database.query_asjson(query, (ids,)))
+            else:
+                rows = Database.query_asjson(query, (ids,))
+            rows = {row['id']: row for row in rows}
+            missing = [str(id) for id in ids if id not in rows]
+            return [rows[id] for id in ids if id in rows], 200, \
+                {MISSING_IDS_HEADER: ','.join(missing)}
+
+        wrapper.__apidoc__ = merge(getattr(func, '__apidoc__', {}), {
+            'params': {
+                IDS_PARAM: {
+                    'in': 'query',
+                    'type': 'string',
+                    'description': 'comma separated list of identifiers to fetch'
+                }
+            }
+        })
+        return wrapper
+    return decorator
+
+
+def bulk_payload():
+    """Return items posted to a bulk endpoint.
+
+    Aborts with a 400 if the payload is not a list of objects.
+    """
+    payload = request.get_json()
+    if not isinstance(payload, list) or \
+            not all(isinstance(item, dict) for item in payload):
+        abort(400, 'payload must be a list of objects')
+    return payload
+
+
+def conflict_update():
+    """Return True if existing rows must be updated on bulk insertion
+    (``on_conflict=update`` query parameter)
+    """
+    on_conflict = request.args.get(ON_CONFLICT_PARAM)
+    if on_conflict not in (None, 'update'):
+        abort(400, '{} only accepts "update"'.format(ON_CONFLICT_PARAM))
+    return on_conflict == 'update'
+
+
+def bulk_insert(table, columns, items, conflict=None):
+    """Insert items in a li3ds table in one transaction (on the current shard)
+    and return created identifiers in items order.
+
+    Aborts with a 400 if no unique index matches the conflict columns.
+    """
+    try:
+        with Database.transaction():
+            return Database.insert_values(table, columns, items, conflict=conflict)
+    except ProgrammingError as exc:
+        if exc.pgcode != INVALID_COLUMN_REFERENCE:
+            raise
+        abort(400, '{}=update needs an unique index on {} ({})'.format(
+            ON_CONFLICT_PARAM, table, ', '.join(conflict)))
+
+
+class marshal_with(orig_marshal_with):
+    """Marshalling decorator also using the ``fields`` query parameter as a mask,
+    with a serializer compiled when the decorator is applied
+    """
+    def __init__(self, fields, envelope=None, mask=None):
+        super().__init__(fields, envelope, mask)
+        serializer(fields)
+
+    def __call__(self, f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            resp = f(*args, **kwargs)
+            mask_header = current_app.config['RESTPLUS_MASK_HEADER']
+            mask = request.args.get(FIELDS_PARAM) or request.headers.get(mask_header)
+            mask = mask or self.mask
+            if isinstance(resp, tuple):
+                data, code, headers = unpack(resp)
+                return marshal(data, self.fields, self.envelope, mask), code, headers
+            return marshal(resp, self.fields, self.envelope, mask)
+        return wrapper
+
+
+class Li3dsNamespace(Namespace):
+
+    def add_resource(self, resource, *urls, **kwargs):
+        resource.namespace = self.name
+        super().add_resource(resource, *urls, **kwargs)
+
+    def marshal_with(self, fields, as_list=False, code=200, description=None, **kwargs):
+        """
+        A decorator specifying the fields to use for serialization,
+        documenting the ``fields`` query parameter.
+        """
+        def wrapper(func):
+            doc = {
+                'responses': {
+                    code: (description, [fields]) if as_list else (description, fields)
+                },
+                '__mask__': kwargs.get('mask', True),
+                'params': {
+                    FIELDS_PARAM: {
+                        'in': 'query',
+                        'type': 'string',
+                        'description': 'comma separated list of fields to return'
+                    }
+                }
+            }
+            func.__apidoc__ = merge(getattr(func, '__apidoc__', {}), doc)
+            return marshal_with(fields, **kwargs)(func)
+        return wrapper
+
+
 class Li3dsApi(Api):
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
+    def namespace(self, *args, **kwargs):
+        """Namespace factory using :class:`Li3dsNamespace`
+        """
+        ns = Li3dsNamespace(*args, **kwargs)
+        self.add_namespace(ns)
+        return ns
+
+    def _register_specs(self, app_or_blueprint):
+        '''Serve swagger specifications built once, from memory'''
+        if self._add_specs:
+            app_or_blueprint.add_url_rule(
+                '/swagger.json', 'specs', lambda: specs.render(self))
+            self.endpoints.add('specs')
+
     def secure(self, func):
         '''Enforce authentication'''
 
@@ -37,8 +482,7 @@ class Li3dsApi(Api):
             if HEADER_API_KEY not in request.headers:
                 self.abort(401, '{} required'.format(HEADER_API_KEY))
             apikey = request.headers[HEADER_API_KEY]
-            if apikey != current_app.config['HEADER_API_KEY']:
-                # for now only one global api key form config file
+            if apikey not in ratelimit.api_keys():
                 self.abort(401, 'Unauthorized')
             else:
                 return func(*args, **kwargs)
@@ -70,3 +514,7 @@ def init_apis():
     from api_li3ds.apis.transfo import nstf
     from api_li3ds.apis.transfotree import nstft
     from api_li3ds.apis.foreignpc import nsfpc
+    from api_li3ds.apis.batch import nsbatch
+    from api_li3ds.apis.changes import nschanges
+    from api_li3ds.apis.monitoring import nsmonitoring
+    from api_li3ds.apis.profiles import nsprofiles
@@ -0,0 +1,110 @@
+'''
+In-memory cache of resource responses
+
+Entries are bounded in number (least recently used are evicted first),
+expire after a time to live and are invalidated by namespace.
+'''
+import time
+import threading
+from collections import OrderedDict, defaultdict
+
+from flask import current_app
+from werkzeug.wrappers import BaseResponse
+
+# default maximum number of cached responses
+CACHE_SIZE = 1000
+
+
+class LRUCache():
+    '''
+    Thread safe LRU cache with time to live and per endpoint statistics.
+
+    Keys are tuples whose first element is the endpoint name.
+    '''
+
+    def __init__(self, maxsize=CACHE_SIZE):
+        self.maxsize = maxsize
+        # key -> (expiration time, namespace, value)
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = defaultdict(int)
+        self.misses = defaultdict(int)
+
+    def get(self, key):
+        '''
+        Return the cached value for key, or None
+        '''
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self.entries[key]
+                self.misses[key[0]] += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits[key[0]] += 1
+            return entry[2]
+
+    def set(self, key, value, ttl, namespace=None):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + ttl, namespace, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, namespace):
+        '''
+        Remove all entries of a namespace
+        '''
+        with self.lock:
+            for key in [key for key, entry in self.entries.items() if entry[1] == namespace]:
+                del self.entries[key]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def after_fork(self):
+        '''
+        Start with an empty cache in a forked worker
+        '''
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.hits.clear()
+        self.misses.clear()
+
+    def stats(self):
+        '''
+        Return hit and miss counts by endpoint
+        '''
+        with self.lock:
+            return {
+                'size': len(self.entries),
+                'maxsize': self.maxsize,
+                'endpoints': {
+                    endpoint: {'hits': self.hits[endpoint], 'misses': self.misses[endpoint]}
+                    for endpoint in set(self.hits) | set(self.misses)
+                }
+            }
+
+
+def freeze(resp):
+    '''
+    Make a resource method result safe to cache
+    '''
+    if isinstance(resp, BaseResponse):
+        return (BaseResponse, resp.get_data(), resp.status_code, list(resp.headers))
+    return resp
+
+
+def thaw(value):
+    '''
+    Rebuild a resource method result from a cached value
+    '''
+    if isinstance(value, tuple) and value and value[0] is BaseResponse:
+        _, data, status, headers = value
+        return current_app.response_class(data, status=status, headers=headers)
+    return value
+
+
+cache = LRUCache()
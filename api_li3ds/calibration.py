@@ -0,0 +1,175 @@
+'''
+Import and export of a full platform calibration as a single document
+
+A calibration document contains sensors, referentials, transformation types,
+transformations, transformation trees and a platform configuration. Objects
+have a local ``key`` used by other objects to reference them, integer
+references are kept as database identifiers.
+'''
+from psycopg2.extras import Json
+
+from api_li3ds.database import Database
+from api_li3ds.exc import abort
+from api_li3ds.apis.referential import referential_columns
+from api_li3ds.apis.transfo import transfo_columns
+
+sensor_columns = (
+    'name', 'serial_number', 'brand', 'model', 'description', 'type', 'specifications')
+transfotype_columns = ('name', 'description', 'func_signature')
+transfotree_columns = ('name', 'owner', 'transfos')
+
+
+export_sql = """
+    with config as (
+        select * from li3ds.platform_config where id = %s
+    ), trees as (
+        select tt.* from li3ds.transfo_tree tt, config
+        where tt.id = ANY(config.transfo_trees)
+    ), transfos as (
+        select t.* from li3ds.transfo t
+        where t.id in (select unnest(transfos) from trees)
+    ), referentials as (
+        select r.* from li3ds.referential r
+        where r.id in (select source from transfos union select target from transfos)
+    )
+    select json_build_object(
+        'sensors', (
+            select coalesce(json_agg(s order by s.key::int), '[]') from (
+                select s.id::text as key, s.name, s.serial_number, s.brand, s.model,
+                       s.description, s.type, s.specifications
+                from li3ds.sensor s where s.id in (select sensor from referentials)
+            ) s),
+        'referentials', (
+            select coalesce(json_agg(r order by r.key::int), '[]') from (
+                select r.id::text as key, r.name, r.description, r.srid,
+                       r.sensor::text as sensor
+                from referentials r
+            ) r),
+        'transfo_types', (
+            select coalesce(json_agg(tt order by tt.key::int), '[]') from (
+                select tt.id::text as key, tt.name, tt.description, tt.func_signature
+                from li3ds.transfo_type tt
+                where tt.id in (select transfo_type from transfos)
+            ) tt),
+        'transfos', (
+            select coalesce(json_agg(t order by t.key::int), '[]') from (
+                select t.id::text as key, t.name, t.source::text as source,
+                       t.target::text as target, t.transfo_type::text as transfo_type,
+                       t.description, t.parameters, t.parameters_column,
+                       t.tdate, t.validity_start, t.validity_end
+                from transfos t
+            ) t),
+        'transfo_trees', (
+            select coalesce(json_agg(tt order by tt.key::int), '[]') from (
+                select tt.id::text as key, tt.name, tt.owner,
+                       tt.transfos::text[] as transfos
+                from trees tt
+            ) tt),
+        'platform_config', (
+            select row_to_json(c) from (
+                select c.name, c.owner, c.transfo_trees::text[] as transfo_trees
+                from config c
+            ) c)
+    )
+    from config
+"""
+
+
+def export(id):
+    '''
+    Build the calibration document of a platform configuration in one query
+    '''
+    res = Database.query_aslist(export_sql, (id,))
+    if not res:
+        return None
+    return res[0]
+
+
+def resolve(ref, ids, kind):
+    '''
+    Resolve a local reference to a database identifier
+    '''
+    if ref is None or isinstance(ref, int):
+        return ref
+    if ref not in ids:
+        abort(400, 'unknown {} reference {!r}'.format(kind, ref))
+    return ids[ref]
+
+
+def insert(table, columns, items):
+    '''
+    Insert items in a li3ds table with multi-rows statements
+
+    :returns: a mapping between items keys and created identifiers
+    '''
+    ids = Database.insert_values(table, columns, items)
+    return {
+        item['key']: id
+        for item, id in zip(items, ids) if item.get('key') is not None
+    }
+
+
+def import_(platform, document):
+    '''
+    Insert all objects of a calibration document in one transaction
+
+    Transformation types are matched by name with existing ones,
+    and only created when missing.
+
+    :returns: created identifiers by object type and local key
+    '''
+    result = {}
+
+    with Database.transaction():
+        result['sensors'] = insert('sensor', sensor_columns, document.get('sensors', []))
+
+        result['referentials'] = insert('referential', referential_columns, [
+            dict(ref, sensor=resolve(ref.get('sensor'), result['sensors'], 'sensor'))
+            for ref in document.get('referentials', [])
+        ])
+
+        transfo_types = document.get('transfo_types', [])
+        existing = dict(Database.query(
+            "select name, id from li3ds.transfo_type where name = ANY(%s)",
+            ([tt.get('name') for tt in transfo_types],)
+        ))
+        result['transfo_types'] = {
+            tt['key']: existing[tt.get('name')]
+            for tt in transfo_types
+            if tt.get('name') in existing and tt.get('key') is not None
+        }
+        result['transfo_types'].update(insert('transfo_type', transfotype_columns, [
+            tt for tt in transfo_types if tt.get('name') not in existing
+        ]))
+
+        result['transfos'] = insert('transfo', transfo_columns, [
+            dict(
+                transfo,
+                source=resolve(transfo.get('source'), result['referentials'], 'referential'),
+                target=resolve(transfo.get('target'), result['referentials'], 'referential'),
+                transfo_type=resolve(
+                    transfo.get('transfo_type'), result['transfo_types'], 'transfo_type'),
+                parameters=Json(transfo.get('parameters')),
+            )
+            for transfo in document.get('transfos', [])
+        ])
+
+        result['transfo_trees'] = insert('transfo_tree', transfotree_columns, [
+            dict(tree, transfos=[
+                resolve(tid, result['transfos'], 'transfo')
+                for tid in tree.get('transfos', [])
+            ])
+            for tree in document.get('transfo_trees', [])
+        ])
+
+        config = document['platform_config']
+        result['platform_config'] = Database.query_aslist(
+            "insert into li3ds.platform_config (name, owner, platform, transfo_trees) "
+            "values (%s, %s, %s, %s) returning id",
+            (config.get('name'), config.get('owner'), platform, [
+                resolve(tid, result['transfo_trees'], 'transfo_tree')
+                for tid in config.get('transfo_trees', [])
+            ])
+        )[0]
+
+    return result
@@ -0,0 +1,232 @@
+'''
+Change log of li3ds tables used for incremental synchronization
+
+Inserts, updates and deletes on li3ds tables are recorded by triggers in
+``li3ds.change_log`` with a monotonic sequence and the writing transaction id.
+
+The version of a table, used to compute etags without running resource
+queries, is the number of its committed changes: those in the change log and
+those removed by compactions (``li3ds.change_log_compacted``, only written by
+compactions). It needs no counter row updated by every writer, it is read in
+the snapshot of the reader like the rows, and it changes on every commit,
+whatever the order in which transactions took their sequences.
+
+Feed tokens hold transaction snapshots (``since;upto;after``): a page contains
+changes of transactions visible in ``upto`` but not in ``since``, after the
+``after`` sequence. This way changes committed late by long transactions are
+never skipped.
+
+Usage::
+
+    python -m api_li3ds.changes install
+    python -m api_li3ds.changes compact
+'''
+import argparse
+
+from psycopg2 import sql
+
+from api_li3ds.database import Database
+from api_li3ds.exc import abort
+
+# tables recording their changes
+TABLES = (
+    'project', 'session', 'datasource', 'processing', 'sensor', 'referential',
+    'transfo', 'transfo_type', 'transfo_tree', 'platform', 'platform_config',
+)
+
+# default number of changes per page
+CHANGES_PAGE_SIZE = 1000
+
+# snapshot in which no transaction is visible
+EMPTY_SNAPSHOT = '1:1:'
+
+# whether table versions are available, checked once by server dsn
+versions_installed = {}
+
+install_sql = """
+    create table if not exists li3ds.change_log (
+        seq bigserial primary key,
+        txid bigint not null default txid_current(),
+        tablename text not null,
+        op text not null,
+        row_id integer not null,
+        data jsonb,
+        changed_at timestamptz not null default now()
+    );
+
+    create index if not exists change_log_txid_idx on li3ds.change_log (txid);
+    create index if not exists change_log_row_idx on li3ds.change_log (tablename, row_id);
+    create index if not exists change_log_version_idx on li3ds.change_log (tablename, seq);
+
+    create table if not exists li3ds.change_log_compacted (
+        tablename text primary key,
+        removed bigint not null default 0
+    );
+
+    create or replace function li3ds.log_change() returns trigger as $$
+    begin
+        if tg_op = 'DELETE' then
+            insert into li3ds.change_log (tablename, op, row_id)
+            values (tg_table_name, 'delete', old.id);
+            return old;
+        end if;
+        insert into li3ds.change_log (tablename, op, row_id, data)
+        values (tg_table_name, lower(tg_op), new.id, to_jsonb(new));
+        return new;
+    end;
+    $$ language plpgsql;
+
+    create or replace function li3ds.log_truncate() returns trigger as $$
+    begin
+        insert into li3ds.change_log (tablename, op, row_id)
+        values (tg_table_name, 'truncate', 0);
+        return null;
+    end;
+    $$ language plpgsql;
+"""
+
+trigger_sql = """
+    drop trigger if exists log_change on li3ds.{table};
+    create trigger log_change after insert or update or delete on li3ds.{table}
+    for each row execute procedure li3ds.log_change();
+
+    drop trigger if exists log_truncate on li3ds.{table};
+    create trigger log_truncate after truncate on li3ds.{table}
+    for each statement execute procedure li3ds.log_truncate();
+
+    -- counters of previous versions, updated by every writer
+    drop trigger if exists bump_version on li3ds.{table};
+"""
+
+feed_sql = """
+    select seq, tablename as table, op, row_id as id, data, changed_at
+    from li3ds.change_log
+    where txid >= txid_snapshot_xmin(%(since)s::txid_snapshot)
+      and not txid_visible_in_snapshot(txid, %(since)s::txid_snapshot)
+      and txid_visible_in_snapshot(txid, %(upto)s::txid_snapshot)
+      and seq > %(after)s
+    order by seq
+    limit %(limit)s
+"""
+
+uninstall_counters_sql = """
+    drop function if exists li3ds.bump_version();
+    drop table if exists li3ds.table_version;
+"""
+
+# changes of each table in the log and removed by compactions
+versions_sql = """
+    select (select count(*) from li3ds.change_log where tablename = t),
+           (select removed from li3ds.change_log_compacted where tablename = t)
+    from unnest(%s::text[]) as t
+"""
+
+# remove changes superseded by a later committed change on the same row,
+# counting them by table so that versions never go back
+compact_sql = """
+    with removed as (
+        delete from li3ds.change_log c
+        using li3ds.change_log newer
+        where newer.tablename = c.tablename and newer.row_id = c.row_id
+          and newer.seq > c.seq
+          and newer.txid < txid_snapshot_xmin(txid_current_snapshot())
+        returning c.tablename
+    ), counted as (
+        select tablename, count(*) as removed from removed group by tablename
+    ), recorded as (
+        insert into li3ds.change_log_compacted (tablename, removed)
+        select tablename, removed from counted
+        on conflict (tablename) do update
+        set removed = li3ds.change_log_compacted.removed + excluded.removed
+    )
+    select coalesce(sum(removed), 0) from counted
+"""
+
+
+def install():
+    '''
+    Create the change log and its triggers on li3ds tables
+    '''
+    Database.rowcount(install_sql)
+    for table in TABLES:
+        Database.rowcount(sql.SQL(trigger_sql).format(table=sql.Identifier(table)))
+    Database.rowcount(uninstall_counters_sql)
+
+
+def table_versions(tables):
+    '''
+    Return versions of the given tables on the current server,
+    or None if the change log is not installed there
+    '''
+    dsn = Database.current_dsn()
+    installed = versions_installed.get(dsn)
+    if installed is None:
+        installed = versions_installed[dsn] = Database.query_aslist(
+            "select to_regclass('li3ds.change_log_compacted') is not null")[0]
+    if not installed:
+        return None
+    return [
+        logged + (removed or 0)
+        for logged, removed in Database.query(versions_sql, (list(tables),))
+    ]
+
+
+def compact():
+    '''
+    Keep only the last change of each row
+
+    :returns: the number of removed changes
+    '''
+    return int(Database.query_aslist(compact_sql)[0])
+
+
+def parse_token(token):
+    '''
+    Split a feed token in (since, upto, after)
+    '''
+    parts = token.split(';')
+    if len(parts) != 3 or not parts[2].isdigit():
+        abort(400, 'invalid token {!r}'.format(token))
+    return parts[0], parts[1] or None, int(parts[2])
+
+
+def feed(token=None, limit=CHANGES_PAGE_SIZE):
+    '''
+    Return a page of changes following the given token
+
+    :returns: a dict with changes, the next token and if more changes are available
+    '''
+    since, upto, after = parse_token(token) if token else (EMPTY_SNAPSHOT, None, 0)
+    if upto is None:
+        upto = Database.query_aslist("select txid_current_snapshot()::text")[0]
+
+    changes = Database.query_asjson(feed_sql, {
+        'since': since, 'upto': upto, 'after': after, 'limit': limit + 1
+    })
+    more = len(changes) > limit
+    if more:
+        changes = changes[:limit]
+        token = '{};{};{}'.format(since, upto, changes[-1]['seq'])
+    else:
+        token = '{};;0'.format(upto)
+    return {'changes': changes, 'next': token, 'more': more}
+
+
+def main():
+    from api_li3ds import create_app
+
+    parser = argparse.ArgumentParser(description='Manage the li3ds change log')
+    parser.add_argument('command', choices=('install', 'compact'))
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        if args.command == 'install':
+            install()
+            print('change log installed on {}'.format(', '.join(TABLES)))
+        else:
+            print('{} changes removed'.format(compact()))
+
+
+if __name__ == '__main__':
+    main()
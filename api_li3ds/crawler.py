@@ -0,0 +1,212 @@
+'''
+Parallel crawler registering acquisition files as datasources
+
+Directories are listed concurrently by a thread pool, recognized files are
+loaded in ``li3ds.datasource`` with COPY. File size and modification time
+are stored in datasource parameters so that rescans only register
+new files and update modified ones in place, keeping their identifiers.
+
+Usage::
+
+    python -m api_li3ds.crawler /data/campaign --session 1 --referential 3
+'''
+import os
+import re
+import stat
+import struct
+import argparse
+import datetime
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from api_li3ds.database import Database
+
+# default number of threads listing directories
+CRAWLER_WORKERS = 8
+
+# known file layouts and corresponding datasource type
+LAYOUTS = [
+    (re.compile(r'.*\.(jpe?g|tiff?|png)$', re.I), 'image'),
+    (re.compile(r'.*\.(las|laz|ply|pcd)$', re.I), 'pointcloud'),
+    (re.compile(r'.*\.(sbet|out)$', re.I), 'trajectory'),
+    (re.compile(r'.*\.bag$', re.I), 'rosbag'),
+]
+
+# capture start time as in LANDINS_20170516_075157_PP
+CAPTURE_START = re.compile(r'_(\d{8})_(\d{6})')
+
+# LAS public header: signature, then bounds at offset 179
+# (max x, min x, max y, min y, max z, min z)
+LAS_SIGNATURE = b'LASF'
+LAS_BOUNDS = struct.Struct('<6d')
+LAS_BOUNDS_OFFSET = 179
+
+columns = ('uri', 'type', 'parameters', 'bounds', 'capture_start', 'referential', 'session')
+
+# modified datasources are updated from a values list, typed explicitly
+# as a null first row would otherwise type its column as text
+UPDATE_TEMPLATE = '(%s, %s, %s::jsonb, %s::float8[], %s::timestamptz)'
+
+
+def datasource_type(name):
+    '''
+    Return the datasource type of a file given its name, None if unknown
+    '''
+    for pattern, dstype in LAYOUTS:
+        if pattern.match(name):
+            return dstype
+    return None
+
+
+def capture_start(name):
+    '''
+    Extract the capture start time (UTC) from a file name
+    '''
+    match = CAPTURE_START.search(name)
+    if not match:
+        return None
+    try:
+        return datetime.datetime.strptime(
+            ''.join(match.groups()), '%Y%m%d%H%M%S'
+        ).replace(tzinfo=datetime.timezone.utc)
+    except ValueError:
+        return None
+
+
+def las_bounds(path):
+    '''
+    Read bounds from a LAS/LAZ header as [xmin, ymin, zmin, xmax, ymax, zmax]
+    '''
+    try:
+        with open(path, 'rb') as f:
+            header = f.read(LAS_BOUNDS_OFFSET + LAS_BOUNDS.size)
+    except OSError:
+        return None
+    if not header.startswith(LAS_SIGNATURE) or \
+            len(header) < LAS_BOUNDS_OFFSET + LAS_BOUNDS.size:
+        return None
+    xmax, xmin, ymax, ymin, zmax, zmin = LAS_BOUNDS.unpack_from(header, LAS_BOUNDS_OFFSET)
+    return [xmin, ymin, zmin, xmax, ymax, zmax]
+
+
+def scan(directory):
+    '''
+    List a directory
+
+    :returns: a tuple (recognized files, subdirectories)
+    '''
+    files, subdirs = [], []
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return files, subdirs
+
+    for name in names:
+        path = os.path.join(directory, name)
+        try:
+            st = os.lstat(path)
+        except OSError:
+            continue
+        if stat.S_ISDIR(st.st_mode):
+            subdirs.append(path)
+            continue
+        dstype = datasource_type(name)
+        if not stat.S_ISREG(st.st_mode) or not dstype:
+            continue
+        files.append({
+            'uri': 'file://' + path,
+            'type': dstype,
+            'size': st.st_size,
+            'mtime': st.st_mtime_ns,
+            'capture_start': capture_start(name),
+            'bounds': las_bounds(path) if path.lower().endswith(('.las', '.laz')) else None,
+        })
+    return files, subdirs
+
+
+def crawl(root, workers=CRAWLER_WORKERS):
+    '''
+    Walk a directory tree listing directories in parallel,
+    yields recognized files
+    '''
+    with ThreadPoolExecutor(workers) as pool:
+        pending = {pool.submit(scan, os.path.abspath(root))}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                files, subdirs = future.result()
+                for f in files:
+                    yield f
+                pending.update(pool.submit(scan, subdir) for subdir in subdirs)
+
+
+def register(root, session, referential, workers=CRAWLER_WORKERS):
+    '''
+    Register files found under root as datasources of the given
+    session and referential. Files already registered with the
+    same size and modification time are skipped, modified ones
+    are updated (keeping their identifier, referenced by processings).
+
+    :returns: counts of inserted, updated and skipped files
+    '''
+    existing = {
+        row.uri: (row.id, row.size, row.mtime)
+        for row in Database.query(
+            "select id, uri, (parameters->>'size')::bigint as size, "
+            "(parameters->>'mtime')::bigint as mtime "
+            "from li3ds.datasource where session = %s and referential = %s",
+            (session, referential)
+        )
+    }
+
+    rows, modified, skipped = [], [], 0
+    for f in crawl(root, workers):
+        parameters = {'size': f['size'], 'mtime': f['mtime']}
+        known = existing.get(f['uri'])
+        if known:
+            if known[1:] == (f['size'], f['mtime']):
+                skipped += 1
+                continue
+            modified.append((known[0], f['uri'], parameters, f['bounds'], f['capture_start']))
+            continue
+        rows.append((
+            f['uri'], f['type'], parameters,
+            f['bounds'], f['capture_start'], referential, session
+        ))
+
+    with Database.transaction():
+        if modified:
+            Database.values_asdict(
+                "update li3ds.datasource as d set uri = v.uri, parameters = v.parameters, "
+                "bounds = v.bounds, capture_start = v.capture_start "
+                "from (values %s) as v(id, uri, parameters, bounds, capture_start) "
+                "where d.id = v.id", modified, UPDATE_TEMPLATE)
+        if rows:
+            Database.copy('datasource', columns, rows)
+
+    return {
+        'inserted': len(rows),
+        'updated': len(modified),
+        'skipped': skipped,
+    }
+
+
+def main():
+    from api_li3ds import create_app, shards
+
+    parser = argparse.ArgumentParser(description='Register acquisition files as datasources')
+    parser.add_argument('directory', help='root directory of the acquisition')
+    parser.add_argument('--session', type=int, required=True, help='session identifier')
+    parser.add_argument('--referential', type=int, required=True,
+                        help='referential identifier')
+    parser.add_argument('--workers', type=int, default=CRAWLER_WORKERS,
+                        help='number of threads listing directories')
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context(), shards.on_shard(shards.id_shard(args.session)):
+        result = register(args.directory, args.session, args.referential, args.workers)
+    print('{inserted} inserted, {updated} updated, {skipped} skipped'.format(**result))
+
+
+if __name__ == '__main__':
+    main()
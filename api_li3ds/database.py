@@ -1,10 +1,23 @@
 # -*- coding: utf-8 -*-
-from itertools import chain
-from psycopg2 import connect, sql
+import io
+import os
+import json
+import time
+import datetime
+import threading
+from contextlib import contextmanager
+from itertools import chain, count
+from psycopg2 import connect, sql, Error, OperationalError
 from psycopg2.extras import NamedTupleCursor, Json, register_default_jsonb
-from psycopg2.extensions import register_adapter
+from psycopg2.extras import execute_values
+from psycopg2.extensions import register_adapter, get_wait_callback
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE, parse_dsn
 
-from flask import current_app
+from flask import current_app, has_request_context, request
+
+from api_li3ds import timeouts
+from api_li3ds.prepared import statements, PREPARE_THRESHOLD, PREPARED_STATEMENTS
+from api_li3ds.slowqueries import inspector
 
 
 # adapt python dict to postgresql json type
@@ -13,20 +26,251 @@ register_adapter(dict, Json)
 # register the jsonb type
 register_default_jsonb()
 
+DSN = "postgresql://{pg_user}:{pg_password}@{pg_host}:{pg_port}/{pg_name}"
+
+# default seconds during which a failed replica is not used
+DB_REPLICA_RETRY = 30
+
+# default number of connections of transactions without DB_POOL_SIZE
+DB_TRANSACTION_POOL_SIZE = 4
+
+
+def copy_value(value):
+    '''
+    Format a python value for the COPY text format
+    (lists are only supported for arrays of numbers)
+    '''
+    if value is None:
+        return '\\N'
+    if isinstance(value, (list, tuple)):
+        value = '{' + ','.join(str(v) for v in value) + '}'
+    elif isinstance(value, dict):
+        value = json.dumps(value)
+    elif isinstance(value, (datetime.date, datetime.datetime)):
+        value = value.isoformat()
+    return (
+        str(value)
+        .replace('\\', '\\\\')
+        .replace('\t', '\\t')
+        .replace('\n', '\\n')
+        .replace('\r', '\\r')
+    )
+
+
+def open_connection(dsn):
+    '''
+    Open a new connection
+    '''
+    db = connect(dsn, cursor_factory=NamedTupleCursor)
+    # autocommit mode for performance (we don't need transaction)
+    db.autocommit = True
+    return db
+
+
+def server_dsn(config, server):
+    '''
+    Build the dsn of a server given as a dsn or as connection parameters
+    overriding the primary ones (pg_host, pg_port...)
+    '''
+    if isinstance(server, str):
+        return server
+    params = dict(config)
+    params.update(server)
+    return DSN.format(**params)
+
+
+class Pool():
+    '''
+    Bounded pool of connections, acquire blocks while all connections are used
+    '''
+
+    def __init__(self, size, factory):
+        self.size = size
+        self.factory = factory
+        self.idle = []
+        self.lock = threading.Lock()
+        self.available = threading.BoundedSemaphore(size)
+
+    def acquire(self):
+        self.available.acquire()
+        try:
+            with self.lock:
+                if self.idle:
+                    return self.idle.pop()
+            return self.factory()
+        except BaseException:
+            self.available.release()
+            raise
+
+    def release(self, db):
+        try:
+            if not db.closed:
+                if db.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+                    db.rollback()
+                db.autocommit = True
+                with self.lock:
+                    self.idle.append(db)
+        except Error:
+            # broken connection, a new one will be opened
+            db.close()
+        finally:
+            self.available.release()
+
+
+class Server():
+    '''
+    Database server other than the primary, with its own connection
+    (or pool of connections)
+    '''
+
+    def __init__(self, dsn, pool_size=None, spare_size=DB_TRANSACTION_POOL_SIZE):
+        self.dsn = dsn
+        self.pool_size = pool_size
+        self.spare_size = spare_size
+        self.db = None
+        self.lock = threading.Lock()
+        self.pool = Pool(pool_size, self.connect) if pool_size else None
+        # connections checked out by transactions without a pool
+        self.spare = Pool(spare_size, self.connect) if not pool_size else None
+        self.local = threading.local()
+
+    @property
+    def name(self):
+        params = parse_dsn(self.dsn)
+        return '{}:{}'.format(params.get('host', ''), params.get('port', ''))
+
+    def connect(self):
+        return open_connection(self.dsn)
+
+    def connection(self):
+        '''
+        Return the connection (of the current thread with a pool)
+        '''
+        db = getattr(self.local, 'db', None)
+        if db is not None:
+            return db
+        if self.pool is not None:
+            db = self.local.db = self.pool.acquire()
+            return db
+        if self.db is None:
+            with self.lock:
+                if self.db is None:
+                    self.db = self.connect()
+        return self.db
+
+    @contextmanager
+    def checkout(self):
+        '''
+        Give the current thread a connection of its own during the block
+        '''
+        if self.pool is not None or getattr(self.local, 'db', None) is not None:
+            yield
+            return
+        db = self.local.db = self.spare.acquire()
+        try:
+            yield
+        finally:
+            self.local.db = None
+            self.spare.release(db)
+
+    def release(self):
+        db = getattr(self.local, 'db', None)
+        if self.pool is not None and db is not None:
+            self.local.db = None
+            self.pool.release(db)
+
+    def connections(self):
+        '''
+        Return open connections not used by a thread
+        '''
+        pool = self.pool if self.pool is not None else self.spare
+        return ([self.db] if self.db is not None else []) + list(pool.idle)
+
+
+class Replica(Server):
+    '''
+    Read-only database server, ejected for a while after a connection failure
+    '''
+
+    def __init__(self, dsn, pool_size=None, spare_size=DB_TRANSACTION_POOL_SIZE):
+        super().__init__(dsn, pool_size, spare_size)
+        # monotonic time until which the replica is not used
+        self.ejected_until = 0
+        self.ejections = 0
+
+    def healthy(self, now=None):
+        return self.ejected_until <= (now or time.monotonic())
+
+    def eject(self, seconds):
+        '''
+        Stop using the replica for some seconds and drop its connection
+        '''
+        self.ejected_until = time.monotonic() + seconds
+        self.ejections += 1
+        if self.pool is not None:
+            db = getattr(self.local, 'db', None)
+            if db is not None:
+                db.close()
+            self.release()
+        else:
+            # not closed, other threads may still use it
+            self.db = None
+
+    def stats(self):
+        return {
+            'name': self.name,
+            'healthy': self.healthy(),
+            'ejections': self.ejections,
+        }
+
 
 class Database():
     '''
     Database object used as a global connection object to the db
     '''
     db = None
+    # connection parameters, set by init_app
+    dsn = None
+    lock = threading.Lock()
+    # process which opened the connection
+    pid = None
+    # connections inherited from parent processes, kept open
+    inherited = []
+    # pool used with the DB_POOL_SIZE setting: each thread (or greenlet)
+    # then has its own connection until the end of its app context
+    pool = None
+    # connections checked out by transactions without DB_POOL_SIZE, so that
+    # the shared connection stays in autocommit mode
+    spare = None
+    local = threading.local()
+    # read-only servers (pg_replicas setting) used by get requests,
+    # chosen with a round-robin among healthy ones
+    replicas = []
+    counter = count()
+    # other databases holding projects (pg_shards setting, see shards.py),
+    # the primary being the first shard
+    shards = []
 
     @classmethod
     def _query(cls, query, parameters=None, rowcount=None):
         '''
         Performs a query and returns results as a named tuple
         '''
-        cur = cls.db.cursor()
-        cur.execute(query, parameters)
+        cur = cls.connection().cursor()
+        started = time.perf_counter()
+        try:
+            cls.execute(cur, query, parameters)
+        except OperationalError:
+            replica = getattr(cls.local, 'server', None)
+            if not isinstance(replica, Replica) or not cur.connection.closed:
+                raise
+            # replica lost, read from the primary
+            cls.eject(replica)
+            cur = cls.connection().cursor()
+            started = time.perf_counter()
+            cls.execute(cur, query, parameters)
+        inspector.inspect(cur, query, parameters, time.perf_counter() - started,
+                          cls.current_dsn())
 
         query_str = query.as_string(cur) if isinstance(query, sql.Composable) else query
         current_app.logger.debug(
@@ -39,6 +283,38 @@ class Database():
         for row in cur:
             yield row
 
+    @classmethod
+    def execute(cls, cur, query, parameters=None):
+        '''
+        Execute a query within the statement timeout of the current endpoint,
+        with a prepared statement if it is frequently used
+        '''
+        dedicated = cls.dedicated()
+        prefix = timeouts.apply(cur, dedicated)
+        with timeouts.watchdog.watch(cur.connection, dedicated):
+            if prefix and isinstance(query, sql.Composable):
+                query = query.as_string(cur)
+            size = current_app.config.get('PREPARED_STATEMENTS', PREPARED_STATEMENTS)
+            if parameters and size:
+                if isinstance(query, sql.Composable):
+                    query = query.as_string(cur)
+                threshold = current_app.config.get('PREPARE_THRESHOLD', PREPARE_THRESHOLD)
+                if statements.execute(cur, query, parameters, threshold, size, prefix):
+                    return
+            # the prefix sets the timeout of the statement it is sent with
+            cur.execute(prefix + query if prefix else query, parameters)
+
+    @classmethod
+    def dedicated(cls):
+        '''
+        Return True if connections used by the current thread are not
+        shared with other threads (their queries may then be cancelled)
+        '''
+        server = getattr(cls.local, 'server', None)
+        if cls.pool is not None or getattr((server or cls).local, 'db', None) is not None:
+            return True
+        return has_request_context() and not request.environ.get('wsgi.multithread', True)
+
     @classmethod
     def rowcount(cls, query, parameters=None):
         '''
@@ -65,12 +341,13 @@ class Database():
         Wrap query with a json serialization directly in postgres
         and return
         '''
+        if isinstance(query, sql.Composable):
+            query = sql.SQL("select row_to_json(t) from ({}) as t").format(query)
+        else:
+            query = "select row_to_json(t) from ({}) as t".format(query)
         return [
             line[0] for line in
-            cls._query(
-                "select row_to_json(t) from ({}) as t"
-                .format(query), parameters=parameters
-            )
+            cls._query(query, parameters=parameters)
         ]
 
     @classmethod
@@ -88,23 +365,306 @@ class Database():
         '''
         return list(cls._query(query, parameters=parameters))
 
+    @classmethod
+    def values_asdict(cls, query, values, template=None, page_size=1000):
+        '''
+        Run a multi-rows query (see psycopg2 execute_values) and returns rows
+        produced by a ``returning`` clause as dicts, in values order
+        '''
+        cur = cls.connection().cursor()
+        rows = []
+        dedicated = cls.dedicated()
+        statement = query
+        prefix = timeouts.apply(cur, dedicated)
+        if prefix:
+            if isinstance(query, sql.Composable):
+                statement = query.as_string(cur)
+            statement = prefix + statement
+        with timeouts.watchdog.watch(cur.connection, dedicated):
+            # page ourselves to collect results of every page
+            for start in range(0, len(values), page_size):
+                execute_values(
+                    cur, statement, values[start:start + page_size], template, page_size)
+                if cur.description:
+                    rows.extend(row._asdict() for row in cur)
+
+        query_str = query.as_string(cur) if isinstance(query, sql.Composable) else query
+        current_app.logger.debug(
+            'query: {}, values: {}'.format(query_str, len(values))
+        )
+        return rows
+
+    @classmethod
+    def insert_values(cls, table, columns, items, conflict=None):
+        '''
+        Insert items (dicts) in a li3ds table with multi-rows statements
+        and returns created identifiers in items order.
+
+        If conflict columns are given, existing rows with the same values
+        for these columns are updated (an unique index is needed on them).
+        '''
+        if not items:
+            return []
+        query = sql.SQL("insert into li3ds.{} ({}) values %s").format(
+            sql.Identifier(table), sql.SQL(', ').join(map(sql.Identifier, columns)))
+        if conflict:
+            query += sql.SQL(" on conflict ({}) do update set {}").format(
+                sql.SQL(', ').join(map(sql.Identifier, conflict)),
+                sql.SQL(', ').join(
+                    sql.SQL("{0} = excluded.{0}").format(sql.Identifier(column))
+                    for column in columns if column not in conflict
+                ))
+        query += sql.SQL(" returning id")
+        rows = cls.values_asdict(
+            query, [tuple(item.get(column) for column in columns) for item in items])
+        return [row['id'] for row in rows]
+
+    @classmethod
+    def copy(cls, table, columns, rows):
+        '''
+        Load rows (tuples) in a li3ds table with COPY and returns the row count
+
+        COPY runs in a transaction, where its statement timeout is set.
+        '''
+        if get_wait_callback() is not None:
+            # COPY is not supported with a wait callback (green mode)
+            return len(cls.insert_values(
+                table, columns, [dict(zip(columns, row)) for row in rows]))
+        buf = io.StringIO()
+        for row in rows:
+            buf.write('\t'.join(copy_value(value) for value in row))
+            buf.write('\n')
+        buf.seek(0)
+
+        with cls.transaction():
+            cur = cls.connection().cursor()
+            query = sql.SQL("copy li3ds.{} ({}) from stdin").format(
+                sql.Identifier(table), sql.SQL(', ').join(map(sql.Identifier, columns))
+            ).as_string(cur)
+            with timeouts.watchdog.watch(cur.connection, cls.dedicated()):
+                cur.copy_expert(query, buf)
+        current_app.logger.debug(
+            'query: {}, rowcount: {}'.format(query, cur.rowcount)
+        )
+        return cur.rowcount
+
     @classmethod
     def notices(cls, query, parameters=None):
         '''
         Get notices raised during a query
         '''
         list(cls._query(query, parameters=parameters, rowcount=True))
-        return cls.db.notices
+        return cls.connection().notices
+
+    @classmethod
+    @contextmanager
+    def transaction(cls):
+        '''
+        Run all queries of the block in a single transaction on the primary
+        (or the current shard), rolled back if an exception is raised.
+
+        The transaction has a connection of its own, the shared one stays in
+        autocommit mode. A transaction in a transaction on the same server
+        is part of it.
+        '''
+        server = getattr(cls.local, 'server', None)
+        if isinstance(server, Replica):
+            server = None
+        with cls.target(server), (server or cls).checkout():
+            db = cls.connection()
+            if not db.autocommit:
+                yield
+                return
+            outer = getattr(cls.local, 'transaction', False)
+            db.autocommit = False
+            cls.local.transaction = True
+            try:
+                timeouts.begin(db)
+                yield
+            except BaseException:
+                db.rollback()
+                raise
+            else:
+                db.commit()
+            finally:
+                cls.local.transaction = outer
+                db.autocommit = True
+
+    @classmethod
+    @contextmanager
+    def checkout(cls):
+        '''
+        Give the current thread a connection to the primary of its own
+        during the block
+        '''
+        if cls.pool is not None or getattr(cls.local, 'db', None) is not None:
+            yield
+            return
+        db = cls.local.db = cls.spare.acquire()
+        try:
+            yield
+        finally:
+            cls.local.db = None
+            cls.spare.release(db)
+
+    @classmethod
+    @contextmanager
+    def target(cls, server):
+        '''
+        Run the queries of the block on a server, or on the primary if None
+        '''
+        previous = getattr(cls.local, 'server', None)
+        cls.local.server = server
+        try:
+            yield
+        finally:
+            cls.local.server = previous
+
+    @classmethod
+    def primary(cls):
+        '''
+        Run the queries of the block on the primary
+        '''
+        return cls.target(None)
+
+    @classmethod
+    def read_replica(cls):
+        '''
+        Run the queries of the block on the next healthy replica,
+        on the primary if there is none or in a transaction
+        '''
+        if getattr(cls.local, 'transaction', False):
+            return cls.target(getattr(cls.local, 'server', None))
+        now = time.monotonic()
+        healthy = [replica for replica in cls.replicas if replica.healthy(now)]
+        if not healthy:
+            return cls.target(None)
+        return cls.target(healthy[next(cls.counter) % len(healthy)])
+
+    @classmethod
+    def current_dsn(cls):
+        '''
+        Return the dsn of the server queries currently run on
+        '''
+        server = getattr(cls.local, 'server', None)
+        return server.dsn if server is not None else cls.dsn
+
+    @classmethod
+    def servers(cls):
+        '''
+        Return replicas and shards
+        '''
+        return cls.replicas + cls.shards
+
+    @classmethod
+    def eject(cls, replica):
+        '''
+        Stop using a failed replica for a while, following queries of the
+        current block run on the primary
+        '''
+        seconds = current_app.config.get('DB_REPLICA_RETRY', DB_REPLICA_RETRY)
+        current_app.logger.warning(
+            'replica {} ejected for {}s'.format(replica.name, seconds))
+        replica.eject(seconds)
+        cls.local.server = None
+
+    @classmethod
+    def connection(cls):
+        '''
+        Return the connection, opened on first use
+        '''
+        if cls.pid is not None and cls.pid != os.getpid():
+            # forked without running the post fork hook
+            cls.after_fork()
+        server = getattr(cls.local, 'server', None)
+        if server is not None:
+            try:
+                return server.connection()
+            except OperationalError:
+                if not isinstance(server, Replica):
+                    raise
+                cls.eject(server)
+        db = getattr(cls.local, 'db', None)
+        if db is not None:
+            return db
+        if cls.pool is not None:
+            db = cls.local.db = cls.pool.acquire()
+            cls.pid = os.getpid()
+            return db
+        if cls.db is None:
+            with cls.lock:
+                if cls.db is None:
+                    db = cls.connect()
+                    cls.pid = os.getpid()
+                    cls.db = db
+        return cls.db
+
+    @classmethod
+    def connect(cls):
+        '''
+        Open a new connection to the primary
+        '''
+        return open_connection(cls.dsn)
+
+    @classmethod
+    def release(cls, exc=None):
+        '''
+        Give the connections of the current thread back to the pools
+        '''
+        db = getattr(cls.local, 'db', None)
+        if cls.pool is not None and db is not None:
+            cls.local.db = None
+            cls.pool.release(db)
+        for server in cls.servers():
+            server.release()
+
+    @classmethod
+    def after_fork(cls):
+        '''
+        Forget the connection inherited from the parent process, a new one
+        is opened on first use. It is not closed: closing it would end
+        the session of the parent process.
+        '''
+        if cls.db is not None:
+            cls.inherited.append(cls.db)
+        cls.db = None
+        cls.pid = None
+        cls.lock = threading.Lock()
+        cls.local = threading.local()
+        if cls.pool is not None:
+            cls.inherited.extend(cls.pool.idle)
+            cls.pool = Pool(cls.pool.size, cls.connect)
+        if cls.spare is not None:
+            cls.inherited.extend(cls.spare.idle)
+            cls.spare = Pool(cls.spare.size, cls.connect)
+        for server in cls.servers():
+            cls.inherited.extend(server.connections())
+        cls.replicas = [
+            Replica(replica.dsn, replica.pool_size, replica.spare_size)
+            for replica in cls.replicas]
+        cls.shards = [Server(shard.dsn, shard.pool_size, shard.spare_size) for shard in cls.shards]
 
     @classmethod
     def init_app(cls, app):
         '''
         Initialize db session lazily
         '''
-        cls.db = connect(
-            "postgresql://{pg_user}:{pg_password}@{pg_host}:{pg_port}/{pg_name}"
-            .format(**app.config),
-            cursor_factory=NamedTupleCursor,
-        )
-        # autocommit mode for performance (we don't need transaction)
-        cls.db.autocommit = True
+        cls.dsn = DSN.format(**app.config)
+        cls.db = None
+        cls.local = threading.local()
+        cls.pool = cls.spare = None
+        spare_size = app.config.get('DB_TRANSACTION_POOL_SIZE', DB_TRANSACTION_POOL_SIZE)
+        if app.config.get('DB_POOL_SIZE'):
+            cls.pool = Pool(app.config['DB_POOL_SIZE'], cls.connect)
+        else:
+            cls.spare = Pool(spare_size, cls.connect)
+        cls.replicas = [
+            Replica(server_dsn(app.config, replica), app.config.get('DB_POOL_SIZE'), spare_size)
+            for replica in app.config.get('pg_replicas') or []
+        ]
+        cls.shards = [
+            Server(server_dsn(app.config, shard.get('dsn') or shard),
+                   app.config.get('DB_POOL_SIZE'), spare_size)
+            for shard in app.config.get('pg_shards') or []
+        ]
+        app.teardown_appcontext(cls.release)
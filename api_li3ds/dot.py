@@ -2,12 +2,14 @@
 Graphviz wrapper to export li3ds database elements
 '''
 from flask import url_for
-from graphviz import Digraph
 
 from api_li3ds.database import Database
 
 
 def make_dot(name, url, label, nodes, edges):
+    # graphviz is only imported when a graph is rendered, to speed up startup
+    from graphviz import Digraph
+
     dot = Digraph(name=name, comment=url)
     dot.graph_attr.update({
         'label': label,
@@ -28,6 +28,9 @@ def pgexceptions(func):
     def decorated(*args, **kwargs):
         try:
             return func(*args, **kwargs)
+        except psycopg2.extensions.QueryCanceledError as exc:
+            # statement timeout or cancelled query (see timeouts.py)
+            return abort(504, 'Database query timed out', exc.pgerror or exc.args)
         except psycopg2.IntegrityError as exc:
             return abort_pgexc(404, exc)
         except psycopg2.Error as exc:
@@ -0,0 +1,103 @@
+'''
+Nested expansion of related li3ds objects
+
+Related objects are loaded with one batched query per expanded level,
+whatever the number of parent objects.
+'''
+from collections import defaultdict, namedtuple
+from functools import wraps
+
+from flask import request
+from flask_restplus.utils import merge
+from psycopg2 import sql
+
+from api_li3ds.app import field_names
+from api_li3ds.database import Database
+from api_li3ds.exc import abort
+from api_li3ds import shards
+from api_li3ds.serializer import marshal
+
+# query parameter used to ask for nested objects
+EXPAND_PARAM = 'expand'
+
+# table: li3ds table holding related objects
+# key: column referencing the parent identifier
+# model: model used to serialize related objects
+# relations: relations available on related objects
+Relation = namedtuple('Relation', ('table', 'key', 'model', 'relations'))
+
+
+def parse_expand(relations):
+    """Parse the ``expand`` query parameter into a tree of relations.
+
+    ``expand=sessions.datasources,sessions.platform`` gives
+    ``{'sessions': (Relation, {'datasources': (Relation, {}), ...})}``
+
+    Aborts with a 400 on unknown relations.
+    """
+    tree = {}
+    for path in request.args.get(EXPAND_PARAM, '').split(','):
+        if not path.strip():
+            continue
+        level, available = tree, relations
+        for name in path.strip().split('.'):
+            if name not in available:
+                abort(400, 'cannot expand {}, available relations are {}'
+                           .format(name, list(available)))
+            relation = available[name]
+            level = level.setdefault(name, (relation, {}))[1]
+            available = relation.relations
+    return tree
+
+
+def expand_rows(rows, tree):
+    """Attach related objects to serialized ``rows``, one query per tree node
+    """
+    ids = [row['id'] for row in rows]
+    for name, (relation, subtree) in tree.items():
+        children = []
+        if ids:
+            query = sql.SQL("select * from li3ds.{} where {} = ANY(%s) order by id").format(
+                sql.Identifier(relation.table), sql.Identifier(relation.key))
+            # related objects are on the shard of their parent
+            children = marshal(shards.by_ids(
+                ids, lambda ids: Database.query_asjson(query, (ids,))
+            ), relation.model)
+            expand_rows(children, subtree)
+        grouped = defaultdict(list)
+        for child in children:
+            grouped[child[relation.key]].append(child)
+        for row in rows:
+            row[name] = grouped[row['id']]
+
+
+def expandable(relations):
+    """Decorator allowing to expand related objects on a marshalled response.
+
+    Must be placed above ``marshal_with``.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            tree = parse_expand(relations)
+            names = field_names()
+            if tree and names is not None and 'id' not in names:
+                abort(400, 'id field is required to expand relations')
+            resp = func(*args, **kwargs)
+            if tree:
+                data = resp[0] if isinstance(resp, tuple) else resp
+                expand_rows(data if isinstance(data, list) else [data], tree)
+            return resp
+
+        wrapper.__apidoc__ = merge(getattr(func, '__apidoc__', {}), {
+            'params': {
+                EXPAND_PARAM: {
+                    'in': 'query',
+                    'type': 'string',
+                    'description': 'comma separated list of relations to expand, '
+                                   'nested with dots ({})'.format(', '.join(relations))
+                }
+            }
+        })
+        return wrapper
+    return decorator
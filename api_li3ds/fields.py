@@ -1,9 +1,47 @@
+import re
 import datetime
 from flask_restplus import fields
 
+# timestamps as formatted by postgresql json functions
+PG_TIMESTAMP = re.compile(
+    r'(\d{4})-(\d\d)-(\d\d)T(\d\d):(\d\d):(\d\d)(?:\.(\d{1,6}))?'
+    r'(?:(Z)|([+-])(\d\d)(?::?(\d\d))?)$'
+)
+
+
+def iso8601_to_utc(value):
+    '''
+    Convert a postgresql timestamp with time zone string to an UTC
+    iso8601 string, None if the string has another format
+    '''
+    match = PG_TIMESTAMP.match(value)
+    if match is None:
+        return None
+    year, month, day, hour, minute, second, fraction, utc, sign, tzh, tzm = match.groups()
+    try:
+        dt = datetime.datetime(
+            int(year), int(month), int(day), int(hour), int(minute), int(second),
+            int(fraction.ljust(6, '0')) if fraction else 0,
+            datetime.timezone.utc
+        )
+    except ValueError:
+        return None
+    if not utc:
+        offset = datetime.timedelta(hours=int(tzh), minutes=int(tzm or 0))
+        dt = dt - offset if sign == '+' else dt + offset
+    return dt.isoformat()
+
 
 class DateTime(fields.DateTime):
 
+    def format(self, value):
+        if isinstance(value, str) and self.dt_format == 'iso8601':
+            # avoid the generic iso8601 parser for database values
+            formatted = iso8601_to_utc(value)
+            if formatted is not None:
+                return formatted
+        return super().format(value)
+
     def format_iso8601(self, dt):
         dt_utc = dt.replace(tzinfo=datetime.timezone.utc) - dt.utcoffset()
         return dt_utc.isoformat()
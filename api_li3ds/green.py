@@ -0,0 +1,62 @@
+'''
+Cooperative (green threads) serving mode with gevent
+
+psycopg2 blocks the whole process while waiting for postgres. With a wait
+callback, queries are run in asynchronous mode and the callback yields to
+other greenlets while the connection waits for the network, so that one
+worker can serve many slow requests (foreign scans for instance).
+
+Use ``api_li3ds.wsgi_gevent:app`` with a gevent server. Each greenlet must
+use its own connection: ``DB_POOL_SIZE`` defaults to 20 in this mode.
+COPY is not supported in this mode (``Database.copy`` then inserts rows).
+'''
+from psycopg2 import extensions, OperationalError
+
+# default number of connections of a worker in green mode
+DB_POOL_SIZE = 20
+
+
+def wait_callback(conn, timeout=None):
+    '''
+    psycopg2 wait callback yielding to other greenlets
+    '''
+    from gevent.socket import wait_read, wait_write
+
+    while True:
+        state = conn.poll()
+        if state == extensions.POLL_OK:
+            break
+        elif state == extensions.POLL_READ:
+            wait_read(conn.fileno(), timeout=timeout)
+        elif state == extensions.POLL_WRITE:
+            wait_write(conn.fileno(), timeout=timeout)
+        else:
+            raise OperationalError('bad state from poll: {}'.format(state))
+
+
+def patch():
+    '''
+    Patch the standard library with gevent (if not done yet) and register
+    the wait callback
+    '''
+    try:
+        from gevent import monkey
+    except ImportError:
+        raise RuntimeError('green mode needs gevent (pip install api_li3ds[gevent])')
+    if not monkey.is_module_patched('threading'):
+        monkey.patch_all()
+    extensions.set_wait_callback(wait_callback)
+
+
+def patched():
+    return extensions.get_wait_callback() is wait_callback
+
+
+def init_app(app):
+    '''
+    Give each greenlet a connection of its own in green mode, queries of
+    greenlets would be mixed on the shared connection
+    '''
+    if patched() and not app.config.get('DB_POOL_SIZE'):
+        app.logger.warning('green mode without DB_POOL_SIZE, {} used'.format(DB_POOL_SIZE))
+        app.config['DB_POOL_SIZE'] = DB_POOL_SIZE
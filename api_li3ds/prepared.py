@@ -0,0 +1,249 @@
+'''
+Server side prepared statements for frequently run queries
+
+A parameterized query run more than ``PREPARE_THRESHOLD`` times is prepared
+on each connection running it (PREPARE, outside transactions), then run
+with EXECUTE: postgresql does not parse and plan it again. Each connection
+keeps at most ``PREPARED_STATEMENTS`` statements (least recently used ones
+are deallocated). A new connection starts without any prepared statement,
+statements dropped by the server are prepared again, and so are statements
+whose result type changed with the schema.
+
+Planning time saved is estimated from the planning time of each statement,
+measured once with ``explain (summary)``.
+'''
+import re
+import hashlib
+import threading
+import weakref
+from collections import OrderedDict
+
+from psycopg2 import Error
+
+# default number of runs of a query before it is prepared
+PREPARE_THRESHOLD = 3
+
+# default maximum number of prepared statements per connection
+PREPARED_STATEMENTS = 100
+
+# maximum number of distinct queries whose runs are counted, and of queries
+# remembered as failing to be prepared
+COUNTED_QUERIES = 10000
+
+# maximum number of statements whose statistics are kept
+KEPT_STATISTICS = 1000
+
+# statements postgresql can prepare
+PREPARABLE = ('select', 'insert', 'update', 'delete', 'with', 'values')
+
+# psycopg2 placeholders
+PLACEHOLDER = re.compile(r'%\((\w+)\)s|%s|%%')
+
+PLANNING_TIME = re.compile(r'Planning [Tt]ime: ([\d.]+) ms')
+
+# sqlstate of missing and duplicate prepared statements
+INVALID_STATEMENT_NAME = '26000'
+DUPLICATE_STATEMENT = '42P05'
+
+# sqlstate of "cached plan must not change result type" (altered tables)
+FEATURE_NOT_SUPPORTED = '0A000'
+
+
+def convert(query, parameters):
+    '''
+    Convert a query with psycopg2 placeholders to a query with numbered
+    parameters, returns (query, values) or None if it cannot be prepared
+    '''
+    if not query.lstrip().lower().startswith(PREPARABLE) or ';' in query.rstrip().rstrip(';'):
+        return None
+    names = []
+    positional = []
+
+    def number(match):
+        if match.group(0) == '%%':
+            return '%'
+        if match.group(1) is None:
+            positional.append(None)
+            return '${}'.format(len(positional))
+        if match.group(1) not in names:
+            names.append(match.group(1))
+        return '${}'.format(names.index(match.group(1)) + 1)
+
+    text = PLACEHOLDER.sub(number, query)
+    if names and positional:
+        return None
+    if names:
+        if not hasattr(parameters, 'keys'):
+            return None
+        return text, [parameters[name] for name in names]
+    if not isinstance(parameters, (list, tuple)) or len(parameters) != len(positional):
+        return None
+    return text, list(parameters)
+
+
+class Statements():
+    '''
+    Prepared statements of connections and their statistics
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # query -> number of runs, until prepared
+        self.counts = OrderedDict()
+        # connection -> OrderedDict(statement name -> None), by recent use
+        self.prepared = weakref.WeakKeyDictionary()
+        # statement name -> [query, executions, planning time (ms) or None],
+        # by recent use
+        self.statistics = OrderedDict()
+        # queries which failed to be prepared, by recent failure
+        self.unpreparable = OrderedDict()
+
+    def name(self, query):
+        return 'li3ds_' + hashlib.sha1(query.encode('utf-8')).hexdigest()[:16]
+
+    def ready(self, query, threshold):
+        '''
+        Count a run of query, returns True once it should be prepared
+        '''
+        with self.lock:
+            if query in self.unpreparable:
+                return False
+            runs = self.counts.pop(query, 0) + 1
+            if runs < threshold:
+                self.counts[query] = runs
+                while len(self.counts) > COUNTED_QUERIES:
+                    self.counts.popitem(last=False)
+                return False
+            return True
+
+    def execute(self, cursor, query, parameters, threshold=PREPARE_THRESHOLD,
+                size=PREPARED_STATEMENTS, prefix=''):
+        '''
+        Run query with a prepared statement if it is frequently used,
+        returns False if the query was not run. The prefix (statement timeout
+        on a shared connection) is sent with the execute statement.
+        '''
+        if not size or not parameters or query in self.unpreparable:
+            return False
+        converted = convert(query, parameters)
+        if converted is None:
+            return False
+        name = self.name(query)
+        connection = cursor.connection
+        with self.lock:
+            prepared = self.prepared.setdefault(connection, OrderedDict())
+            known = name in prepared
+            if known:
+                prepared.move_to_end(name)
+        if not known:
+            # statements are prepared outside transactions: a failure would
+            # abort them
+            if not connection.autocommit:
+                return False
+            # frequent queries are prepared at once on new connections
+            if name not in self.statistics and not self.ready(query, threshold):
+                return False
+            if not self.prepare(cursor, name, query, converted[0], parameters, size):
+                return False
+
+        text = prefix + 'execute {} ({})'.format(name, ', '.join(['%s'] * len(converted[1])))
+        try:
+            cursor.execute(text, converted[1])
+        except Error as exc:
+            if exc.pgcode not in (INVALID_STATEMENT_NAME, FEATURE_NOT_SUPPORTED) or \
+                    not connection.autocommit:
+                raise
+            # dropped by the server (reset session) or stale after a schema
+            # change, prepared again
+            with self.lock:
+                prepared.pop(name, None)
+            if exc.pgcode == FEATURE_NOT_SUPPORTED:
+                cursor.execute('deallocate {}'.format(name))
+            if not self.prepare(cursor, name, query, converted[0], parameters, size):
+                return False
+            cursor.execute(text, converted[1])
+        with self.lock:
+            statistics = self.statistics.setdefault(name, [query, 0, None])
+            statistics[1] += 1
+            self.statistics.move_to_end(name)
+            while len(self.statistics) > KEPT_STATISTICS:
+                self.statistics.popitem(last=False)
+        return True
+
+    def prepare(self, cursor, name, query, text, parameters, size):
+        '''
+        Prepare a statement on the cursor connection, deallocating the least
+        recently used one if there are too many
+        '''
+        planning = None
+        if name not in self.statistics:
+            planning = self.planning_time(cursor, query, parameters)
+        try:
+            cursor.execute('prepare {} as {}'.format(name, text))
+        except Error as exc:
+            if exc.pgcode != DUPLICATE_STATEMENT:
+                with self.lock:
+                    self.unpreparable[query] = None
+                    while len(self.unpreparable) > COUNTED_QUERIES:
+                        self.unpreparable.popitem(last=False)
+                return False
+        with self.lock:
+            self.statistics.setdefault(name, [query, 0, planning])
+            prepared = self.prepared.setdefault(cursor.connection, OrderedDict())
+            prepared[name] = None
+            evicted = []
+            while len(prepared) > size:
+                evicted.append(prepared.popitem(last=False)[0])
+        for old in evicted:
+            try:
+                cursor.execute('deallocate {}'.format(old))
+            except Error:
+                pass
+        return True
+
+    def planning_time(self, cursor, query, parameters):
+        '''
+        Planning time of query in milliseconds, None if it is not available
+        (postgresql < 10)
+        '''
+        try:
+            cursor.execute('explain (summary) ' + query, parameters)
+            plan = '\n'.join(str(row[0]) for row in cursor)
+        except Error:
+            return None
+        match = PLANNING_TIME.search(plan)
+        return float(match.group(1)) if match else None
+
+    def after_fork(self):
+        '''
+        Start without prepared statements in a forked worker
+        '''
+        self.lock = threading.Lock()
+        self.prepared = weakref.WeakKeyDictionary()
+
+    def stats(self):
+        '''
+        Return executions of prepared statements and the estimated
+        planning time saved (in milliseconds)
+        '''
+        with self.lock:
+            statements = [
+                {
+                    'query': query,
+                    'executions': executions,
+                    'planning_ms': planning,
+                    'saved_ms': round(planning * executions, 3) if planning else None,
+                }
+                for query, executions, planning in self.statistics.values()
+            ]
+            connections = len(self.prepared)
+        statements.sort(key=lambda statement: -statement['executions'])
+        return {
+            'connections': connections,
+            'executions': sum(statement['executions'] for statement in statements),
+            'saved_ms': round(sum(statement['saved_ms'] or 0 for statement in statements), 3),
+            'statements': statements,
+        }
+
+
+statements = Statements()
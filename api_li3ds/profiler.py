@@ -0,0 +1,233 @@
+'''
+Opt-in profiling of requests
+
+A request is profiled when it carries the ``X-Profile`` header with a valid
+api key, or at random with the ``PROFILE_SAMPLING`` setting (fraction of
+requests). ``PROFILE_MODE`` gives the profiler:
+
+- ``cprofile``: deterministic profile of the request thread, served as
+  pstats (``python -m pstats``, snakeviz...) or as text
+- ``sampler``: the request thread stack sampled every ``PROFILE_INTERVAL``
+  seconds, served as collapsed stacks (``flamegraph.pl``, speedscope...).
+  Lower overhead, suited to sampling in production; with green threads,
+  samples show the running greenlet.
+
+Profiles are written to ``PROFILE_DIR`` (shared by workers), keyed by
+a request id returned in the ``X-Profile-Id`` header, and served by the
+secured ``/profiles/`` endpoints. Only the ``PROFILE_KEEP`` most recent
+ones are kept.
+'''
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import cProfile
+import tempfile
+import threading
+from collections import Counter
+
+from flask import current_app, g, request
+
+from api_li3ds.ratelimit import api_keys
+
+# header asking a profile of the request, with an api key as value
+PROFILE_HEADER = 'X-Profile'
+
+# response header giving the id of the profile
+PROFILE_ID_HEADER = 'X-Profile-Id'
+
+# default fraction of requests profiled
+PROFILE_SAMPLING = 0
+
+# default profiler (cprofile or sampler)
+PROFILE_MODE = 'cprofile'
+
+# default seconds between two samples of the stack sampler
+PROFILE_INTERVAL = 0.005
+
+# default number of profiles kept
+PROFILE_KEEP = 100
+
+# file extension by profiler
+EXTENSIONS = {'cprofile': 'pstats', 'sampler': 'collapsed'}
+
+
+def profile_dir():
+    return current_app.config.get('PROFILE_DIR') or \
+        os.path.join(tempfile.gettempdir(), 'api_li3ds-profiles')
+
+
+class Sampler():
+    '''
+    Sample the stack of a thread from another thread
+    '''
+
+    def __init__(self, interval=PROFILE_INTERVAL):
+        self.interval = interval
+        self.stacks = Counter()
+        self.thread_id = threading.get_ident()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def enable(self):
+        self.thread = threading.Thread(target=self.run, name='li3ds-sampler')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def disable(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append('{}:{}'.format(os.path.basename(code.co_filename), code.co_name))
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def dump_stats(self, path):
+        with open(path, 'w') as out:
+            for stack, count in self.stacks.most_common():
+                out.write('{} {}\n'.format(stack, count))
+
+
+def request_id():
+    '''
+    Unique id of a request, ordered by creation time
+    '''
+    return '{:014x}{}'.format(int(time.time() * 1000000), uuid.uuid4().hex[:16])
+
+
+def wanted():
+    '''
+    Return True if the current request must be profiled
+    '''
+    key = request.headers.get(PROFILE_HEADER)
+    if key:
+        return key in api_keys()
+    sampling = current_app.config.get('PROFILE_SAMPLING', PROFILE_SAMPLING)
+    return bool(sampling) and random.random() < sampling
+
+
+def start():
+    '''
+    Start profiling the current request if wanted (before_request hook)
+    '''
+    if not wanted():
+        return
+    mode = current_app.config.get('PROFILE_MODE', PROFILE_MODE)
+    if mode == 'sampler':
+        profiler = Sampler(current_app.config.get('PROFILE_INTERVAL', PROFILE_INTERVAL))
+    else:
+        mode, profiler = 'cprofile', cProfile.Profile()
+    g.profile = (request_id(), mode, profiler, time.perf_counter())
+    profiler.enable()
+
+
+def stop(response):
+    '''
+    Save the profile of the current request (after_request hook)
+    '''
+    profile = g.pop('profile', None)
+    if profile is None:
+        return response
+    id, mode, profiler, started = profile
+    profiler.disable()
+    duration = time.perf_counter() - started
+    try:
+        save(id, mode, profiler, {
+            'id': id,
+            'format': EXTENSIONS[mode],
+            'method': request.method,
+            'path': request.full_path.rstrip('?'),
+            'endpoint': request.endpoint,
+            'status': response.status_code,
+            'duration_ms': round(duration * 1000, 3),
+            'created': time.time(),
+        })
+    except OSError as exc:
+        current_app.logger.error('profile not saved: {}'.format(exc))
+        return response
+    response.headers[PROFILE_ID_HEADER] = id
+    return response
+
+
+def discard(exc=None):
+    '''
+    Stop the profiler of a failed request (teardown_request hook)
+    '''
+    profile = g.pop('profile', None)
+    if profile is not None:
+        profile[2].disable()
+
+
+def save(id, mode, profiler, meta):
+    directory = profile_dir()
+    os.makedirs(directory, exist_ok=True)
+    profiler.dump_stats(os.path.join(directory, '{}.{}'.format(id, EXTENSIONS[mode])))
+    with open(os.path.join(directory, id + '.json'), 'w') as out:
+        json.dump(meta, out)
+    prune(directory, current_app.config.get('PROFILE_KEEP', PROFILE_KEEP))
+
+
+def prune(directory, keep):
+    '''
+    Remove the oldest profiles beyond keep
+    '''
+    # ids start with their creation time
+    metas = sorted(
+        (name for name in os.listdir(directory) if name.endswith('.json')), reverse=True)
+    for name in metas[keep:]:
+        id = name[:-len('.json')]
+        for extension in ('json',) + tuple(EXTENSIONS.values()):
+            try:
+                os.remove(os.path.join(directory, '{}.{}'.format(id, extension)))
+            except FileNotFoundError:
+                # removed by another worker
+                pass
+
+
+def profiles():
+    '''
+    Metadata of stored profiles, most recent first
+    '''
+    directory = profile_dir()
+    if not os.path.isdir(directory):
+        return []
+    found = []
+    for name in os.listdir(directory):
+        if name.endswith('.json'):
+            try:
+                with open(os.path.join(directory, name)) as meta:
+                    found.append(json.load(meta))
+            except (OSError, ValueError):
+                # removed or being written
+                pass
+    return sorted(found, key=lambda meta: -meta['created'])
+
+
+def profile(id):
+    '''
+    Metadata of a profile and the path of its data, None if not found
+    '''
+    if not id.isalnum():
+        return None
+    path = os.path.join(profile_dir(), id + '.json')
+    try:
+        with open(path) as meta:
+            meta = json.load(meta)
+    except (OSError, ValueError):
+        return None
+    return meta, os.path.join(profile_dir(), '{}.{}'.format(id, meta['format']))
+
+
+def init_app(app):
+    app.before_request(start)
+    app.after_request(stop)
+    app.teardown_request(discard)
@@ -0,0 +1,233 @@
+'''
+Rate limits and daily quotas by api key and by client address
+
+Requests with a valid api key (``HEADER_API_KEY`` or one of ``API_KEYS``)
+are counted for their key, other ones for the client address (use a proxy
+fix middleware behind a reverse proxy). Each of them has a token bucket
+(``rate`` requests per second, up to ``burst`` at once) and a daily
+``quota``, 0 meaning no limit::
+
+    API_KEYS:
+        - {key: ..., name: crawler, rate: 50, burst: 200, quota: 1000000}
+    RATE_LIMIT_KEYS: {rate: 0, burst: 0, quota: 0}
+    RATE_LIMIT_ADDRESSES: {rate: 20, burst: 100, quota: 0}
+
+Counters are kept in a file mapped in memory (``RATE_LIMIT_FILE``, in
+``/dev/shm`` by default) shared by the workers of the host, each check
+taking a file lock: no external service is needed. Limited requests are
+answered with a 429, all responses carry ``X-RateLimit-*`` headers.
+'''
+import os
+import mmap
+import math
+import time
+import struct
+import hashlib
+import tempfile
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    # counters are then kept by process
+    fcntl = None
+
+from flask import current_app, request
+
+# default limits of api keys and client addresses
+RATE_LIMIT_KEYS = {'rate': 0, 'burst': 0, 'quota': 0}
+RATE_LIMIT_ADDRESSES = {'rate': 20, 'burst': 100, 'quota': 0}
+
+# default number of counters, least recently used ones are reused
+RATE_LIMIT_SLOTS = 4096
+
+# counter: identity hash, tokens, time of last request, day, requests of the day
+SLOT = struct.Struct('<Qddll')
+
+# slots probed for an identity
+PROBES = 8
+
+
+def identity_hash(identity):
+    value = int.from_bytes(hashlib.sha1(identity.encode('utf-8')).digest()[:8], 'little')
+    # 0 marks free slots
+    return value or 1
+
+
+def default_path():
+    directory = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    return os.path.join(directory, 'api_li3ds-ratelimit-{}'.format(os.getuid()))
+
+
+class Limit():
+    '''
+    Result of a check
+    '''
+
+    def __init__(self, allowed, burst, tokens, rate, quota, count, retry_after=0):
+        self.allowed = allowed
+        self.retry_after = retry_after
+        self.headers = {}
+        if rate:
+            self.headers.update({
+                'X-RateLimit-Limit': str(burst),
+                'X-RateLimit-Remaining': str(int(tokens)),
+                'X-RateLimit-Reset': str(int(math.ceil((burst - tokens) / rate))),
+            })
+        if quota:
+            self.headers.update({
+                'X-RateLimit-Quota-Limit': str(quota),
+                'X-RateLimit-Quota-Remaining': str(max(quota - count, 0)),
+            })
+        if not allowed:
+            self.headers['Retry-After'] = str(int(math.ceil(retry_after)))
+
+
+class Counters():
+    '''
+    Token buckets and daily counts stored in a memory mapped file
+    '''
+
+    def __init__(self, path=None, slots=RATE_LIMIT_SLOTS):
+        self.lock = threading.Lock()
+        self.map = None
+        self.fd = None
+        self.pid = None
+        self.configure(path, slots)
+
+    def configure(self, path=None, slots=RATE_LIMIT_SLOTS):
+        with self.lock:
+            self.close()
+            self.path = path
+            self.slots = slots
+
+    def open(self):
+        size = self.slots * SLOT.size
+        if fcntl is None:
+            self.map = mmap.mmap(-1, size)
+        else:
+            self.fd = os.open(self.path or default_path(), os.O_RDWR | os.O_CREAT, 0o600)
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+            try:
+                if os.fstat(self.fd).st_size != size:
+                    os.ftruncate(self.fd, size)
+            finally:
+                fcntl.flock(self.fd, fcntl.LOCK_UN)
+            self.map = mmap.mmap(self.fd, size)
+        self.pid = os.getpid()
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+        if self.fd is not None:
+            os.close(self.fd)
+        self.map = self.fd = self.pid = None
+
+    def after_fork(self):
+        '''
+        Reopen the file in a forked worker: file locks are not shared
+        with the parent process
+        '''
+        self.lock = threading.Lock()
+        self.close()
+
+    def take(self, identity, rate, burst, quota, now=None):
+        '''
+        Count a request of identity, returns a Limit
+        '''
+        now = now or time.time()
+        day = int(now // 86400)
+        key = identity_hash(identity)
+        with self.lock:
+            if self.pid != os.getpid():
+                # first use, or forked without running the post fork hook
+                self.close()
+                self.open()
+            if self.fd is not None:
+                fcntl.flock(self.fd, fcntl.LOCK_EX)
+            try:
+                offset = self.find(key)
+                found, tokens, last, slot_day, count = SLOT.unpack_from(self.map, offset)
+                if found != key:
+                    tokens, last, slot_day, count = burst, now, day, 0
+                if slot_day != day:
+                    count = 0
+                tokens = min(burst, tokens + max(now - last, 0) * rate)
+                retry_after = 0
+                if quota and count >= quota:
+                    retry_after = (day + 1) * 86400 - now
+                elif rate and tokens < 1:
+                    retry_after = (1 - tokens) / rate
+                else:
+                    count += 1
+                    if rate:
+                        tokens -= 1
+                SLOT.pack_into(self.map, offset, key, tokens, now, day, count)
+            finally:
+                if self.fd is not None:
+                    fcntl.flock(self.fd, fcntl.LOCK_UN)
+        return Limit(not retry_after, burst, tokens, rate, quota, count, retry_after)
+
+    def find(self, key):
+        '''
+        Offset of the slot of key: its own, a free one or the least
+        recently used of the probed ones
+        '''
+        start = key % self.slots
+        oldest = None
+        for probe in range(min(PROBES, self.slots)):
+            offset = ((start + probe) % self.slots) * SLOT.size
+            found, _, last, _, _ = SLOT.unpack_from(self.map, offset)
+            if found == key or found == 0:
+                return offset
+            if oldest is None or last < oldest[0]:
+                oldest = (last, offset)
+        return oldest[1]
+
+
+counters = Counters()
+
+
+def api_keys():
+    '''
+    Valid api keys and their settings
+    '''
+    config = current_app.config
+    keys = {config['HEADER_API_KEY']: {'name': 'default'}}
+    for settings in config.get('API_KEYS') or []:
+        keys[settings['key']] = settings
+    return keys
+
+
+def identity(key):
+    '''
+    Identity of the client of the current request, given the api key it
+    sent, and its limits
+    '''
+    config = current_app.config
+    settings = api_keys().get(key) if key else None
+    if settings is not None:
+        limits = dict(RATE_LIMIT_KEYS, **config.get('RATE_LIMIT_KEYS', {}))
+        name = 'key:{}'.format(settings.get('name', key))
+    else:
+        limits = dict(RATE_LIMIT_ADDRESSES, **config.get('RATE_LIMIT_ADDRESSES', {}))
+        settings = {}
+        name = 'address:{}'.format(request.remote_addr)
+    limits.update((field, settings[field]) for field in limits if field in settings)
+    return name, limits
+
+
+def check(key=None):
+    '''
+    Count the current request, returns a Limit or None if its client has
+    no limits
+    '''
+    name, limits = identity(key)
+    if not limits['rate'] and not limits['quota']:
+        return None
+    return counters.take(name, limits['rate'], limits['burst'] or 1, limits['quota'])
+
+
+def init_app(app):
+    counters.configure(
+        app.config.get('RATE_LIMIT_FILE'), app.config.get('RATE_LIMIT_SLOTS', RATE_LIMIT_SLOTS))
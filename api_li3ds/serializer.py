@@ -0,0 +1,190 @@
+'''
+Model serializers compiled to python functions
+
+``marshal`` gives the same output as :func:`flask_restplus.marshal` but each
+(model, mask) couple is turned once into a function reading row values
+directly, instead of walking field objects for every row.
+Values or fields the compiled functions do not handle are delegated to
+flask-restplus.
+'''
+import threading
+from collections import OrderedDict
+
+from flask_restplus import fields, marshal as restplus_marshal
+from flask_restplus.mask import apply as apply_mask
+
+# conversion of a non null value by field format method
+CONVERSIONS = {
+    fields.Raw.format: None,
+    fields.String.format: str,
+    fields.Integer.format: int,
+    fields.Float.format: float,
+    fields.Boolean.format: bool,
+}
+
+# row types read with the get method
+ROW_TYPES = (dict, OrderedDict)
+
+# maximum number of compiled serializers, masked models are not compiled
+# beyond this number
+MAX_SERIALIZERS = 1000
+
+# compiled serializers by (model id, mask)
+_serializers = {}
+_lock = threading.Lock()
+
+
+def field_instance(field):
+    return field() if isinstance(field, type) else field
+
+
+def is_plain(key, field):
+    '''
+    Return True if the output method of field only reads ``row[key]``
+    '''
+    if field.attribute is not None or field.mask is not None:
+        return False
+    # missing keys are read as attributes by flask-restplus
+    return not callable(field.default) and not hasattr(dict, key)
+
+
+def conversion(field):
+    '''
+    Return a function formatting non null values of a plain field
+    (None for no conversion)
+    '''
+    return CONVERSIONS.get(type(field).format, field.format)
+
+
+def compile_list(field):
+    '''
+    Return a function serializing the list value of a List field
+    '''
+    container = field.container
+    if type(container).output is not fields.Raw.output or \
+            container.attribute is not None or container.mask is not None or \
+            callable(container.default):
+        return None
+
+    convert = conversion(container)
+    empty = container.output(0, [None])
+    # flask-restplus reads dict items of typed lists as objects
+    accept_dicts = type(container) is fields.Raw
+
+    def serialize_list(value):
+        result = []
+        for item in value:
+            if item is None:
+                result.append(empty)
+            elif not accept_dicts and isinstance(item, dict):
+                raise TypeError('dict in a list of values')
+            else:
+                result.append(item if convert is None else convert(item))
+        return result
+    return serialize_list
+
+
+def compile_fields(model):
+    '''
+    Build a function serializing one row with the (resolved) fields of model
+    '''
+    model = getattr(model, 'resolved', model)
+    namespace = {
+        'OrderedDict': OrderedDict,
+        'ROW_TYPES': ROW_TYPES,
+        'fallback': lambda row: restplus_marshal(row, model),
+    }
+    lines = []
+    items = []
+    for index, (key, field) in enumerate(model.items()):
+        result = 'r{}'.format(index)
+        items.append('({!r}, {})'.format(key, result))
+
+        if isinstance(field, dict):
+            namespace['nested{}'.format(index)] = compile_fields(field)
+            lines.append('{} = nested{}(row)'.format(result, index))
+            continue
+
+        field = field_instance(field)
+        namespace['field{}'.format(index)] = field
+        plain = is_plain(key, field)
+        output = type(field).output
+
+        if plain and output is fields.Raw.output:
+            convert = conversion(field)
+            namespace['convert{}'.format(index)] = convert
+            namespace['empty{}'.format(index)] = field.output(key, {})
+            lines.append('{} = get({!r})'.format(result, key))
+            if convert is not None or namespace['empty{}'.format(index)] is not None:
+                lines.append('{0} = empty{1} if {0} is None else {2}'.format(
+                    result, index,
+                    result if convert is None else 'convert{}({})'.format(index, result)))
+        elif plain and output is fields.List.output and compile_list(field):
+            namespace['list{}'.format(index)] = compile_list(field)
+            lines.append('{} = get({!r})'.format(result, key))
+            lines.append(
+                '{0} = list{1}({0}) if type({0}) is list else field{1}.output({2!r}, row)'
+                .format(result, index, key))
+        elif plain and output is fields.Nested.output:
+            namespace['nested{}'.format(index)] = compile_fields(field.nested)
+            lines.append('{} = get({!r})'.format(result, key))
+            lines.append(
+                '{0} = field{1}.output({2!r}, row) if {0} is None else nested{1}({0})'
+                .format(result, index, key))
+        else:
+            lines.append('{} = field{}.output({!r}, row)'.format(result, index, key))
+
+    source = '\n'.join([
+        'def serialize_row(row):',
+        '    if type(row) not in ROW_TYPES:',
+        '        return fallback(row)',
+        '    get = row.get',
+        '    try:',
+    ] + ['        ' + line for line in lines or ['pass']] + [
+        '    except Exception:',
+        '        # let flask-restplus raise its own errors',
+        '        return fallback(row)',
+        '    return OrderedDict(({}{}))'.format(', '.join(items), ',' if len(items) == 1 else ''),
+        '',
+        'def serialize(data):',
+        '    if isinstance(data, (list, tuple)):',
+        '        return [serialize_row(row) for row in data]',
+        '    return serialize_row(data)',
+    ])
+    exec(compile(source, '<serializer {}>'.format(getattr(model, 'name', '')), 'exec'), namespace)
+    namespace['serialize'].source = source
+    return namespace['serialize']
+
+
+def serializer(model, mask=None):
+    '''
+    Return the compiled serializer of model with an optional mask (string),
+    compiling it on first use (None if too many serializers are compiled)
+    '''
+    key = (id(model), mask)
+    entry = _serializers.get(key)
+    if entry is None:
+        if mask and len(_serializers) >= MAX_SERIALIZERS:
+            return None
+        fields_ = apply_mask(getattr(model, 'resolved', model), mask, skip=True) \
+            if mask else model
+        # keep a reference to the model so that its id is not reused
+        entry = (model, compile_fields(fields_))
+        with _lock:
+            _serializers.setdefault(key, entry)
+    return entry[1]
+
+
+def marshal(data, model, envelope=None, mask=None):
+    '''
+    Compiled equivalent of :func:`flask_restplus.marshal`
+    '''
+    mask = mask or getattr(model, '__mask__', None)
+    serialize = serializer(model, mask or None) if not mask or isinstance(mask, str) else None
+    if serialize is None:
+        # mask objects are not compiled
+        return restplus_marshal(data, model, envelope, mask)
+    out = serialize(data)
+    if envelope:
+        out = OrderedDict([(envelope, out)])
+    return out
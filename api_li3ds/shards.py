@@ -0,0 +1,238 @@
+'''
+Routing of projects across several databases (shards)
+
+The primary database is the first shard, other ones are given by the
+``pg_shards`` setting, each with the names of the projects it holds::
+
+    pg_shards:
+        - pg_host: shard1
+          projects: [campaign_a, campaign_b]
+
+Projects, sessions, datasources and processing rows are stored on the shard
+of their project. Each shard allocates their identifiers in its own range
+(``SHARD_ID_RANGE`` identifiers, see the ``install`` command), so that the
+shard of a row is known from its identifier. Other tables (platforms,
+sensors, referentials, transformations) are written on the primary and must
+be replicated to other shards, as sessions and datasources reference them.
+
+Requests on an identifier or a project name are run on its shard, listings
+are run on all shards in parallel and merged.
+'''
+import argparse
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+
+from flask import current_app, copy_current_request_context, has_request_context, request
+from psycopg2 import sql
+
+from api_li3ds.database import Database
+from api_li3ds.exc import abort
+
+# default number of identifiers of each shard, must not change once
+# shards are installed
+SHARD_ID_RANGE = 10 ** 8
+
+# tables whose rows are stored on the shard of their project
+SHARDED_TABLES = ('project', 'session', 'datasource', 'processing')
+
+
+def shard_count():
+    return len(Database.shards) + 1
+
+
+def id_range():
+    return current_app.config.get('SHARD_ID_RANGE', SHARD_ID_RANGE)
+
+
+def id_shard(id):
+    '''
+    Shard of a sharded row identifier (the primary for unknown ranges)
+    '''
+    try:
+        shard = (int(id) - 1) // id_range()
+    except (TypeError, ValueError):
+        return 0
+    return shard if 0 <= shard < shard_count() else 0
+
+
+def project_shard(name):
+    '''
+    Shard of a project name
+    '''
+    for index, shard in enumerate(current_app.config.get('pg_shards') or [], 1):
+        if name in shard.get('projects', ()):
+            return index
+    return 0
+
+
+@contextmanager
+def on_shard(shard):
+    '''
+    Run the queries of the block on a shard
+    '''
+    current = getattr(Database.local, 'server', None)
+    server = Database.shards[shard - 1] if shard else None
+    if not shard and current not in Database.shards:
+        # the primary, or one of its replicas for get requests
+        yield
+        return
+    if server is not current and getattr(Database.local, 'transaction', False):
+        abort(400, 'a transaction cannot span several shards')
+    with Database.target(server):
+        yield
+
+
+def routed(shard):
+    '''
+    Decorator running a resource method on the shard returned by
+    ``shard(**kwargs)``, kwargs being the view arguments
+    '''
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with on_shard(shard(**kwargs)):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def by_id(id, **kwargs):
+    return id_shard(id)
+
+
+def by_name(name, **kwargs):
+    return project_shard(name)
+
+
+def by_payload(key, shard=id_shard):
+    '''
+    Shard of a field of the json payload, the primary if it is missing
+    '''
+    def payload_shard(**kwargs):
+        payload = request.get_json(silent=True)
+        if isinstance(payload, dict) and payload.get(key) is not None:
+            return shard(payload[key])
+        return 0
+    return payload_shard
+
+
+def run_on(shards, func):
+    '''
+    Run func on the given shards in parallel and return results in shards order
+    '''
+    shards = list(shards)
+    if len(shards) == 1 or getattr(Database.local, 'transaction', False):
+        results = []
+        for shard in shards:
+            with on_shard(shard):
+                results.append(func())
+        return results
+
+    # replica chosen for the primary
+    server = getattr(Database.local, 'server', None)
+
+    def run(shard):
+        with Database.target(server), on_shard(shard):
+            return func()
+
+    if has_request_context():
+        # a copy of the request context is used in each thread
+        tasks = [copy_current_request_context(run) for _ in shards]
+    else:
+        app = current_app._get_current_object()
+
+        def task(shard):
+            with app.app_context():
+                return run(shard)
+        tasks = [task] * len(shards)
+    with ThreadPoolExecutor(len(shards)) as executor:
+        return list(executor.map(lambda task, shard: task(shard), tasks, shards))
+
+
+def fanout(func):
+    '''
+    Run func (returning a list) on all shards and concatenate results
+    '''
+    return [row for rows in run_on(range(shard_count()), func) for row in rows]
+
+
+def by_ids(ids, func):
+    '''
+    Run func(ids) on identifiers grouped by shard and concatenate results
+    (in shards order, that is in identifiers order)
+    '''
+    groups = {}
+    for id in ids:
+        groups.setdefault(id_shard(id), []).append(id)
+    rows = []
+    for shard in sorted(groups):
+        with on_shard(shard):
+            rows.extend(func(groups[shard]))
+    return rows
+
+
+def scatter(items, shard, func):
+    '''
+    Run func on the items of each shard, shard(item) giving the shard
+    of an item, and return the results of func in items order
+    '''
+    groups = {}
+    for index, item in enumerate(items):
+        groups.setdefault(shard(item), []).append(index)
+    results = [None] * len(items)
+    for shard_, indexes in sorted(groups.items()):
+        with on_shard(shard_):
+            for index, result in zip(indexes, func([items[index] for index in indexes])):
+                results[index] = result
+    return results
+
+
+def versions(table_versions, tables):
+    '''
+    Versions of tables on all shards, None if one shard has no change log
+    '''
+    if not Database.shards:
+        return table_versions(tables)
+    found = run_on(range(shard_count()), lambda: table_versions(tables))
+    if any(shard_versions is None for shard_versions in found):
+        return None
+    return [version for shard_versions in found for version in shard_versions]
+
+
+def install():
+    '''
+    Restrict identifiers of sharded tables of each shard to its range
+    '''
+    size = id_range()
+    for shard in range(shard_count()):
+        with on_shard(shard):
+            for table in SHARDED_TABLES:
+                sequence = Database.query_aslist(
+                    "select pg_get_serial_sequence(%s, 'id')", ('li3ds.' + table,))[0]
+                last, called = Database.query(
+                    sql.SQL("select last_value, is_called from {}").format(sql.SQL(sequence)))[0]
+                low, high = shard * size + 1, (shard + 1) * size
+                if called and last >= high:
+                    raise RuntimeError('{} of shard {} is out of range'.format(sequence, shard))
+                start = max(low, last + 1 if called else last)
+                Database.rowcount(
+                    sql.SQL("alter sequence {} minvalue %s maxvalue %s start with %s "
+                            "restart with %s").format(sql.SQL(sequence)),
+                    (low, high, low, start))
+
+
+def main():
+    from api_li3ds import create_app
+
+    parser = argparse.ArgumentParser(description='Manage li3ds shards')
+    parser.add_argument('command', choices=('install',))
+    parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        install()
+
+
+if __name__ == '__main__':
+    main()
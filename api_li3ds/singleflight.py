@@ -0,0 +1,221 @@
+'''
+Coalescing of identical concurrent requests
+
+Threads asking for the same key while a computation is in flight wait for it
+and share its result instead of running it again.
+
+With the ``SINGLE_FLIGHT_SHARED`` setting, workers also elect a leader per key
+with a postgresql advisory lock: the leader stores its result in the unlogged
+``li3ds.flight_result`` table where other workers pick it up. Results are
+stored as json documents (body, status and headers of the response), never
+as pickles: the content of the table is not trusted.
+'''
+import json
+import time
+import base64
+import hashlib
+import threading
+from collections import defaultdict
+
+from flask import current_app
+from flask_restplus.representations import output_json
+from flask_restplus.utils import unpack
+from werkzeug.wrappers import BaseResponse
+
+from api_li3ds.cache import freeze
+from api_li3ds.database import Database
+
+# default number of seconds followers wait for another worker
+# and shared results are kept
+SINGLE_FLIGHT_TIMEOUT = 30
+
+# seconds between two checks of a follower waiting for another worker
+POLL_INTERVAL = 0.05
+
+# whether the result table exists, checked once
+_table_created = False
+
+create_sql = """
+    create unlogged table if not exists li3ds.flight_result (
+        key bigint primary key,
+        value bytea not null,
+        stored timestamptz not null default clock_timestamp(),
+        expires timestamptz not null
+    )
+"""
+
+result_sql = """
+    select value from li3ds.flight_result where key = %s and stored >= %s
+"""
+
+store_sql = """
+    with expired as (
+        delete from li3ds.flight_result where expires <= now()
+    )
+    insert into li3ds.flight_result (key, value, expires)
+    values (%(key)s, %(value)s, now() + %(timeout)s * interval '1 second')
+    on conflict (key) do update
+    set value = excluded.value, stored = excluded.stored, expires = excluded.expires
+"""
+
+
+class Call():
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight():
+    '''
+    Run at most one computation per key at a time in this process
+    '''
+
+    def __init__(self):
+        self.calls = {}
+        self.lock = threading.Lock()
+        self.shared = defaultdict(int)
+
+    def do(self, key, func):
+        '''
+        Return the result of func, computed by this thread or by the thread
+        already computing it for the same key.
+
+        Keys are tuples whose first element is the endpoint name.
+        '''
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = Call()
+            else:
+                self.shared[key[0]] += 1
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func()
+        except BaseException as error:
+            call.error = error
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.event.set()
+        return call.result
+
+    def after_fork(self):
+        '''
+        Forget calls in flight in the parent process
+        '''
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.shared.clear()
+
+    def stats(self):
+        '''
+        Return the number of shared results by endpoint
+        '''
+        with self.lock:
+            return dict(self.shared)
+
+
+def lock_key(key):
+    '''
+    Advisory lock identifier (signed 64 bits) of a key
+    '''
+    digest = hashlib.sha1(repr(key).encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big', signed=True)
+
+
+def dumps(result):
+    '''
+    Serialize a resource method result as a json document holding the body,
+    status and headers of its response
+    '''
+    if not (isinstance(result, tuple) and result and result[0] is BaseResponse):
+        result = freeze(output_json(*unpack(result)))
+    _, body, status, headers = result
+    return json.dumps({
+        'body': base64.b64encode(body).decode('ascii'),
+        'status': status,
+        'headers': headers,
+    }).encode('utf-8')
+
+
+def loads(value):
+    '''
+    Rebuild a response (see cache.thaw) from a json document made by dumps
+    '''
+    document = json.loads(bytes(value).decode('utf-8'))
+    return (
+        BaseResponse, base64.b64decode(document['body']), int(document['status']),
+        [(str(name), str(header)) for name, header in document['headers']],
+    )
+
+
+def shared_flight(key, func):
+    '''
+    Return the result of func computed by this worker if it gets the advisory
+    lock of key, or by the worker holding it
+    '''
+    # locks and results are shared on the primary, func may read from a replica
+    server = getattr(Database.local, 'server', None)
+
+    def compute():
+        with Database.target(server):
+            return func()
+
+    with Database.primary():
+        return _shared_flight(key, compute)
+
+
+def _shared_flight(key, func):
+    global _table_created
+    if not _table_created:
+        Database.rowcount(create_sql)
+        _table_created = True
+
+    lock = lock_key(key)
+    timeout = current_app.config.get('SINGLE_FLIGHT_TIMEOUT', SINGLE_FLIGHT_TIMEOUT)
+    deadline = time.monotonic() + timeout
+    since = None
+    # only try-locks are used: the shared connection is never blocked
+    while not Database.query_aslist("select pg_try_advisory_lock(%s)", (lock,))[0]:
+        if since is None:
+            # only results stored by the current leader are used
+            since = Database.query_aslist("select clock_timestamp()")[0]
+        else:
+            value = Database.query_aslist(result_sql, (lock, since))
+            if value:
+                return loads(value[0])
+        if time.monotonic() > deadline:
+            # leader is too slow, compute without it
+            return func()
+        time.sleep(POLL_INTERVAL)
+
+    try:
+        result = func()
+        Database.rowcount(store_sql, {
+            'key': lock, 'value': dumps(result), 'timeout': timeout
+        })
+        return result
+    finally:
+        Database.query("select pg_advisory_unlock(%s)", (lock,))
+
+
+def coalesce(key, func):
+    '''
+    Return the result of func, sharing it between identical concurrent calls
+    '''
+    if current_app.config.get('SINGLE_FLIGHT_SHARED'):
+        return flights.do(key, lambda: shared_flight(key, func))
+    return flights.do(key, func)
+
+
+flights = SingleFlight()
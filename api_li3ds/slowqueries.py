@@ -0,0 +1,251 @@
+'''
+Plans of slow queries
+
+Read-only queries slower than ``SLOW_QUERY_MS`` milliseconds are run again
+with ``EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON)`` by a background thread, on
+its own connection to the same server, in a read-only transaction rolled
+back afterwards. The first slow run of a query is always explained, next
+ones with the ``SLOW_QUERY_SAMPLING`` probability.
+
+The worst plan of each query is kept (``SLOW_QUERY_KEEP`` queries by worker)
+with the endpoint and the shape of its parameters (not their values), and
+sequential scans of li3ds tables larger than ``SLOW_QUERY_LARGE_TABLE``
+rows are flagged. Plans are served by the secured ``/monitoring/slowqueries/``
+endpoint, worst first.
+'''
+import re
+import json
+import time
+import queue
+import random
+import hashlib
+import logging
+import threading
+
+from flask import current_app, has_request_context, request
+from psycopg2 import connect, sql
+
+# default milliseconds from which a query is explained, 0 to disable
+SLOW_QUERY_MS = 1000
+
+# default probability of explaining a query already explained
+SLOW_QUERY_SAMPLING = 0.1
+
+# default number of queries whose worst plan is kept
+SLOW_QUERY_KEEP = 50
+
+# default estimated rows from which a table sequentially scanned is flagged
+SLOW_QUERY_LARGE_TABLE = 10000
+
+# queries waiting to be explained, others are dropped
+QUEUE_SIZE = 10
+
+# milliseconds an explain may run, relative to the slow query duration
+EXPLAIN_TIMEOUT_FACTOR = 10
+
+READ_ONLY = re.compile(r'^\s*(select|with|values|table)\b', re.IGNORECASE)
+
+# statements or functions with side effects, even in a read-only transaction
+SIDE_EFFECTS = re.compile(
+    r'\b(insert|update|delete|nextval|setval|\w*advisory\w*|pg_notify|set_config|'
+    r'pg_sleep|dblink\w*)\b', re.IGNORECASE)
+
+large_tables_sql = """
+    select c.relname, c.reltuples::bigint
+    from pg_class c
+    join pg_namespace n on n.oid = c.relnamespace
+    where n.nspname = 'li3ds' and c.relname = any(%s) and c.reltuples >= %s
+"""
+
+logger = logging.getLogger(__name__)
+
+
+def read_only(query):
+    return bool(READ_ONLY.match(query)) and not SIDE_EFFECTS.search(query)
+
+
+def shape(parameters):
+    '''
+    Types of parameters, with the length of lists
+    '''
+    def describe(value):
+        if isinstance(value, (list, tuple)):
+            return '{}[{}]'.format(type(value).__name__, len(value))
+        return type(value).__name__
+    if parameters is None:
+        return None
+    if hasattr(parameters, 'keys'):
+        return {name: describe(value) for name, value in parameters.items()}
+    return [describe(value) for value in parameters]
+
+
+def seq_scans(node):
+    '''
+    Relations sequentially scanned in a plan node and its children
+    '''
+    found = []
+    if node.get('Node Type') == 'Seq Scan' and 'Relation Name' in node:
+        found.append(node['Relation Name'])
+    for child in node.get('Plans', ()):
+        found.extend(name for name in seq_scans(child) if name not in found)
+    return found
+
+
+class Inspector():
+    '''
+    Explain slow queries in a background thread and keep the worst plans
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.queries = {}
+        self.queue = queue.Queue(QUEUE_SIZE)
+        self.thread = None
+        # connections of the background thread by dsn
+        self.connections = {}
+        self.dropped = 0
+
+    def inspect(self, cursor, query, parameters, seconds, dsn):
+        '''
+        Submit a query that ran for seconds if it is slow
+        '''
+        config = current_app.config
+        threshold = config.get('SLOW_QUERY_MS', SLOW_QUERY_MS)
+        milliseconds = seconds * 1000
+        if not threshold or milliseconds < threshold:
+            return
+        if isinstance(query, sql.Composable):
+            query = query.as_string(cursor)
+        if not read_only(query):
+            return
+        key = hashlib.sha1(query.encode('utf-8')).hexdigest()[:16]
+        with self.lock:
+            entry = self.queries.get(key)
+            if entry is not None:
+                entry['count'] += 1
+                sampling = config.get('SLOW_QUERY_SAMPLING', SLOW_QUERY_SAMPLING)
+                if entry['explaining'] or random.random() >= sampling:
+                    return
+            else:
+                entry = self.queries[key] = {
+                    'query': query, 'count': 1, 'duration_ms': 0, 'explaining': False}
+            entry['explaining'] = True
+        job = {
+            'key': key,
+            'query': query,
+            'parameters': parameters,
+            'dsn': dsn,
+            'duration_ms': round(milliseconds, 3),
+            'endpoint': request.endpoint if has_request_context() else None,
+            'keep': config.get('SLOW_QUERY_KEEP', SLOW_QUERY_KEEP),
+            'large': config.get('SLOW_QUERY_LARGE_TABLE', SLOW_QUERY_LARGE_TABLE),
+        }
+        self.start()
+        try:
+            self.queue.put_nowait(job)
+        except queue.Full:
+            with self.lock:
+                self.dropped += 1
+                self.done(key)
+
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='li3ds-explain')
+                self.thread.daemon = True
+                self.thread.start()
+
+    def run(self):
+        while True:
+            job = self.queue.get()
+            try:
+                self.explain(job)
+            except Exception:
+                logger.exception('slow query not explained')
+            finally:
+                with self.lock:
+                    self.done(job['key'])
+
+    def done(self, key):
+        '''
+        End the explain of a query, forgotten if it has no plan yet
+        '''
+        entry = self.queries.get(key)
+        if entry is not None:
+            entry['explaining'] = False
+            if 'plan' not in entry:
+                del self.queries[key]
+
+    def explain(self, job):
+        '''
+        Explain a query on its server and record its plan
+        '''
+        db = self.connections.get(job['dsn'])
+        if db is None or db.closed:
+            db = self.connections[job['dsn']] = connect(job['dsn'])
+        try:
+            with db.cursor() as cur:
+                cur.execute('set transaction read only')
+                cur.execute('set local statement_timeout = %s',
+                            (int(job['duration_ms'] * EXPLAIN_TIMEOUT_FACTOR) + 1,))
+                cur.execute('explain (analyze, buffers, format json) ' + job['query'],
+                            job['parameters'])
+                plan = cur.fetchone()[0]
+                if isinstance(plan, str):
+                    plan = json.loads(plan)
+                scanned = seq_scans(plan[0]['Plan'])
+                large = []
+                if scanned:
+                    cur.execute(large_tables_sql, (scanned, job['large']))
+                    large = [{'table': name, 'rows': rows} for name, rows in cur.fetchall()]
+        finally:
+            if not db.closed:
+                db.rollback()
+        self.record(job, plan, large)
+
+    def record(self, job, plan, large):
+        with self.lock:
+            entry = self.queries.get(job['key'])
+            if entry is None or job['duration_ms'] < entry['duration_ms']:
+                return
+            entry.update({
+                'endpoint': job['endpoint'],
+                'parameters': shape(job['parameters']),
+                'duration_ms': job['duration_ms'],
+                'execution_ms': plan[0].get('Execution Time'),
+                'seq_scans': large,
+                'plan': plan,
+                'explained_at': time.time(),
+            })
+            explained = [key for key, entry in self.queries.items() if 'plan' in entry]
+            for key in sorted(explained, key=lambda key: self.queries[key]['duration_ms'])[
+                    :max(len(explained) - job['keep'], 0)]:
+                del self.queries[key]
+
+    def stats(self):
+        '''
+        Explained queries, worst first
+        '''
+        with self.lock:
+            entries = [
+                dict((name, value) for name, value in entry.items() if name != 'explaining')
+                for entry in self.queries.values() if 'plan' in entry
+            ]
+            dropped = self.dropped
+        entries.sort(key=lambda entry: -entry['duration_ms'])
+        return {'dropped': dropped, 'queries': entries}
+
+    def after_fork(self):
+        '''
+        The background thread and its connections are not usable in
+        a forked worker
+        '''
+        self.lock = threading.Lock()
+        self.queue = queue.Queue(QUEUE_SIZE)
+        self.thread = None
+        self.connections = {}
+        for entry in self.queries.values():
+            entry['explaining'] = False
+
+
+inspector = Inspector()
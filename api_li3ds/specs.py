@@ -0,0 +1,107 @@
+'''
+Swagger specifications built and serialized once
+
+The specifications are built at startup (or on first request), serialized
+and compressed once by base path (the api root, behind the script name of
+the request), and served from memory with an etag.
+'''
+import gzip
+import json
+import hashlib
+from collections import Counter, namedtuple
+
+from flask import current_app, request
+
+# key of built specifications by base path in flask app extensions
+EXTENSION = 'api_li3ds_specs'
+
+# base paths whose specifications are kept
+MAX_BASE_PATHS = 16
+
+Specs = namedtuple('Specs', ('data', 'gzipped', 'etag'))
+
+
+def build(app, api, base_path=None):
+    '''
+    Build, serialize and compress the swagger specifications of api for app,
+    served under base_path (the one of an application root by default)
+    '''
+    with app.test_request_context('/'):
+        schema = dict(api.__schema__)
+    if base_path is not None:
+        schema['basePath'] = base_path
+    data = json.dumps(schema).encode('utf-8')
+    specs = Specs(data, gzip.compress(data), hashlib.sha1(data).hexdigest())
+    built = app.extensions.setdefault(EXTENSION, {})
+    if len(built) >= MAX_BASE_PATHS:
+        built.clear()
+    built[schema.get('basePath')] = specs
+    return specs
+
+
+def refs(value):
+    '''
+    Iterate over all $ref values of a json document
+    '''
+    if isinstance(value, dict):
+        for key, item in value.items():
+            if key == '$ref' and isinstance(item, str):
+                yield item
+            else:
+                yield from refs(item)
+    elif isinstance(value, list):
+        for item in value:
+            yield from refs(item)
+
+
+def validate(specs):
+    '''
+    Check built specifications, returns a list of problems
+    '''
+    schema = json.loads(specs.data.decode('utf-8'))
+    problems = []
+    for key in ('swagger', 'info', 'paths'):
+        if key not in schema:
+            problems.append('missing {}'.format(key))
+
+    definitions = schema.get('definitions', {})
+    for ref in sorted(set(refs(schema))):
+        if not ref.startswith('#/definitions/') or \
+                ref[len('#/definitions/'):] not in definitions:
+            problems.append('unresolved reference {}'.format(ref))
+
+    operations = [
+        (path, method, operation)
+        for path, item in schema.get('paths', {}).items()
+        for method, operation in item.items()
+        if isinstance(operation, dict) and method != 'parameters'
+    ]
+    for path, method, operation in operations:
+        if not operation.get('responses'):
+            problems.append('no response for {} {}'.format(method, path))
+    ids = Counter(operation.get('operationId') for _, _, operation in operations)
+    for operation_id, count in sorted(ids.items()):
+        if count > 1:
+            problems.append('duplicate operationId {}'.format(operation_id))
+    return problems
+
+
+def render(api):
+    '''
+    Response with the specifications of the current app, for the base path
+    of the current request
+    '''
+    app = current_app._get_current_object()
+    base_path = api.base_path
+    specs = app.extensions.get(EXTENSION, {}).get(base_path) or build(app, api, base_path)
+
+    if specs.etag in request.if_none_match:
+        response = app.response_class(status=304)
+    elif 'gzip' in request.accept_encodings:
+        response = app.response_class(specs.gzipped, mimetype='application/json')
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = app.response_class(specs.data, mimetype='application/json')
+    response.set_etag(specs.etag)
+    response.vary.add('Accept-Encoding')
+    return response
@@ -0,0 +1,240 @@
+'''
+Statement timeouts and cancellation of running queries
+
+Each endpoint has a budget, the number of milliseconds one of its queries
+may run: ``STATEMENT_TIMEOUT``, overriden by the ``statement_timeout``
+attribute of the resource and by endpoint with the ``STATEMENT_TIMEOUTS``
+setting. It is applied with ``SET LOCAL statement_timeout`` at the start of
+transactions. On autocommit connections used by a single thread, it is set
+for the session when it differs from the previous one. On the autocommit
+connection shared by threads, a session setting would apply to queries of
+other requests: ``SET LOCAL`` is sent with the statement (or with the
+EXECUTE of its prepared statement), both running in an implicit transaction,
+without any extra round trip. This needs postgresql >= 10: older servers
+ignore it with a warning, use ``DB_POOL_SIZE`` with them.
+
+Queries are also cancelled (``connection.cancel()``) by a watchdog thread
+when the request deadline passes (``REQUEST_TIMEOUT`` seconds after the
+start of the request) or when the client disconnects (detected with gunicorn
+and uWSGI). This needs a connection per thread (``DB_POOL_SIZE``) or a single
+threaded worker: on a connection shared between threads, the query of
+another request could be cancelled.
+
+Cancelled queries end requests with a 504.
+'''
+import time
+import select
+import socket
+import logging
+import threading
+import weakref
+from contextlib import contextmanager
+
+from flask import current_app, has_request_context, request
+
+from api_li3ds.exc import abort
+
+# default milliseconds a query may run, 0 for no limit
+STATEMENT_TIMEOUT = 0
+
+# default seconds a request may wait for the database, 0 for no limit
+REQUEST_TIMEOUT = 0
+
+# seconds between two checks of the watchdog
+CHECK_INTERVAL = 0.1
+
+# wsgi environ key of the request deadline (monotonic time)
+DEADLINE_KEY = 'api_li3ds.deadline'
+
+logger = logging.getLogger(__name__)
+
+
+def budget():
+    '''
+    Milliseconds the queries of the current endpoint may run, 0 for no limit
+    '''
+    config = current_app.config
+    default = config.get('STATEMENT_TIMEOUT', STATEMENT_TIMEOUT) or 0
+    if not has_request_context() or request.endpoint is None:
+        return default
+    view = current_app.view_functions.get(request.endpoint)
+    resource = getattr(view, 'view_class', None)
+    if getattr(resource, 'statement_timeout', None) is not None:
+        default = resource.statement_timeout
+    return config.get('STATEMENT_TIMEOUTS', {}).get(request.endpoint, default) or 0
+
+
+def start_request():
+    '''
+    Record the deadline of the current request
+    '''
+    seconds = current_app.config.get('REQUEST_TIMEOUT', REQUEST_TIMEOUT)
+    if seconds:
+        request.environ[DEADLINE_KEY] = time.monotonic() + seconds
+
+
+def deadline():
+    '''
+    Deadline of the current request, None if there is none
+    '''
+    if not has_request_context():
+        return None
+    return request.environ.get(DEADLINE_KEY)
+
+
+def client_socket():
+    '''
+    Socket of the client of the current request if the server gives it,
+    None otherwise
+    '''
+    if not has_request_context():
+        return None
+    sock = request.environ.get('gunicorn.socket')
+    if sock is not None:
+        return sock
+    try:
+        import uwsgi
+    except ImportError:
+        return None
+    # a duplicate, closed when the query ends
+    return socket.fromfd(uwsgi.connection_fd(), socket.AF_INET, socket.SOCK_STREAM)
+
+
+def disconnected(sock):
+    '''
+    Return True if the client closed its connection
+    '''
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+        return bool(readable) and sock.recv(1, socket.MSG_PEEK) == b''
+    except (OSError, ValueError):
+        return True
+
+
+# session statement_timeout of autocommit connections
+settings = weakref.WeakKeyDictionary()
+
+
+def apply(cursor, dedicated=True):
+    '''
+    Set the statement timeout of the current endpoint on the cursor connection,
+    or return the statement setting it to prepend to the query on a shared
+    connection ('' if none is needed)
+    '''
+    connection = cursor.connection
+    if not connection.autocommit:
+        # set at the start of the transaction
+        return ''
+    milliseconds = budget()
+    if not dedicated:
+        # the session setting of shared connections is never changed
+        return 'set local statement_timeout = {:d}; '.format(milliseconds) if milliseconds else ''
+    if settings.get(connection, 0) != milliseconds:
+        cursor.execute('set statement_timeout = %s', (milliseconds,))
+        settings[connection] = milliseconds
+    return ''
+
+
+def begin(connection):
+    '''
+    Set the statement timeout of the current endpoint for a transaction
+    '''
+    milliseconds = budget()
+    if milliseconds != settings.get(connection, 0):
+        connection.cursor().execute('set local statement_timeout = %s', (milliseconds,))
+
+
+class Watched():
+
+    def __init__(self, connection, deadline, client, dup):
+        self.connection = connection
+        self.deadline = deadline
+        self.client = client
+        # client is a duplicated socket to close
+        self.dup = dup
+
+
+class Watchdog():
+    '''
+    Cancel queries of requests past their deadline or whose client is gone
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.watched = {}
+        self.thread = None
+        self.cancelled = 0
+
+    @contextmanager
+    def watch(self, connection, dedicated=True):
+        '''
+        Watch the query run by the block on connection
+        '''
+        limit = deadline()
+        client = client_socket() if dedicated else None
+        if not dedicated or (limit is None and client is None):
+            yield
+            return
+        if limit is not None and limit <= time.monotonic():
+            abort(504, 'request deadline exceeded')
+        watched = Watched(
+            connection, limit, client,
+            client is not None and 'gunicorn.socket' not in request.environ)
+        with self.lock:
+            self.watched[id(watched)] = watched
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='li3ds-watchdog')
+                self.thread.daemon = True
+                self.thread.start()
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.watched.pop(id(watched), None)
+            if watched.dup:
+                watched.client.close()
+
+    def check(self, now=None):
+        '''
+        Cancel the queries which must stop
+        '''
+        now = now or time.monotonic()
+        with self.lock:
+            watched = list(self.watched.values())
+        for query in watched:
+            if query.deadline is not None and query.deadline <= now:
+                reason = 'request deadline exceeded'
+            elif query.client is not None and disconnected(query.client):
+                reason = 'client disconnected'
+            else:
+                continue
+            with self.lock:
+                if self.watched.pop(id(query), None) is None:
+                    # ended meanwhile
+                    continue
+                self.cancelled += 1
+            logger.warning('query cancelled: {}'.format(reason))
+            try:
+                query.connection.cancel()
+            except Exception:
+                logger.exception('query cancellation failed')
+
+    def run(self):
+        while True:
+            time.sleep(CHECK_INTERVAL)
+            self.check()
+
+    def after_fork(self):
+        '''
+        The watchdog thread is not running in a forked worker
+        '''
+        self.lock = threading.Lock()
+        self.watched = {}
+        self.thread = None
+
+
+watchdog = Watchdog()
+
+
+def init_app(app):
+    app.before_request(start_request)
@@ -0,0 +1,166 @@
+'''
+Payload validation with validators built once per model
+
+flask-restplus rebuilds the json schema of a model and a jsonschema validator
+for each validated object. Here validators are built on first use and cached,
+parent models are inlined so that no reference is resolved per object,
+and list payloads are validated item by item with the same validator.
+
+Schemas only using simple keywords are also compiled to python checks:
+jsonschema is then only run on objects they reject, to report errors.
+'''
+import numbers
+import threading
+
+from flask import request
+from flask_restplus import abort
+from jsonschema import Draft4Validator
+
+# maximum number of invalid items reported for a list payload
+MAX_REPORTED_ITEMS = 100
+
+# python checks of json schema types (draft 4)
+TYPE_CHECKS = {
+    'object': lambda value: isinstance(value, dict),
+    'array': lambda value: isinstance(value, list),
+    'string': lambda value: isinstance(value, str),
+    'integer': lambda value: isinstance(value, int) and not isinstance(value, bool),
+    'number': lambda value: isinstance(value, numbers.Number) and not isinstance(value, bool),
+    'boolean': lambda value: isinstance(value, bool),
+    'null': lambda value: value is None,
+}
+
+# schema keywords without effect on validation
+ANNOTATIONS = {'title', 'description', 'default', 'example', 'readOnly'}
+
+# validators and checks by model id
+_validators = {}
+_lock = threading.Lock()
+
+
+def inline_schema(model):
+    '''
+    Return the json schema of model with parent models inlined
+    '''
+    schema = model.__schema__
+    if not model.__parents__:
+        return schema
+    return {'allOf': [inline_schema(parent) for parent in model.__parents__] + [model._schema]}
+
+
+def compile_check(schema, resolver, format_checker=None, depth=0):
+    '''
+    Compile a json schema to a function returning True for valid values,
+    None if the schema uses keywords that are not supported
+    '''
+    if depth > 10:
+        return None
+    if '$ref' in schema:
+        _, schema = resolver.resolve(schema['$ref'])
+        return compile_check(schema, resolver, format_checker, depth + 1)
+
+    supported = ANNOTATIONS | {'type', 'properties', 'required', 'items', 'enum', 'allOf'}
+    if format_checker is None:
+        supported.add('format')
+    if set(schema) - supported or not isinstance(schema.get('type', ''), str):
+        return None
+
+    checks = []
+    if 'type' in schema:
+        if schema['type'] not in TYPE_CHECKS:
+            return None
+        checks.append(TYPE_CHECKS[schema['type']])
+    if 'enum' in schema:
+        enum = schema['enum']
+        # json schema does not consider booleans equal to numbers
+        checks.append(lambda value: any(
+            type(value) is type(item) and value == item for item in enum))
+    for sub_schema in schema.get('allOf', []):
+        check = compile_check(sub_schema, resolver, format_checker, depth + 1)
+        if check is None:
+            return None
+        checks.append(check)
+    if 'required' in schema:
+        required = schema['required']
+        checks.append(
+            lambda value: not isinstance(value, dict) or all(key in value for key in required))
+    if 'properties' in schema:
+        properties = {}
+        for key, sub_schema in schema['properties'].items():
+            properties[key] = compile_check(sub_schema, resolver, format_checker, depth + 1)
+            if properties[key] is None:
+                return None
+        checks.append(lambda value: not isinstance(value, dict) or all(
+            properties[key](item) for key, item in value.items() if key in properties))
+    if 'items' in schema:
+        if not isinstance(schema['items'], dict):
+            return None
+        item_check = compile_check(schema['items'], resolver, format_checker, depth + 1)
+        if item_check is None:
+            return None
+        checks.append(lambda value: not isinstance(value, list) or all(map(item_check, value)))
+
+    if len(checks) == 1:
+        return checks[0]
+    return lambda value: all(check(value) for check in checks)
+
+
+def validator(model, api):
+    '''
+    Return the cached validator of a model and its python check
+    (the validator is_valid method if the schema could not be compiled)
+    '''
+    entry = _validators.get(id(model))
+    if entry is None:
+        schema = inline_schema(model)
+        # nested models are still resolved with the api resolver
+        validator_ = Draft4Validator(
+            schema, resolver=api.refresolver, format_checker=api.format_checker)
+        check = compile_check(schema, api.refresolver, api.format_checker)
+        entry = (model, validator_, check or validator_.is_valid)
+        with _lock:
+            _validators.setdefault(id(model), entry)
+    return entry[1:]
+
+
+def errors(model, validator, data, prefix=''):
+    return dict(
+        (prefix + key if key else prefix.rstrip('.'), message)
+        for key, message in (model.format_error(e) for e in validator.iter_errors(data))
+    )
+
+
+def validate(model, api, data, collection=False):
+    '''
+    Validate data against a model, a list of objects if collection is true,
+    aborting with a 400 listing errors (prefixed with item indexes for lists)
+    '''
+    validator_, check = validator(model, api)
+
+    def is_valid(item):
+        # a rejected object is always checked again by jsonschema
+        return check(item) or validator_.is_valid(item)
+
+    if not collection:
+        if not is_valid(data):
+            abort(400, message='Input payload validation failed',
+                  errors=errors(model, validator_, data))
+        return
+
+    if not isinstance(data, list):
+        data = [data]
+    invalid = [index for index, item in enumerate(data) if not is_valid(item)]
+    if invalid:
+        found = {}
+        for index in invalid[:MAX_REPORTED_ITEMS]:
+            found.update(errors(model, validator_, data[index], '{}.'.format(index)))
+        abort(400, message='Input payload validation failed ({} invalid items)'
+                           .format(len(invalid)),
+              errors=found)
+
+
+def validate_payload(model, api, collection=False):
+    '''
+    Validate the json payload of the current request
+    '''
+    validate(model, api, request.get_json(), collection)
@@ -0,0 +1,76 @@
+'''
+Per worker initialization for pre-forking servers
+
+uWSGI (without lazy-apps) and gunicorn (with preload) create the application
+once and fork workers. Each worker must then drop the database connection
+and per process state inherited from the master.
+
+Hooks are registered by ``create_app``: ``os.register_at_fork`` (python >= 3.7)
+and the uWSGI ``postfork`` decorator. With gunicorn on older pythons, use
+``post_fork`` in the gunicorn configuration file (see
+``conf/gunicorn.sample.py``).
+'''
+import os
+import sys
+
+from api_li3ds.admission import admission
+from api_li3ds.cache import cache
+from api_li3ds.database import Database
+from api_li3ds.prepared import statements
+from api_li3ds.ratelimit import counters
+from api_li3ds.singleflight import flights
+from api_li3ds.slowqueries import inspector
+from api_li3ds.timeouts import watchdog
+
+# whether hooks are registered (once per process)
+_registered = False
+
+
+def server():
+    '''
+    Name of the pre-forking server running the application, or None
+    '''
+    if 'uwsgi' in sys.modules:
+        return 'uwsgi'
+    if 'gunicorn' in sys.modules or \
+            os.environ.get('SERVER_SOFTWARE', '').startswith('gunicorn'):
+        return 'gunicorn'
+    return None
+
+
+def after_fork():
+    '''
+    Reset per process state in a forked worker
+    '''
+    Database.after_fork()
+    cache.after_fork()
+    flights.after_fork()
+    statements.after_fork()
+    watchdog.after_fork()
+    admission.after_fork()
+    counters.after_fork()
+    inspector.after_fork()
+
+
+def post_fork(server, worker):
+    '''
+    gunicorn post_fork hook
+    '''
+    after_fork()
+
+
+def init_app(app):
+    '''
+    Register post fork hooks
+    '''
+    global _registered
+    name = server()
+    app.logger.debug('running with {}'.format(name or 'no pre-forking server'))
+    if _registered:
+        return
+    if hasattr(os, 'register_at_fork'):
+        os.register_at_fork(after_in_child=after_fork)
+    if name == 'uwsgi':
+        from uwsgidecorators import postfork
+        postfork(after_fork)
+    _registered = True
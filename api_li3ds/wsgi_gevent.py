@@ -0,0 +1,13 @@
+# -*- coding: utf-8 -*-
+# patch the standard library before anything else is imported
+from gevent import monkey
+monkey.patch_all()
+
+from api_li3ds import create_app, green  # noqa
+
+green.patch()
+app = create_app()
+
+if __name__ == '__main__':
+    from gevent.pywsgi import WSGIServer
+    WSGIServer(('0.0.0.0', 5000), app).serve_forever()
@@ -0,0 +1,131 @@
+'''
+Minimal fake PostgreSQL server answering every query after a delay
+
+Only the simple query protocol without authentication is implemented:
+each query returns a single json row (a sensor), transaction statements
+return no row and table existence checks return false. Used to measure how
+the api behaves with a slow database (foreign scans for instance) without
+a real server.
+
+Usage::
+
+    python benchmarks/_slowdb.py [--port 5433] [--delay 0.05]
+'''
+import json
+import time
+import struct
+import argparse
+import socketserver
+
+# oids of the json and boolean types
+JSON_OID = 114
+BOOL_OID = 16
+
+ROW = {
+    'id': 1, 'name': 'sensor', 'serial_number': '', 'brand': '', 'model': '',
+    'description': '', 'type': 'camera', 'specifications': {},
+}
+
+PARAMETERS = (
+    ('server_version', '9.6.0'),
+    ('server_encoding', 'UTF8'),
+    ('client_encoding', 'UTF8'),
+    ('DateStyle', 'ISO, MDY'),
+    ('integer_datetimes', 'on'),
+    ('standard_conforming_strings', 'on'),
+)
+
+# statements returning no row
+COMMANDS = ('BEGIN', 'COMMIT', 'ROLLBACK', 'SET', 'DISCARD')
+
+
+def message(kind, payload=b''):
+    return kind + struct.pack('!i', len(payload) + 4) + payload
+
+
+def cstring(value):
+    return value.encode('utf-8') + b'\0'
+
+
+class Handler(socketserver.BaseRequestHandler):
+
+    def read(self, size):
+        data = b''
+        while len(data) < size:
+            chunk = self.request.recv(size - len(data))
+            if not chunk:
+                raise EOFError
+            data += chunk
+        return data
+
+    def startup(self):
+        while True:
+            length, = struct.unpack('!i', self.read(4))
+            code, = struct.unpack('!i', self.read(4))
+            self.read(length - 8)
+            if code == 80877103:
+                # SSLRequest
+                self.request.sendall(b'N')
+                continue
+            break
+        out = message(b'R', struct.pack('!i', 0))
+        for name, value in PARAMETERS:
+            out += message(b'S', cstring(name) + cstring(value))
+        out += message(b'K', struct.pack('!ii', 1, 1))
+        out += message(b'Z', b'I')
+        self.request.sendall(out)
+
+    def reply(self, query):
+        command = query.strip().split(None, 1)[0].upper() if query.strip() else ''
+        if command in COMMANDS:
+            return message(b'C', cstring(command)) + message(b'Z', b'I')
+        if 'to_regclass' in query:
+            # optional tables (change counters) are not installed
+            oid, value = BOOL_OID, b'f'
+        else:
+            time.sleep(self.server.delay)
+            oid, value = JSON_OID, json.dumps(ROW).encode('utf-8')
+        return (
+            message(b'T', struct.pack('!h', 1) + cstring('value') +
+                    struct.pack('!ihihih', 0, 0, oid, -1, -1, 0)) +
+            message(b'D', struct.pack('!hi', 1, len(value)) + value) +
+            message(b'C', cstring('SELECT 1')) +
+            message(b'Z', b'I')
+        )
+
+    def handle(self):
+        try:
+            self.startup()
+            while True:
+                kind = self.read(1)
+                length, = struct.unpack('!i', self.read(4))
+                payload = self.read(length - 4)
+                if kind == b'X':
+                    return
+                if kind != b'Q':
+                    continue
+                self.request.sendall(self.reply(payload.rstrip(b'\0').decode('utf-8')))
+        except (EOFError, ConnectionError):
+            pass
+
+
+class Server(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, address, delay):
+        super().__init__(address, Handler)
+        self.delay = delay
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--port', type=int, default=5433)
+    parser.add_argument('--delay', type=float, default=0.05,
+                        help='seconds waited before answering a query')
+    args = parser.parse_args()
+    Server(('127.0.0.1', args.port), args.delay).serve_forever()
+
+
+if __name__ == '__main__':
+    main()
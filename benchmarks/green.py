@@ -0,0 +1,141 @@
+'''
+Load test of serving modes with a simulated slow database
+
+Starts the fake database of ``benchmarks/_slowdb.py``, then the api in a
+single process in each mode and sends concurrent requests to
+``/sensors/<id>/`` (one query per request):
+
+- sync: one request at a time (one worker without threads)
+- threads: one thread per request, ``DB_POOL_SIZE`` connections
+- green: gevent server with the psycopg2 wait callback, ``DB_POOL_SIZE``
+  connections
+
+Usage::
+
+    python benchmarks/green.py [--requests 400] [--concurrency 100] [--delay 0.05]
+'''
+import os
+import sys
+import time
+import socket
+import argparse
+import importlib.util
+import tempfile
+import subprocess
+import urllib.request
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = Path(__file__).resolve().parent.parent
+
+SETTINGS = '''
+flask:
+    DEBUG: False
+    pg_host: 127.0.0.1
+    pg_name: li3ds
+    pg_port: {db_port}
+    pg_user: li3ds
+    pg_password: li3ds
+    HEADER_API_KEY: li3dsli3dsli3dsli3dsli3dsli3ds
+    DB_POOL_SIZE: {pool_size}
+'''
+
+# serve the api on a port in a given mode
+SERVERS = {
+    'sync': '''
+from werkzeug.serving import run_simple
+from api_li3ds import create_app
+run_simple('127.0.0.1', {port}, create_app(), threaded=False)
+''',
+    'threads': '''
+from werkzeug.serving import run_simple
+from api_li3ds import create_app
+run_simple('127.0.0.1', {port}, create_app(), threaded=True)
+''',
+    'green': '''
+from gevent.pywsgi import WSGIServer
+from api_li3ds.wsgi_gevent import app
+WSGIServer(('127.0.0.1', {port}), app, log=None).serve_forever()
+''',
+}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_port(port, timeout=10):
+    end = time.time() + timeout
+    while time.time() < end:
+        try:
+            socket.create_connection(('127.0.0.1', port), 0.1).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError('port {} not opened'.format(port))
+
+
+def get(url):
+    with urllib.request.urlopen(url, timeout=60) as response:
+        response.read()
+        return response.status
+
+
+def run(mode, settings, requests, concurrency):
+    port = free_port()
+    env = dict(os.environ, API_LI3DS_SETTINGS=settings, PYTHONPATH=str(ROOT))
+    server = subprocess.Popen(
+        [sys.executable, '-c', SERVERS[mode].format(port=port)],
+        env=env, cwd=str(ROOT), stderr=subprocess.DEVNULL)
+    try:
+        wait_port(port)
+        url = 'http://127.0.0.1:{}/sensors/{{}}/'.format(port)
+        with ThreadPoolExecutor(concurrency) as executor:
+            # warm up: open the database connections
+            list(executor.map(get, [url.format(0)] * concurrency))
+            start = time.perf_counter()
+            # distinct ids, so that no request is coalesced
+            statuses = list(executor.map(get, (url.format(i) for i in range(1, requests + 1))))
+            elapsed = time.perf_counter() - start
+        assert all(status == 200 for status in statuses), statuses
+        return elapsed
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=400)
+    parser.add_argument('--concurrency', type=int, default=100)
+    parser.add_argument('--delay', type=float, default=0.05,
+                        help='seconds spent by the database on each query')
+    parser.add_argument('--pool-size', type=int, default=100)
+    parser.add_argument('--modes', nargs='+', default=sorted(SERVERS), choices=sorted(SERVERS))
+    args = parser.parse_args()
+    if 'green' in args.modes and importlib.util.find_spec('gevent') is None:
+        print('gevent is not installed, green mode skipped')
+        args.modes.remove('green')
+
+    db_port = free_port()
+    database = subprocess.Popen(
+        [sys.executable, str(ROOT / 'benchmarks' / '_slowdb.py'),
+         '--port', str(db_port), '--delay', str(args.delay)])
+    try:
+        wait_port(db_port)
+        with tempfile.NamedTemporaryFile('w', suffix='.yml') as settings:
+            settings.write(SETTINGS.format(db_port=db_port, pool_size=args.pool_size))
+            settings.flush()
+            for mode in args.modes:
+                elapsed = run(mode, settings.name, args.requests, args.concurrency)
+                print('{:8} {:6.0f} requests/s  ({} requests in {:.2f}s)'.format(
+                    mode, args.requests / elapsed, args.requests, elapsed))
+    finally:
+        database.terminate()
+        database.wait()
+
+
+if __name__ == '__main__':
+    main()
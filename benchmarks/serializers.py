@@ -0,0 +1,56 @@
+'''
+Compare compiled serializers with flask-restplus marshalling
+
+Usage::
+
+    python benchmarks/serializers.py [rows]
+'''
+import sys
+import timeit
+
+from flask import Flask
+from flask_restplus import marshal as restplus_marshal
+
+from api_li3ds.app import api, init_apis
+from api_li3ds.serializer import marshal
+
+ROWS = {
+    'Datasource Model': lambda id: {
+        'id': id, 'uri': 'file:///data/{}.las'.format(id), 'type': 'las',
+        'parameters': {'driver': 'las'}, 'bounds': [0.5, 1.5, 2.5, 3.5, 4.5, 5.5],
+        'capture_start': '2017-03-02T10:11:12.345+01:00',
+        'capture_end': '2017-03-02T10:21:12.345+01:00',
+        'referential': 3, 'session': 2,
+    },
+    'Transformation Model': lambda id: {
+        'id': id, 'source': 1, 'target': 2, 'transfo_type': 3,
+        'description': 'transformation {}'.format(id), 'parameters': [{'a': 1}],
+        'tdate': '2017-03-02T10:11:12+01', 'validity_start': '2017-01-01T00:00:00+00',
+        'validity_end': '2017-03-02T10:11:12.5+01',
+    },
+    'Sensor Model': lambda id: {
+        'id': id, 'name': 'sensor {}'.format(id), 'serial_number': 'sn{}'.format(id),
+        'brand': 'brand', 'model': 'model', 'description': '', 'type': 'camera',
+        'specifications': {'width': 1024},
+    },
+}
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    app = Flask('api_li3ds')
+    init_apis()
+    api.init_app(app)
+
+    for name, make_row in ROWS.items():
+        model = api.models[name]
+        rows = [make_row(id) for id in range(count)]
+        assert marshal(rows, model) == restplus_marshal(rows, model), name
+        restplus = min(timeit.repeat(lambda: restplus_marshal(rows, model), number=1, repeat=3))
+        compiled = min(timeit.repeat(lambda: marshal(rows, model), number=1, repeat=3))
+        print('{:<22} {} rows  flask-restplus {:.3f}s  compiled {:.3f}s  x{:.1f}'.format(
+            name, count, restplus, compiled, restplus / compiled))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+'''
+Measure cold start: import time, create_app time and time to first response,
+in fresh python processes. No database connection is needed.
+
+Exits with an error if the median total time exceeds the threshold.
+
+Usage::
+
+    python benchmarks/startup.py [--runs 5] [--threshold 1.0]
+'''
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# run in a fresh interpreter, prints timings as json
+PROBE = '''
+import json
+import time
+start = time.perf_counter()
+import api_li3ds
+imported = time.perf_counter()
+app = api_li3ds.create_app()
+created = time.perf_counter()
+response = app.test_client().get('/monitoring/cache/')
+assert response.status_code == 200, response.status_code
+answered = time.perf_counter()
+print(json.dumps({
+    'import': imported - start,
+    'create_app': created - imported,
+    'first_response': answered - created,
+    'total': answered - start,
+}))
+'''
+
+
+def probe(settings):
+    env = dict(os.environ, API_LI3DS_SETTINGS=str(settings), PYTHONPATH=str(ROOT))
+    output = subprocess.check_output(
+        [sys.executable, '-c', PROBE], env=env, cwd=str(ROOT), stderr=subprocess.DEVNULL)
+    return json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--threshold', type=float, default=1.0,
+                        help='maximum median total time in seconds')
+    parser.add_argument('--settings', default=ROOT / 'conf' / 'api_li3ds.sample.yml')
+    args = parser.parse_args()
+
+    runs = [probe(args.settings) for _ in range(args.runs)]
+    medians = {
+        step: statistics.median(run[step] for run in runs)
+        for step in ('import', 'create_app', 'first_response', 'total')
+    }
+    print('  '.join('{} {:.3f}s'.format(step, value) for step, value in medians.items()))
+    if medians['total'] > args.threshold:
+        print('cold start regression: {:.3f}s > {:.3f}s'.format(
+            medians['total'], args.threshold))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+'''
+Compare cached validators with flask-restplus payload validation
+on a bulk payload
+
+Usage::
+
+    python benchmarks/validation.py [items]
+'''
+import sys
+import timeit
+
+from flask import Flask
+
+from api_li3ds.app import api, init_apis
+from api_li3ds.validation import validate
+
+
+def restplus_validate(model, items):
+    # what flask-restplus does for a list expect
+    for item in items:
+        model.validate(item, api.refresolver, api.format_checker)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    app = Flask('api_li3ds')
+    init_apis()
+    api.init_app(app)
+
+    items = [
+        {'uri': 'file:///data/{}.las'.format(id), 'type': 'las',
+         'parameters': {'driver': 'las'}, 'bounds': [0.5, 1.5, 2.5, 3.5, 4.5, 5.5],
+         'capture_start': '2017-03-02T10:11:12.345+01:00',
+         'referential': 3, 'session': 2}
+        for id in range(count)
+    ]
+    with app.test_request_context():
+        for name in ('Datasource Model Post', 'Datasource Model'):
+            model = api.models[name]
+            restplus = min(timeit.repeat(
+                lambda: restplus_validate(model, items), number=1, repeat=3))
+            cached = min(timeit.repeat(
+                lambda: validate(model, api, items, collection=True), number=1, repeat=3))
+            print('{:<22} {} items  flask-restplus {:.3f}s  cached {:.3f}s  x{:.1f}'.format(
+                name, count, restplus, cached, restplus / cached))
+
+
+if __name__ == '__main__':
+    main()
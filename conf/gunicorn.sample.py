@@ -0,0 +1,10 @@
+# gunicorn -c conf/gunicorn.sample.py api_li3ds.wsgi:app
+import multiprocessing
+
+from api_li3ds.workers import post_fork  # noqa
+
+bind = 'localhost:5000'
+workers = multiprocessing.cpu_count()
+threads = 4
+preload_app = True
+raw_env = ['API_LI3DS_SETTINGS=/home/user/api-li3ds/conf/api_li3ds.yml']
@@ -31,6 +31,10 @@ prod_requirements = (
     'uwsgi'
 )
 
+gevent_requirements = (
+    'gevent',
+)
+
 
 def find_version(*file_paths):
     """
@@ -69,6 +73,7 @@ setup(
     extras_require={
         'dev': dev_requirements,
         'prod': prod_requirements,
+        'gevent': gevent_requirements,
         'doc': doc_requirements
     }
 )
@@ -22,6 +22,14 @@ def test(ctx):
     run('cd {0} && py.test'.format(HERE), pty=True)
 
 
+@task
+def bench(ctx):
+    '''Run benchmarks'''
+    for path in sorted(Path(HERE, 'benchmarks').glob('[!_]*.py')):
+        print(path.stem)
+        run('cd {0} && PYTHONPATH=. python {1}'.format(HERE, path), pty=True)
+
+
 @task
 def tox(ctx):
     '''Run test in all Python versions'''
@@ -1,9 +1,140 @@
+import os
+
 import pytest
+from flask import Flask
+from psycopg2 import OperationalError
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
 
 from api_li3ds import create_app
+from api_li3ds import ratelimit
+from api_li3ds.app import api, init_apis
+
+API_KEY = 'li3dsli3dsli3ds'
 
 
 @pytest.fixture
 def app():
     app = create_app()
     return app
+
+
+@pytest.fixture
+def api_app(tmpdir):
+    '''Application without database connection'''
+    app = Flask('api_li3ds')
+    app.config['HEADER_API_KEY'] = API_KEY
+    app.config['RATE_LIMIT_FILE'] = str(tmpdir.join('ratelimit'))
+    ratelimit.init_app(app)
+    init_apis()
+    api.init_app(app)
+    return app
+
+
+class FakeCursor():
+    '''Cursor of a FakeConnection'''
+    rowcount = 1
+    description = None
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.rows = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def execute(self, query, parameters=None):
+        connection = self.connection
+        # a connection must only be used by the process which opened it
+        if connection.pid != os.getpid():
+            connection.shared = True
+        connection.queries.append(query)
+        connection.executed.append((query, parameters))
+        # composed sql queries only match the empty prefix
+        text = query if isinstance(query, str) else ''
+        for failure in connection.failures:
+            prefix, error, times = failure
+            if text.startswith(prefix) and times != 0:
+                failure[2] = times - 1 if times else times
+                if isinstance(error, OperationalError):
+                    # the server closed the connection
+                    connection.closed = 2
+                raise error
+        if connection.servers is not None:
+            connection.servers.append(connection.dsn)
+        self.rows = next(
+            (rows for prefix, rows in connection.results if text.startswith(prefix)), [])
+
+    def fetchone(self):
+        return self.rows[0] if self.rows else None
+
+    def fetchall(self):
+        return list(self.rows)
+
+    def __iter__(self):
+        return iter(self.rows)
+
+
+class FakeConnection():
+    '''
+    Fake psycopg2 connection recording executed queries
+
+    Query results and errors are configured by query prefix
+    with ``result`` and ``fail``.
+    '''
+
+    def __init__(self, dsn=None, autocommit=True, servers=None):
+        self.dsn = dsn
+        self.autocommit = autocommit
+        # list shared by connections, recording the dsn of each query run
+        self.servers = servers
+        self.pid = os.getpid()
+        self.closed = 0
+        self.status = TRANSACTION_STATUS_IDLE
+        self.queries = []
+        self.executed = []
+        self.results = []
+        self.failures = []
+        self.committed = False
+        self.rolledback = False
+        self.rollbacks = 0
+        self.cancelled = False
+        self.shared = False
+
+    def result(self, prefix, rows):
+        '''Rows of queries starting with prefix'''
+        self.results.append((prefix, rows))
+
+    def fail(self, prefix, error, times=1):
+        '''Raise error on queries starting with prefix, always if times is None'''
+        self.failures.append([prefix, error, times])
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def get_transaction_status(self):
+        return self.status
+
+    def commit(self):
+        self.committed = True
+
+    def rollback(self):
+        if self.status is None:
+            raise OperationalError('connection lost')
+        self.rolledback = True
+        self.rollbacks += 1
+        self.status = TRANSACTION_STATUS_IDLE
+
+    def cancel(self):
+        self.cancelled = True
+
+    def close(self):
+        self.closed = 1
+
+
+@pytest.fixture
+def fake_connection():
+    '''Factory of fake database connections'''
+    return FakeConnection
@@ -0,0 +1,128 @@
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+import pytest
+
+from api_li3ds import app as app_module
+from api_li3ds.admission import admission, CostClass, Overloaded
+from api_li3ds.database import Database
+
+from conftest import API_KEY
+
+
+@pytest.fixture
+def limited(api_app):
+    admission.configure({'heavy': {'limit': 1, 'queue': 0, 'retry_after': 7}})
+    yield api_app
+    admission.configure()
+
+
+def wait_for(condition):
+    end = time.monotonic() + 5
+    while not condition() and time.monotonic() < end:
+        time.sleep(0.01)
+    assert condition()
+
+
+def test_overload():
+    cost = CostClass('heavy', limit=2, queue=2, wait=5)
+    release = threading.Event()
+    done = []
+
+    def request():
+        try:
+            cost.acquire()
+        except Overloaded:
+            done.append('rejected')
+            return
+        release.wait()
+        cost.release()
+        done.append('served')
+
+    threads = [threading.Thread(target=request) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    wait_for(lambda: cost.running == 2 and cost.waiting == 2)
+
+    # the queue is full
+    with pytest.raises(Overloaded) as error:
+        cost.acquire()
+    assert error.value.retry_after == 1
+
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert done == ['served'] * 4
+    stats = cost.stats()
+    assert (stats['admitted'], stats['queued'], stats['rejected']) == (4, 2, 1)
+    assert stats['running'] == 0 and stats['saturation'] == 0
+
+
+def test_queue_timeout():
+    cost = CostClass('heavy', limit=1, queue=1, wait=0.05)
+    cost.acquire()
+    with pytest.raises(Overloaded):
+        cost.acquire()
+    assert cost.waiting == 0 and cost.rejected == 1
+    cost.release()
+    cost.acquire()
+
+
+def test_saturated_class_rejected(limited, monkeypatch):
+    monkeypatch.setattr(app_module, 'table_versions', lambda tables: None)
+    client = limited.test_client()
+    heavy = admission.get('heavy')
+    heavy.acquire()
+    try:
+        resp = client.get('/transfotrees/1/preview/')
+        assert resp.status_code == 503
+        assert resp.headers['Retry-After'] == '7'
+
+        # cheap requests are still served
+        resp = client.get('/monitoring/admission/')
+        assert resp.status_code == 200
+        stats = json.loads(resp.get_data(as_text=True))
+        assert stats['heavy']['saturation'] == 1 and stats['heavy']['rejected'] == 1
+        assert stats['light']['limit'] == 0
+    finally:
+        heavy.release()
+
+
+def test_not_modified_not_admitted(limited, monkeypatch):
+    monkeypatch.setattr(app_module, 'table_versions', lambda tables: [3])
+    path = '/platforms/configs/1/preview/'
+    with limited.test_request_context(path):
+        etag = app_module.resource_etag(('platform',))
+    heavy = admission.get('heavy')
+    heavy.acquire()
+    try:
+        resp = limited.test_client().get(path, headers={'If-None-Match': '"{}"'.format(etag)})
+        assert resp.status_code == 304
+        assert heavy.rejected == 0
+    finally:
+        heavy.release()
+
+
+def test_batch_subrequests_not_admitted(limited, monkeypatch):
+    admitted = []
+    admit = admission.admit
+
+    def record(name):
+        admitted.append(name)
+        return admit(name)
+
+    monkeypatch.setattr(admission, 'admit', record)
+    monkeypatch.setattr(Database, 'transaction', contextmanager(lambda: (yield)))
+    monkeypatch.setattr(Database, 'query_asdict',
+                        lambda query, parameters=None: [dict(parameters, id=1)])
+    payload = {'requests': [
+        {'method': 'POST', 'path': '/sensors/', 'body': {'type': 'camera'}},
+        {'method': 'POST', 'path': '/sensors/', 'body': {'type': 'lidar'}},
+    ]}
+    resp = limited.test_client().post(
+        '/batch/', data=json.dumps(payload), content_type='application/json',
+        headers={'X-API-KEY': API_KEY})
+    assert resp.status_code == 200
+    assert admitted == ['normal']
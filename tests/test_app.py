@@ -0,0 +1,130 @@
+import json
+from contextlib import contextmanager
+
+import pytest
+from flask import Flask
+from psycopg2 import sql, ProgrammingError
+from werkzeug.exceptions import BadRequest
+
+from api_li3ds import app as app_module
+from api_li3ds.app import select_fields, requested_ids, ids_batch
+from api_li3ds.app import bulk_insert, bulk_payload, conflict_update
+from api_li3ds.database import Database
+from api_li3ds.apis.datasource import datasource_model
+
+
+@pytest.fixture
+def flask_app():
+    return Flask('api_li3ds')
+
+
+def test_select_fields_all(flask_app):
+    with flask_app.test_request_context('/'):
+        assert select_fields(datasource_model) == sql.SQL('*')
+        assert select_fields(datasource_model, 'd') == \
+            sql.SQL('{}.*').format(sql.Identifier('d'))
+
+
+def test_select_fields_subset(flask_app):
+    with flask_app.test_request_context('/?fields=id,uri'):
+        assert select_fields(datasource_model) == \
+            sql.SQL(', ').join([sql.Identifier('id'), sql.Identifier('uri')])
+
+
+def test_select_fields_unknown(flask_app):
+    with flask_app.test_request_context('/?fields=id,foo'):
+        with pytest.raises(BadRequest):
+            select_fields(datasource_model)
+
+
+def test_session_platform_fields(api_app, monkeypatch):
+    queries = []
+
+    def query_asjson(query, parameters=None):
+        queries.append(query)
+        return [{'name': 'stereopolis'}]
+
+    monkeypatch.setattr(Database, 'query_asjson', query_asjson)
+    monkeypatch.setattr(app_module, 'table_versions', lambda tables: None)
+    with api_app.test_client() as client:
+        response = client.get('/sessions/1/platform/?fields=name')
+    assert response.status_code == 200
+    assert json.loads(response.get_data(as_text=True)) == [{'name': 'stereopolis'}]
+    # only the requested column is read
+    assert "Identifier('p'), SQL('.'), Identifier('name')" in repr(queries[0])
+    assert '*' not in repr(queries[0])
+
+
+def test_requested_ids(flask_app):
+    with flask_app.test_request_context('/?ids=3,1,3,2'):
+        assert requested_ids() == [3, 1, 2]
+    with flask_app.test_request_context('/?ids=1,a'):
+        with pytest.raises(BadRequest):
+            requested_ids()
+    flask_app.config['MAX_BATCH_IDS'] = 2
+    with flask_app.test_request_context('/?ids=1,2,3'):
+        with pytest.raises(BadRequest):
+            requested_ids()
+    # duplicates are counted before being removed
+    with flask_app.test_request_context('/?ids=1,1,1'):
+        with pytest.raises(BadRequest):
+            requested_ids()
+
+
+def test_ids_batch(flask_app, monkeypatch):
+    monkeypatch.setattr(Database, 'query_asjson', lambda query, parameters: [
+        {'id': id} for id in sorted(parameters[0]) if id != 4
+    ])
+
+    @ids_batch('datasource', datasource_model)
+    def get():
+        return []
+
+    with flask_app.test_request_context('/?ids=5,4,1'):
+        rows, code, headers = get()
+    assert rows == [{'id': 5}, {'id': 1}]
+    assert headers == {'X-Missing-Ids': '4'}
+
+
+def test_bulk_payload(flask_app):
+    with flask_app.test_request_context(
+            '/?on_conflict=update', method='POST', data='[{"uri": "a"}]',
+            content_type='application/json'):
+        assert bulk_payload() == [{'uri': 'a'}]
+        assert conflict_update()
+    with flask_app.test_request_context(
+            '/?on_conflict=ignore', method='POST', data='{"uri": "a"}',
+            content_type='application/json'):
+        with pytest.raises(BadRequest):
+            bulk_payload()
+        with pytest.raises(BadRequest):
+            conflict_update()
+
+
+class NoUniqueIndex(ProgrammingError):
+    pgcode = '42P10'
+
+
+def test_bulk_insert(flask_app, monkeypatch):
+    calls = []
+
+    @contextmanager
+    def transaction():
+        calls.append('begin')
+        yield
+        calls.append('commit')
+
+    def insert_values(table, columns, items, conflict=None):
+        calls.append('insert')
+        if conflict:
+            raise NoUniqueIndex()
+        return [1]
+
+    monkeypatch.setattr(Database, 'transaction', transaction)
+    monkeypatch.setattr(Database, 'insert_values', insert_values)
+    with flask_app.test_request_context('/'):
+        assert bulk_insert('referential', ['name'], [{'name': 'a'}]) == [1]
+        assert calls == ['begin', 'insert', 'commit']
+        with pytest.raises(BadRequest) as error:
+            bulk_insert('referential', ['name'], [{'name': 'a'}], conflict=('name', 'sensor'))
+    assert 'unique index on referential (name, sensor)' in error.value.data['message']
@@ -0,0 +1,89 @@
+import json
+
+import pytest
+from werkzeug.exceptions import BadRequest
+
+from api_li3ds.cache import cache
+from api_li3ds.database import Database, Pool
+from api_li3ds.apis.batch import resolve
+
+from conftest import API_KEY
+
+
+@pytest.fixture
+def batch_app(api_app, fake_connection, monkeypatch):
+    # connection shared by threads, and the one checked out by batches
+    monkeypatch.setattr(Database, 'db', fake_connection())
+    monkeypatch.setattr(Database, 'checked_out', fake_connection(), raising=False)
+    monkeypatch.setattr(Database, 'spare', Pool(1, lambda: Database.checked_out))
+    return api_app
+
+
+def test_resolve(batch_app):
+    results = [{'status': 201, 'body': [{'id': 12, 'name': 'cam'}]}]
+    assert resolve({'sensor': '$0.id', 'name': 'ref of $0.name'}, results) == \
+        {'sensor': 12, 'name': 'ref of cam'}
+    assert resolve('/sensors/$0.id/', results) == '/sensors/12/'
+    with batch_app.app_context():
+        with pytest.raises(BadRequest):
+            resolve('$1.id', results)
+        with pytest.raises(BadRequest):
+            resolve('$0.foo', results)
+
+
+def test_batch(batch_app, monkeypatch):
+    created = []
+
+    def query_asdict(query, parameters=None):
+        created.append(dict(parameters))
+        return [dict(parameters, id=len(created))]
+
+    monkeypatch.setattr(Database, 'query_asdict', query_asdict)
+
+    payload = {'requests': [
+        {'method': 'POST', 'path': '/sensors/', 'body': {'type': 'camera'}},
+        {'method': 'POST', 'path': '/referentials/',
+         'body': {'name': 'camera', 'sensor': '$0.id'}},
+    ]}
+    resp = batch_app.test_client().post(
+        '/batch/', data=json.dumps(payload), content_type='application/json',
+        headers={'X-API-KEY': API_KEY})
+    assert resp.status_code == 200
+    results = json.loads(resp.get_data(as_text=True))
+    assert [result['status'] for result in results] == [201, 201]
+    assert created[1]['sensor'] == 1
+    assert Database.checked_out.committed
+    assert Database.checked_out.autocommit
+    # the shared connection is not part of the transaction
+    assert Database.db.autocommit and not Database.db.committed
+
+
+def test_batch_rollback(batch_app, monkeypatch):
+    monkeypatch.setattr(Database, 'query_asdict',
+                        lambda query, parameters=None: [dict(parameters, id=1)])
+
+    payload = {'requests': [
+        {'method': 'POST', 'path': '/sensors/', 'body': {'type': 'camera'}},
+        {'method': 'POST', 'path': '/referentials/', 'body': {'sensor': '$3.id'}},
+    ]}
+    resp = batch_app.test_client().post(
+        '/batch/', data=json.dumps(payload), content_type='application/json',
+        headers={'X-API-KEY': API_KEY})
+    assert resp.status_code == 400
+    assert Database.checked_out.rolledback
+    assert not Database.checked_out.committed
+
+
+def test_batch_subrequests_not_cached(batch_app, monkeypatch):
+    monkeypatch.setattr(Database, 'query_asjson',
+                        lambda query, parameters=None: [{'id': 1, 'type': 'camera'}])
+    batch_app.config['CACHE_TTL'] = {'sensors': 60}
+    cache.clear()
+
+    payload = {'requests': [{'method': 'GET', 'path': '/sensors/'}]}
+    resp = batch_app.test_client().post(
+        '/batch/', data=json.dumps(payload), content_type='application/json',
+        headers={'X-API-KEY': API_KEY})
+    assert resp.status_code == 200
+    # rows read in a transaction may never be committed
+    assert not cache.entries
@@ -0,0 +1,77 @@
+import pytest
+
+from api_li3ds import app as app_module
+from api_li3ds.cache import LRUCache, cache
+from api_li3ds.database import Database
+from conftest import API_KEY
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    cache.clear()
+    yield
+    cache.clear()
+
+
+def test_lru_eviction():
+    lru = LRUCache(maxsize=2)
+    lru.set(('a', 1), 1, 60)
+    lru.set(('a', 2), 2, 60)
+    assert lru.get(('a', 1)) == 1
+    lru.set(('a', 3), 3, 60)
+    assert lru.get(('a', 2)) is None
+    assert lru.get(('a', 1)) == 1
+    assert lru.stats()['endpoints']['a'] == {'hits': 2, 'misses': 1}
+
+
+def test_ttl_and_invalidation():
+    lru = LRUCache()
+    lru.set(('a', 1), 1, -1)
+    assert lru.get(('a', 1)) is None
+    lru.set(('a', 1), 1, 60, 'sensors')
+    lru.set(('b', 1), 2, 60, 'platforms')
+    lru.invalidate('sensors')
+    assert lru.get(('a', 1)) is None
+    assert lru.get(('b', 1)) == 2
+
+
+def test_cached_endpoint(api_app, monkeypatch):
+    queries = []
+
+    def query_asjson(query, parameters=None):
+        queries.append(query)
+        return [{'id': 1, 'name': 'affine'}]
+
+    monkeypatch.setattr(Database, 'query_asjson', query_asjson)
+    monkeypatch.setattr(Database, 'query_asdict', lambda query, parameters=None: {'id': 2})
+    monkeypatch.setattr(app_module, 'table_versions', lambda tables: None)
+    client = api_app.test_client()
+
+    assert client.get('/transfos/types/').status_code == 200
+    assert client.get('/transfos/types/').status_code == 200
+    assert len(queries) == 1
+    assert client.get('/transfos/types/?fields=id').status_code == 200
+    assert len(queries) == 2
+
+    # a successful write invalidates the namespace
+    resp = client.post('/transfos/types/', headers={'X-API-KEY': API_KEY},
+                       data='{"name": "spline"}', content_type='application/json')
+    assert resp.status_code == 201
+    client.get('/transfos/types/')
+    assert len(queries) == 3
+
+
+def test_cache_ttl_setting(api_app, monkeypatch):
+    queries = []
+
+    def query_asjson(query, parameters=None):
+        queries.append(query)
+        return []
+
+    monkeypatch.setattr(Database, 'query_asjson', query_asjson)
+    monkeypatch.setattr(app_module, 'table_versions', lambda tables: None)
+    api_app.config['CACHE_TTL'] = {'transfotypes': 0}
+    client = api_app.test_client()
+    client.get('/transfos/types/')
+    client.get('/transfos/types/')
+    assert len(queries) == 2
@@ -0,0 +1,40 @@
+import pytest
+from flask import Flask
+from werkzeug.exceptions import BadRequest
+
+from api_li3ds import calibration
+from api_li3ds.database import Database
+
+
+@pytest.fixture
+def flask_app():
+    return Flask('api_li3ds')
+
+
+def test_resolve(flask_app):
+    ids = {'cam': 12}
+    assert calibration.resolve('cam', ids, 'sensor') == 12
+    assert calibration.resolve(3, ids, 'sensor') == 3
+    assert calibration.resolve(None, ids, 'sensor') is None
+    with flask_app.app_context():
+        with pytest.raises(BadRequest):
+            calibration.resolve('lidar', ids, 'sensor')
+
+
+def test_insert(monkeypatch):
+    statements = []
+
+    def values_asdict(query, values):
+        statements.append(values)
+        return [{'id': 100 + i} for i in range(len(values))]
+
+    monkeypatch.setattr(Database, 'values_asdict', values_asdict)
+
+    ids = calibration.insert('referential', calibration.referential_columns, [
+        {'key': 'a', 'name': 'a', 'sensor': 1},
+        {'name': 'no key'},
+        {'key': 'c', 'name': 'c', 'srid': 4326},
+    ])
+    assert ids == {'a': 100, 'c': 102}
+    assert len(statements) == 1
+    assert statements[0][2] == ('c', None, 4326, None)
@@ -0,0 +1,104 @@
+import pytest
+from flask import Flask
+from werkzeug.exceptions import BadRequest
+
+from api_li3ds import changes
+from api_li3ds.database import Database, Server
+
+
+@pytest.fixture
+def flask_app():
+    return Flask('api_li3ds')
+
+
+def test_parse_token(flask_app):
+    assert changes.parse_token('10:12:11;15:15:;42') == ('10:12:11', '15:15:', 42)
+    assert changes.parse_token('15:15:;;0') == ('15:15:', None, 0)
+    with flask_app.app_context():
+        with pytest.raises(BadRequest):
+            changes.parse_token('15:15:')
+
+
+def test_feed_pages(monkeypatch):
+    calls = []
+
+    def query_asjson(query, parameters):
+        calls.append(parameters)
+        seqs = [seq for seq in range(1, 6) if seq > parameters['after']]
+        return [{'seq': seq} for seq in seqs][:parameters['limit']]
+
+    monkeypatch.setattr(Database, 'query_asjson', query_asjson)
+    monkeypatch.setattr(Database, 'query_aslist', lambda query: ['20:20:'])
+
+    page = changes.feed(limit=3)
+    assert [c['seq'] for c in page['changes']] == [1, 2, 3]
+    assert page['more']
+    assert page['next'] == '1:1:;20:20:;3'
+
+    page = changes.feed(page['next'], limit=3)
+    assert [c['seq'] for c in page['changes']] == [4, 5]
+    assert not page['more']
+    assert page['next'] == '20:20:;;0'
+
+
+def test_versions_checked_by_server(monkeypatch):
+    checks = []
+
+    def query_aslist(query, parameters=None):
+        checks.append(Database.current_dsn())
+        return [Database.current_dsn() == 'primary']
+
+    monkeypatch.setattr(Database, 'query_aslist', query_aslist)
+    monkeypatch.setattr(Database, 'query',
+                        lambda query, parameters=None: [(12, None), (0, None)])
+    monkeypatch.setattr(Database, 'dsn', 'primary')
+    monkeypatch.setattr(changes, 'versions_installed', {})
+
+    assert changes.table_versions(['sensor', 'platform']) == [12, 0]
+    assert changes.table_versions(['sensor', 'platform']) == [12, 0]
+    with Database.target(Server('replica')):
+        assert changes.table_versions(['sensor']) is None
+    assert checks == ['primary', 'replica']
+
+
+class ChangeLog():
+    '''
+    Committed changes of a table as seen by versions_sql
+    '''
+
+    def __init__(self):
+        self.committed = []
+        self.removed = 0
+
+    def query(self, query, parameters=None):
+        assert query == changes.versions_sql
+        return [(len(self.committed), self.removed or None)]
+
+    def compact(self, count):
+        del self.committed[:count]
+        self.removed += count
+
+
+def test_versions_change_on_late_commit(monkeypatch):
+    log = ChangeLog()
+    monkeypatch.setattr(Database, 'query', log.query)
+    monkeypatch.setattr(Database, 'dsn', 'primary')
+    monkeypatch.setattr(changes, 'versions_installed', {'primary': True})
+    seen = set()
+
+    def version():
+        found = changes.table_versions(['sensor'])[0]
+        assert found not in seen
+        seen.add(found)
+
+    # T1 takes sequence 100, T2 takes 101 and commits first
+    log.committed.append(101)
+    version()
+    # the late commit of T1 does not raise the last sequence
+    log.committed.append(100)
+    version()
+    # compactions do not bring a previous version back
+    log.compact(1)
+    assert changes.table_versions(['sensor']) == [2]
+    log.committed.append(102)
+    version()
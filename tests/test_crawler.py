@@ -0,0 +1,124 @@
+import struct
+import datetime
+from contextlib import contextmanager
+
+from api_li3ds import crawler
+from api_li3ds.database import Database, copy_value
+
+
+def test_capture_start():
+    assert crawler.capture_start('LANDINS_20170516_075157_PP.sbet') == \
+        datetime.datetime(2017, 5, 16, 7, 51, 57, tzinfo=datetime.timezone.utc)
+    assert crawler.capture_start('image.jpg') is None
+
+
+def test_datasource_type():
+    assert crawler.datasource_type('img_001.JPG') == 'image'
+    assert crawler.datasource_type('cloud.laz') == 'pointcloud'
+    assert crawler.datasource_type('notes.txt') is None
+
+
+def test_copy_value():
+    assert copy_value(None) == '\\N'
+    assert copy_value([1.0, 2.5]) == '{1.0,2.5}'
+    assert copy_value('a\tb\\c') == 'a\\tb\\\\c'
+    assert copy_value({'size': 1}) == '{"size": 1}'
+
+
+def make_tree(tmpdir):
+    las = bytearray(b'LASF' + b'\0' * 300)
+    struct.pack_into('<6d', las, 179, 10, 1, 20, 2, 30, 3)
+    tmpdir.mkdir('cam').join('img_20170516_075157.jpg').write('jpg')
+    tmpdir.mkdir('lidar').mkdir('deep').join('cloud.las').write_binary(bytes(las))
+    tmpdir.join('readme.txt').write('ignored')
+
+
+def test_crawl(tmpdir):
+    make_tree(tmpdir)
+    files = {f['uri']: f for f in crawler.crawl(str(tmpdir), workers=2)}
+    assert len(files) == 2
+    cloud = files['file://' + str(tmpdir.join('lidar', 'deep', 'cloud.las'))]
+    assert cloud['type'] == 'pointcloud'
+    assert cloud['bounds'] == [1, 2, 3, 10, 20, 30]
+
+
+def test_register_incremental(tmpdir, monkeypatch):
+    make_tree(tmpdir)
+    table = []
+
+    def query(query, parameters=None):
+        return [
+            Row(id=i, uri=row[0], size=row[2]['size'], mtime=row[2]['mtime'])
+            for i, row in enumerate(table)
+        ]
+
+    class Row():
+        def __init__(self, **kwargs):
+            self.__dict__.update(kwargs)
+
+    @contextmanager
+    def transaction():
+        yield
+
+    monkeypatch.setattr(Database, 'query', query)
+    monkeypatch.setattr(Database, 'transaction', transaction)
+    monkeypatch.setattr(Database, 'copy', lambda table_, columns, rows: table.extend(rows))
+
+    assert crawler.register(str(tmpdir), 1, 2) == {'inserted': 2, 'updated': 0, 'skipped': 0}
+    assert crawler.register(str(tmpdir), 1, 2) == {'inserted': 0, 'updated': 0, 'skipped': 2}
+
+
+def test_register_modified(tmpdir, monkeypatch):
+    make_tree(tmpdir)
+    table = {}
+
+    class Row():
+        def __init__(self, **kwargs):
+            self.__dict__.update(kwargs)
+
+    def query(query, parameters=None):
+        return [
+            Row(id=id, uri=row[0], size=row[2]['size'], mtime=row[2]['mtime'])
+            for id, row in table.items()
+        ]
+
+    def copy(table_, columns, rows):
+        for row in rows:
+            table[len(table) + 1] = row
+
+    def values_asdict(query, values, template=None, page_size=1000):
+        assert 'from (values %s)' in query
+        for id, uri, params, bounds, start in values:
+            table[id] = (uri, table[id][1], params, bounds, start) + table[id][5:]
+        return []
+
+    @contextmanager
+    def transaction():
+        yield
+
+    monkeypatch.setattr(Database, 'query', query)
+    monkeypatch.setattr(Database, 'transaction', transaction)
+    monkeypatch.setattr(Database, 'copy', copy)
+    monkeypatch.setattr(Database, 'values_asdict', values_asdict)
+
+    crawler.register(str(tmpdir), 1, 2)
+    ids = {row[0]: id for id, row in table.items()}
+    tmpdir.join('cam', 'img_20170516_075157.jpg').write('modified jpg')
+    assert crawler.register(str(tmpdir), 1, 2) == {'inserted': 0, 'updated': 1, 'skipped': 1}
+    # updated in place, identifiers referenced by processings are kept
+    assert {row[0]: id for id, row in table.items()} == ids
+    image = table[ids['file://' + str(tmpdir.join('cam', 'img_20170516_075157.jpg'))]]
+    assert image[2]['size'] == len('modified jpg')
+
+
+def test_crawl_outside_root(api_app, tmpdir):
+    from conftest import API_KEY
+    tmpdir.mkdir('root')
+    tmpdir.mkdir('root2')
+    api_app.config['CRAWLER_ROOT'] = str(tmpdir.join('root'))
+    with api_app.test_client() as client:
+        response = client.post(
+            '/datasources/crawl/', headers={'X-API-KEY': API_KEY},
+            json={'directory': '../root2', 'session': 1, 'referential': 2})
+    assert response.status_code == 400
+    assert b'is not a directory under' in response.data
@@ -0,0 +1,95 @@
+import threading
+
+from flask import Flask
+from psycopg2.extensions import TRANSACTION_STATUS_INTRANS
+
+from api_li3ds import database, green
+from api_li3ds.database import Database, Pool
+
+
+def make_app(**config):
+    app = Flask('api_li3ds')
+    app.config.update(pg_user='u', pg_password='p', pg_host='h', pg_port=5432, pg_name='n')
+    app.config.update(config)
+    return app
+
+
+def test_lazy_connection(fake_connection, monkeypatch):
+    calls = []
+
+    def connect(dsn, **kwargs):
+        calls.append(dsn)
+        return fake_connection(autocommit=False)
+
+    monkeypatch.setattr(database, 'connect', connect)
+    monkeypatch.setattr(Database, 'db', None)
+    monkeypatch.setattr(Database, 'dsn', None)
+    monkeypatch.setattr(Database, 'pool', None)
+    app = make_app()
+
+    Database.init_app(app)
+    assert calls == []
+    connection = Database.connection()
+    assert connection is Database.connection()
+    assert connection.autocommit
+    assert calls == ['postgresql://u:p@h:5432/n']
+
+
+def test_pool_connection_per_thread(fake_connection, monkeypatch):
+    monkeypatch.setattr(database, 'connect', lambda dsn, **kwargs: fake_connection())
+    monkeypatch.setattr(Database, 'pool', None)
+    app = make_app(DB_POOL_SIZE=2)
+    Database.init_app(app)
+
+    connections = []
+
+    def request():
+        with app.app_context():
+            connection = Database.connection()
+            assert connection is Database.connection()
+            connections.append(connection)
+
+    request()
+    request()
+    # released at the end of the app context and reused
+    assert connections[0] is connections[1]
+    assert Database.pool.idle == [connections[0]]
+
+    with app.app_context():
+        first = Database.connection()
+        thread = threading.Thread(target=request)
+        thread.start()
+        thread.join()
+        assert connections[2] is not first
+    assert sorted(map(id, Database.pool.idle)) == sorted(map(id, (first, connections[2])))
+
+
+def test_pool_release(fake_connection):
+    pool = Pool(1, fake_connection)
+    connection = pool.acquire()
+    assert not pool.available.acquire(blocking=False)
+
+    connection.status = TRANSACTION_STATUS_INTRANS
+    connection.autocommit = False
+    pool.release(connection)
+    assert connection.rollbacks == 1 and connection.autocommit
+    assert pool.idle == [connection]
+
+    # broken connections are not reused
+    assert pool.acquire() is connection
+    connection.status = None
+    pool.release(connection)
+    assert connection.closed and pool.idle == []
+    assert pool.acquire() is not connection
+
+
+def test_green_mode_has_a_pool(monkeypatch):
+    app = Flask('api_li3ds')
+    green.init_app(app)
+    assert not app.config.get('DB_POOL_SIZE')
+    monkeypatch.setattr(green, 'patched', lambda: True)
+    green.init_app(app)
+    assert app.config['DB_POOL_SIZE'] == green.DB_POOL_SIZE
+    app.config['DB_POOL_SIZE'] = 5
+    green.init_app(app)
+    assert app.config['DB_POOL_SIZE'] == 5
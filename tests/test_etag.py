@@ -0,0 +1,41 @@
+from api_li3ds import app as app_module
+from api_li3ds.database import Database
+
+
+def test_etag(api_app, monkeypatch):
+    queries = []
+
+    def query_asjson(query, parameters=None):
+        queries.append(query)
+        return [{'id': 1, 'type': 'camera'}]
+
+    monkeypatch.setattr(Database, 'query_asjson', query_asjson)
+    monkeypatch.setattr(app_module, 'table_versions', lambda tables: [3])
+    client = api_app.test_client()
+
+    resp = client.get('/sensors/')
+    assert resp.status_code == 200
+    etag = resp.headers['ETag']
+    assert len(queries) == 1
+
+    resp = client.get('/sensors/', headers={'If-None-Match': etag})
+    assert resp.status_code == 304
+    assert len(queries) == 1
+
+    # other query arguments give another etag
+    resp = client.get('/sensors/?fields=id', headers={'If-None-Match': etag})
+    assert resp.status_code == 200
+
+    # a write bumps the table counter
+    monkeypatch.setattr(app_module, 'table_versions', lambda tables: [4])
+    resp = client.get('/sensors/', headers={'If-None-Match': etag})
+    assert resp.status_code == 200
+    assert resp.headers['ETag'] != etag
+
+
+def test_no_etag_without_counters(api_app, monkeypatch):
+    monkeypatch.setattr(Database, 'query_asjson', lambda query, parameters=None: [])
+    monkeypatch.setattr(app_module, 'table_versions', lambda tables: None)
+    resp = api_app.test_client().get('/sensors/')
+    assert resp.status_code == 200
+    assert 'ETag' not in resp.headers
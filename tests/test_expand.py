@@ -0,0 +1,60 @@
+import pytest
+from flask import Flask
+from werkzeug.exceptions import BadRequest
+
+from api_li3ds.database import Database
+from api_li3ds.expand import parse_expand, expand_rows, expandable
+from api_li3ds.apis.project import project_relations
+
+
+@pytest.fixture
+def flask_app():
+    return Flask('api_li3ds')
+
+
+def test_parse_expand(flask_app):
+    with flask_app.test_request_context('/?expand=sessions.datasources.processing,sessions'):
+        tree = parse_expand(project_relations)
+        assert list(tree) == ['sessions']
+        datasources = tree['sessions'][1]
+        assert list(datasources) == ['datasources']
+        assert list(datasources['datasources'][1]) == ['processing']
+
+
+def test_parse_expand_unknown(flask_app):
+    with flask_app.test_request_context('/?expand=sessions.foo'):
+        with pytest.raises(BadRequest):
+            parse_expand(project_relations)
+
+
+def test_expand_rows_query_count(flask_app, monkeypatch):
+    queries = []
+
+    def query_asjson(query, parameters=None):
+        queries.append(parameters)
+        ids = parameters[0]
+        # two children per parent
+        return [
+            {'id': parent * 10 + i, 'project': parent, 'session': parent, 'target': parent}
+            for parent in ids for i in range(2)
+        ]
+
+    monkeypatch.setattr(Database, 'query_asjson', query_asjson)
+
+    with flask_app.test_request_context('/?expand=sessions.datasources.processing'):
+        rows = [{'id': i} for i in range(1, 50)]
+        expand_rows(rows, parse_expand(project_relations))
+
+    assert len(queries) == 3
+    assert len(rows[0]['sessions']) == 2
+    assert len(rows[0]['sessions'][0]['datasources']) == 2
+    assert len(rows[0]['sessions'][0]['datasources'][0]['processing']) == 2
+
+
+def test_expand_fields_with_spaces(flask_app):
+    view = expandable(project_relations)(lambda: [])
+    with flask_app.test_request_context('/?expand=sessions&fields=name, id'):
+        assert view() == []
+    with flask_app.test_request_context('/?expand=sessions&fields=name'):
+        with pytest.raises(BadRequest):
+            view()
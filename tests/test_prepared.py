@@ -0,0 +1,131 @@
+import pytest
+from psycopg2 import Error
+
+from api_li3ds import prepared
+from api_li3ds.prepared import Statements, convert
+
+from conftest import API_KEY
+
+QUERY = 'select * from li3ds.sensor where id = %s'
+
+
+class StatementError(Error):
+    pgcode = '26000'
+
+
+class ResultTypeError(Error):
+    pgcode = '0A000'
+
+
+@pytest.fixture
+def cursor(fake_connection):
+    return new_cursor(fake_connection)
+
+
+def new_cursor(fake_connection):
+    connection = fake_connection()
+    connection.result('explain', [('Seq Scan on sensor',), ('Planning Time: 0.500 ms',)])
+    return connection.cursor()
+
+
+@pytest.mark.parametrize('query, parameters, expected', [
+    (QUERY, (1,), ('select * from li3ds.sensor where id = $1', [1])),
+    ('select %(a)s, %(b)s, %(a)s', {'a': 1, 'b': 2}, ('select $1, $2, $1', [1, 2])),
+    ("select 'x' like 'a%%' and %s", [True], ("select 'x' like 'a%' and $1", [True])),
+    ('create table a (b int)', (1,), None),
+    ('select %s; select 1', (1,), None),
+    ('select %s, %s', (1,), None),
+])
+def test_convert(query, parameters, expected):
+    assert convert(query, parameters) == expected
+
+
+def test_prepared_after_threshold(fake_connection, cursor):
+    statements = Statements()
+    assert not statements.execute(cursor, QUERY, (1,), threshold=3)
+    assert not statements.execute(cursor, QUERY, (2,), threshold=3)
+    assert cursor.connection.queries == []
+    assert statements.execute(cursor, QUERY, (3,), threshold=3)
+    assert statements.execute(cursor, QUERY, (4,), threshold=3)
+    name = statements.name(QUERY)
+    assert cursor.connection.queries == [
+        'explain (summary) ' + QUERY,
+        'prepare {} as select * from li3ds.sensor where id = $1'.format(name),
+        'execute {} (%s)'.format(name),
+        'execute {} (%s)'.format(name),
+    ]
+    stats = statements.stats()
+    assert stats['executions'] == 2 and stats['saved_ms'] == 1.0
+
+    # prepared at once on another connection
+    other = new_cursor(fake_connection)
+    assert statements.execute(other, QUERY, (5,), threshold=3)
+    assert other.connection.queries[0].startswith('prepare')
+    assert statements.stats()['connections'] == 2
+
+
+def test_not_prepared_in_transaction(cursor):
+    statements = Statements()
+    cursor.connection.autocommit = False
+    for id in range(5):
+        assert not statements.execute(cursor, QUERY, (id,), threshold=1)
+    assert cursor.connection.queries == []
+
+
+def test_least_recently_used_deallocated(cursor):
+    statements = Statements()
+    queries = ['select %s', 'select %s + 1', 'select %s + 2']
+    for query in queries:
+        statements.execute(cursor, query, (1,), threshold=1, size=2)
+    assert 'deallocate ' + statements.name(queries[0]) in cursor.connection.queries
+    assert list(statements.prepared[cursor.connection]) == [
+        statements.name(query) for query in queries[1:]]
+
+
+def test_prepared_again_when_dropped(cursor):
+    statements = Statements()
+    statements.execute(cursor, QUERY, (1,), threshold=1)
+    cursor.connection.fail('execute', StatementError('prepared statement does not exist'))
+    del cursor.connection.queries[:]
+    assert statements.execute(cursor, QUERY, (2,), threshold=1)
+    assert [query.split()[0] for query in cursor.connection.queries] == [
+        'execute', 'prepare', 'execute']
+
+
+def test_prepared_again_when_result_type_changed(cursor):
+    statements = Statements()
+    statements.execute(cursor, QUERY, (1,), threshold=1)
+    cursor.connection.fail('execute', ResultTypeError('cached plan must not change result type'))
+    del cursor.connection.queries[:]
+    assert statements.execute(cursor, QUERY, (2,), threshold=1)
+    assert [query.split()[0] for query in cursor.connection.queries] == [
+        'execute', 'deallocate', 'prepare', 'execute']
+
+
+def test_statistics_bounded(cursor, monkeypatch):
+    monkeypatch.setattr(prepared, 'KEPT_STATISTICS', 2)
+    monkeypatch.setattr(prepared, 'COUNTED_QUERIES', 2)
+    statements = Statements()
+    queries = ['select %s + {}'.format(index) for index in range(4)]
+    for query in queries:
+        statements.execute(cursor, query, (1,), threshold=1)
+    assert [query for query, _, _ in statements.statistics.values()] == queries[2:]
+    cursor.connection.fail('prepare', Error('syntax error'), times=None)
+    for query in queries:
+        assert not statements.execute(cursor, query + ' + 1', (1,), threshold=1)
+    assert list(statements.unpreparable) == [query + ' + 1' for query in queries[2:]]
+
+
+def test_statements_endpoint_secured(api_app):
+    client = api_app.test_client()
+    assert client.get('/monitoring/statements/').status_code == 401
+    resp = client.get('/monitoring/statements/', headers={'X-API-KEY': API_KEY})
+    assert resp.status_code == 200
+
+
+def test_prefix_sent_with_execute(cursor):
+    statements = Statements()
+    prefix = 'set local statement_timeout = 50; '
+    assert statements.execute(cursor, QUERY, (1,), threshold=1, prefix=prefix)
+    assert cursor.connection.queries[-1] == \
+        prefix + 'execute {} (%s)'.format(statements.name(QUERY))
@@ -0,0 +1,69 @@
+import json
+import time
+import marshal
+
+import pytest
+
+from api_li3ds import profiler
+
+from conftest import API_KEY
+
+
+@pytest.fixture
+def profiled(api_app, tmpdir):
+    api_app.config['PROFILE_DIR'] = str(tmpdir.join('profiles'))
+    profiler.init_app(api_app)
+    return api_app
+
+
+def test_profile_on_demand(profiled):
+    client = profiled.test_client()
+    assert profiler.PROFILE_ID_HEADER not in client.get('/monitoring/cache/').headers
+    resp = client.get('/monitoring/cache/', headers={'X-Profile': 'unknownunknown'})
+    assert profiler.PROFILE_ID_HEADER not in resp.headers
+
+    resp = client.get('/monitoring/cache/', headers={'X-Profile': API_KEY})
+    assert resp.status_code == 200
+    id = resp.headers[profiler.PROFILE_ID_HEADER]
+
+    auth = {'X-API-KEY': API_KEY}
+    assert client.get('/profiles/').status_code == 401
+    listed = json.loads(client.get('/profiles/', headers=auth).get_data(as_text=True))
+    assert [(meta['id'], meta['path'], meta['format']) for meta in listed] == [
+        (id, '/monitoring/cache/', 'pstats')]
+
+    resp = client.get('/profiles/{}/'.format(id), headers=auth)
+    assert resp.mimetype == 'application/octet-stream'
+    stats = marshal.loads(resp.get_data())
+    assert any(function[2] == 'stats' for function in stats)
+    resp = client.get('/profiles/{}/?format=text'.format(id), headers=auth)
+    assert 'function calls' in resp.get_data(as_text=True)
+    assert client.get('/profiles/unknown/', headers=auth).status_code == 404
+
+
+def test_sampling_and_pruning(profiled):
+    profiled.config.update(PROFILE_SAMPLING=1, PROFILE_KEEP=2)
+    client = profiled.test_client()
+    ids = [client.get('/monitoring/cache/').headers[profiler.PROFILE_ID_HEADER]
+           for _ in range(3)]
+    with profiled.app_context():
+        assert sorted(meta['id'] for meta in profiler.profiles()) == sorted(ids[1:])
+
+
+def busy(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+def test_sampler(tmpdir):
+    sampler = profiler.Sampler(0.001)
+    sampler.enable()
+    busy(0.05)
+    sampler.disable()
+    path = str(tmpdir.join('stacks'))
+    sampler.dump_stats(path)
+    lines = open(path).read().splitlines()
+    assert lines and all(line.rsplit(' ', 1)[1].isdigit() for line in lines)
+    assert any('test_profiler.py:busy' in line for line in lines)
+    assert not sampler.thread.is_alive()
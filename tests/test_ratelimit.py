@@ -0,0 +1,97 @@
+import os
+
+import pytest
+from werkzeug.exceptions import HTTPException
+
+from api_li3ds.app import api
+from api_li3ds.ratelimit import Counters
+
+from conftest import API_KEY
+
+OTHER_KEY = 'otherkeyotherkey'
+
+
+@pytest.fixture
+def counters(tmpdir):
+    counters = Counters(str(tmpdir.join('counters')), slots=16)
+    yield counters
+    counters.close()
+
+
+def test_token_bucket(counters):
+    now = 1000000.0
+    assert counters.take('a', 1, 2, 0, now).allowed
+    limit = counters.take('a', 1, 2, 0, now)
+    assert limit.allowed and limit.headers['X-RateLimit-Remaining'] == '0'
+    limit = counters.take('a', 1, 2, 0, now + 0.5)
+    assert not limit.allowed and limit.headers['Retry-After'] == '1'
+    # other identities have their own bucket
+    assert counters.take('b', 1, 2, 0, now).allowed
+    assert counters.take('a', 1, 2, 0, now + 1).allowed
+
+
+def test_daily_quota(counters):
+    day = 86400 * 20000
+    assert counters.take('a', 0, 1, 2, day + 10).allowed
+    limit = counters.take('a', 0, 1, 2, day + 20)
+    assert limit.allowed and limit.headers == {
+        'X-RateLimit-Quota-Limit': '2', 'X-RateLimit-Quota-Remaining': '0'}
+    limit = counters.take('a', 0, 1, 2, day + 30)
+    assert not limit.allowed and limit.retry_after == 86400 - 30
+    assert counters.take('a', 0, 1, 2, day + 86400).allowed
+
+
+def test_slots_reused(counters):
+    for index in range(100):
+        counters.take(str(index), 1, 1, 0, 1000.0 + index)
+    # the last identities are still counted
+    assert not counters.take('99', 1, 1, 0, 1099.5).allowed
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='fork not available')
+def test_shared_between_processes(counters):
+    counters.take('a', 1, 3, 0, 1000.0)
+    pid = os.fork()
+    if pid == 0:
+        code = 1
+        try:
+            counters.after_fork()
+            code = 0 if counters.take('a', 1, 3, 0, 1000.0).allowed else 1
+        finally:
+            os._exit(code)
+    assert os.waitpid(pid, 0)[1] == 0
+    assert counters.take('a', 1, 3, 0, 1000.0).allowed
+    assert not counters.take('a', 1, 3, 0, 1000.0).allowed
+
+
+def test_rate_limit_headers(api_app):
+    api_app.config.update(
+        RATE_LIMIT_ADDRESSES={'rate': 0.01, 'burst': 2},
+        API_KEYS=[{'key': OTHER_KEY, 'name': 'script', 'quota': 10}],
+    )
+    client = api_app.test_client()
+    resp = client.get('/monitoring/cache/')
+    assert resp.status_code == 200
+    assert resp.headers['X-RateLimit-Limit'] == '2'
+    assert resp.headers['X-RateLimit-Remaining'] == '1'
+    client.get('/monitoring/cache/')
+    resp = client.get('/monitoring/cache/')
+    assert resp.status_code == 429 and int(resp.headers['Retry-After']) > 0
+
+    # requests with an api key are counted for the key
+    resp = client.get('/monitoring/cache/', headers={'X-API-KEY': API_KEY})
+    assert resp.status_code == 200 and 'X-RateLimit-Limit' not in resp.headers
+    resp = client.get('/monitoring/cache/', headers={'X-API-KEY': OTHER_KEY})
+    assert resp.headers['X-RateLimit-Quota-Remaining'] == '9'
+
+
+def test_api_keys(api_app):
+    api_app.config['API_KEYS'] = [{'key': OTHER_KEY, 'name': 'script'}]
+    secured = api.secure(lambda: 'ok')
+    for key in (API_KEY, OTHER_KEY):
+        with api_app.test_request_context('/', headers={'X-API-KEY': key}):
+            assert secured() == 'ok'
+    with api_app.test_request_context('/', headers={'X-API-KEY': 'unknownunknown'}):
+        with pytest.raises(HTTPException) as error:
+            secured()
+    assert error.value.code == 401
@@ -0,0 +1,128 @@
+from collections import namedtuple
+
+import pytest
+from psycopg2 import OperationalError
+
+from api_li3ds import app as app_module
+from api_li3ds import database
+from api_li3ds.database import Database
+
+from conftest import API_KEY
+
+Row = namedtuple('Row', ('value',))
+
+PRIMARY = 'postgresql://u:p@primary:5432/li3ds'
+REPLICAS = ('postgresql://u:p@replica1:5432/li3ds', 'postgresql://u:p@replica2:5432/li3ds')
+
+
+@pytest.fixture
+def replicated(api_app, fake_connection, monkeypatch):
+    # dsn of each query
+    queries = []
+    # dsns of unreachable servers
+    down = set()
+    connections = []
+
+    def connect(dsn, **kwargs):
+        if dsn in down:
+            raise OperationalError('could not connect to server')
+        connection = fake_connection(dsn, servers=queries)
+        connection.result('', [Row({'id': 1, 'type': 'camera'})])
+        connections.append(connection)
+        return connection
+
+    def lose(dsn):
+        '''Close connections to a server on their next query'''
+        for connection in connections:
+            if connection.dsn == dsn:
+                connection.fail('', OperationalError('server closed the connection unexpectedly'),
+                                times=None)
+
+    monkeypatch.setattr(database, 'connect', connect)
+    monkeypatch.setattr(app_module, 'table_versions', lambda tables: None)
+    for name in ('db', 'pid', 'pool', 'spare', 'replicas', 'local'):
+        monkeypatch.setattr(Database, name, getattr(Database, name))
+    api_app.config.update(
+        pg_user='u', pg_password='p', pg_host='primary', pg_port=5432, pg_name='li3ds',
+        pg_replicas=[{'pg_host': 'replica1'}, REPLICAS[1]],
+        # fake connections do not prepare statements
+        PREPARED_STATEMENTS=0,
+    )
+    Database.init_app(api_app)
+    return api_app, queries, down, lose
+
+
+def test_reads_on_replicas(replicated):
+    app, queries, _, _ = replicated
+    client = app.test_client()
+    for id in range(4):
+        assert client.get('/sensors/{}/'.format(id)).status_code == 200
+    assert sorted(queries) == sorted(REPLICAS * 2)
+    assert queries[0] != queries[1]
+
+
+def test_reads_on_primary_after_write(replicated):
+    app, queries, _, _ = replicated
+    client = app.test_client()
+    resp = client.post('/sensors/', json={'type': 'camera'}, headers={'X-API-KEY': API_KEY})
+    assert resp.status_code == 201
+    assert queries == [PRIMARY]
+    assert app_module.PRIMARY_COOKIE in resp.headers['Set-Cookie']
+
+    client.get('/sensors/1/')
+    assert queries[-1] == PRIMARY
+
+    # other clients still read from replicas
+    app.test_client().get('/sensors/1/')
+    assert queries[-1] in REPLICAS
+
+    app.config['DB_PRIMARY_AFTER_WRITE'] = 0
+    client.post('/sensors/', json={'type': 'camera'}, headers={'X-API-KEY': API_KEY})
+    client.get('/sensors/1/')
+    assert queries[-1] in REPLICAS
+
+
+def test_replica_ejection(replicated, monkeypatch):
+    app, queries, down, _ = replicated
+    down.add(REPLICAS[0])
+    client = app.test_client()
+    for id in range(4):
+        assert client.get('/sensors/{}/'.format(id)).status_code == 200
+    # the failed read is done on the primary, then only replica2 is used
+    assert REPLICAS[0] not in queries
+    assert queries.count(REPLICAS[1]) == 3 and queries.count(PRIMARY) == 1
+    replica = Database.replicas[0]
+    assert not replica.healthy() and replica.ejections == 1
+
+    # used again once the retry delay is over
+    down.clear()
+    replica.ejected_until = 0
+    client.get('/sensors/1/')
+    client.get('/sensors/2/')
+    assert REPLICAS[0] in queries[-2:]
+
+
+def test_lost_replica(replicated):
+    app, queries, _, lose = replicated
+    client = app.test_client()
+    client.get('/sensors/1/')
+    failed = queries[-1]
+    lose(failed)
+    del queries[:]
+
+    # the query is run again on the primary
+    assert client.get('/sensors/1/').status_code == 200
+    assert client.get('/sensors/1/').status_code == 200
+    assert client.get('/sensors/1/').status_code == 200
+    assert PRIMARY in queries and failed not in queries
+
+
+def test_no_replica_in_transaction(replicated):
+    app, queries, _, _ = replicated
+    with app.app_context():
+        with Database.transaction():
+            with Database.read_replica():
+                Database.query('select 1')
+        with Database.read_replica():
+            Database.query('select 1')
+    assert queries[0] == PRIMARY and queries[1] in REPLICAS
@@ -0,0 +1,90 @@
+from collections import OrderedDict
+
+import pytest
+from flask_restplus import fields, marshal as restplus_marshal
+
+from api_li3ds import fields as li3ds_fields
+from api_li3ds.app import api
+from api_li3ds.serializer import marshal, serializer
+
+
+VALUES = {
+    fields.Integer: [1, '2', None],
+    fields.Float: [1.5, 2, None],
+    fields.String: ['name', 3, None],
+    fields.Boolean: [True, 0, None],
+    fields.DateTime: ['2011-10-05T17:31:16.32+02', '2017-01-01T00:00:00Z', None],
+    fields.List: [[1, 2, None], [], None],
+    fields.Raw: [{'a': 1}, [1, 'b'], None],
+}
+
+
+def sample_value(field, index):
+    field = field() if isinstance(field, type) else field
+    for cls, values in VALUES.items():
+        if isinstance(field, cls):
+            return values[index % len(values)]
+    return None
+
+
+def sample_rows(model, count=6):
+    model = getattr(model, 'resolved', model)
+    rows = []
+    for index in range(count):
+        rows.append({
+            key: sample_value(field, index + position)
+            for position, (key, field) in enumerate(model.items())
+            # some keys are missing
+            if (index + position) % 5
+        })
+    return rows
+
+
+def test_models(api_app):
+    for model in api.models.values():
+        rows = sample_rows(model)
+        assert marshal(rows, model) == restplus_marshal(rows, model), model.name
+        assert marshal(rows[0], model) == restplus_marshal(rows[0], model)
+
+
+def test_mask_and_envelope(api_app):
+    model = api.models['Transformation Model']
+    rows = sample_rows(model)
+    assert marshal(rows, model, mask='id,tdate') == \
+        restplus_marshal(rows, model, mask='id,tdate')
+    assert marshal(rows, model, 'data') == restplus_marshal(rows, model, 'data')
+    assert list(marshal(rows[1], model, mask='id')) == ['id']
+
+
+def test_nested_and_defaults():
+    inner = {'id': fields.Integer, 'at': li3ds_fields.DateTime(dt_format='iso8601')}
+    model = {
+        'count': fields.Integer(default=0),
+        'name': fields.String(default='none'),
+        'items': fields.List(fields.Nested(inner)),
+        'child': fields.Nested(inner, allow_null=True),
+        'flat': inner,
+        'alias': fields.String(attribute='name'),
+        'keys': fields.Raw,
+    }
+    rows = [
+        {'name': 'a', 'items': [{'id': '1', 'at': '2017-01-01T02:00:00+02'}],
+         'child': {'id': 2}, 'id': 3},
+        {'count': None, 'items': None, 'child': None},
+        OrderedDict([('count', '4')]),
+    ]
+    assert marshal(rows, model) == restplus_marshal(rows, model)
+
+
+def test_errors_are_delegated():
+    model = {'id': fields.Integer}
+    with pytest.raises(Exception) as error:
+        restplus_marshal({'id': 'x'}, model)
+    with pytest.raises(error.type):
+        marshal({'id': 'x'}, model)
+
+
+def test_compiled_once(api_app):
+    model = api.models['Transformation Model']
+    assert serializer(model) is serializer(model)
+    assert serializer(model, 'id') is serializer(model, 'id')
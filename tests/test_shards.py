@@ -0,0 +1,109 @@
+import json
+
+import pytest
+from werkzeug.exceptions import HTTPException
+
+from api_li3ds import app as app_module
+from api_li3ds import database, shards
+from api_li3ds.database import Database
+
+from conftest import API_KEY
+
+
+def body(resp):
+    return json.loads(resp.get_data(as_text=True))
+
+
+def where():
+    server = getattr(Database.local, 'server', None)
+    return server.name if server else 'primary'
+
+
+@pytest.fixture
+def sharded(api_app, fake_connection, monkeypatch):
+    queries = []
+
+    def query_asjson(query, parameters=None):
+        queries.append((parameters, where()))
+        if parameters and isinstance(parameters[0], list):
+            return [{'id': id, 'name': where()} for id in parameters[0]]
+        return [{'id': 1, 'name': where()}]
+
+    monkeypatch.setattr(Database, 'query_asjson', query_asjson)
+    monkeypatch.setattr(Database, 'query_asdict', query_asjson)
+    monkeypatch.setattr(database, 'connect', lambda dsn, **kwargs: fake_connection(dsn))
+    monkeypatch.setattr(app_module, 'table_versions', lambda tables: None)
+    for name in ('db', 'pid', 'pool', 'spare', 'replicas', 'shards', 'local'):
+        monkeypatch.setattr(Database, name, getattr(Database, name))
+    api_app.config.update(
+        pg_user='u', pg_password='p', pg_host='primary', pg_port=5432, pg_name='li3ds',
+        pg_shards=[
+            {'pg_host': 'shard1', 'projects': ['a']},
+            {'dsn': 'postgresql://u:p@shard2:5433/li3ds', 'projects': ['b']},
+        ],
+        SHARD_ID_RANGE=100,
+    )
+    Database.init_app(api_app)
+    return api_app, queries
+
+
+def test_shard_of_ids_and_names(sharded):
+    app, _ = sharded
+    with app.app_context():
+        assert [shards.id_shard(id) for id in (1, 100, 101, 250, 301, 'x')] == [0, 0, 1, 2, 0, 0]
+        assert [shards.project_shard(name) for name in ('a', 'b', 'c')] == [1, 2, 0]
+
+
+def test_listing_fanout(sharded):
+    app, _ = sharded
+    resp = app.test_client().get('/sessions/')
+    assert resp.status_code == 200
+    assert [row['name'] for row in body(resp)] == ['primary', 'shard1:5432', 'shard2:5433']
+
+
+def test_routed_requests(sharded):
+    app, queries = sharded
+    client = app.test_client()
+    for id, name in ((5, 'primary'), (150, 'shard1:5432'), (250, 'shard2:5433'),
+                     (999, 'primary')):
+        assert body(client.get('/sessions/{}/'.format(id)))[0]['name'] == name
+    assert body(client.get('/projects/b/'))[0]['name'] == 'shard2:5433'
+    client.get('/datasources/?session=150')
+    assert queries[-1][1] == 'shard1:5432'
+
+    resp = client.post('/sessions/', json={'project': 150, 'platform': 1},
+                       headers={'X-API-KEY': API_KEY})
+    assert resp.status_code == 201
+    assert queries[-1][1] == 'shard1:5432'
+
+
+def test_ids_by_shard(sharded):
+    app, queries = sharded
+    resp = app.test_client().get('/sessions/?ids=250,5,150')
+    assert [row['id'] for row in body(resp)] == [250, 5, 150]
+    assert queries == [
+        (([5],), 'primary'), (([150],), 'shard1:5432'), (([250],), 'shard2:5433')]
+
+
+def test_scatter(sharded):
+    app, _ = sharded
+    items = [{'session': 150}, {'session': 5}, {'session': 151}]
+    with app.app_context():
+        results = shards.scatter(
+            items, lambda item: shards.id_shard(item['session']),
+            lambda items: [(item['session'], where()) for item in items])
+    assert results == [(150, 'shard1:5432'), (5, 'primary'), (151, 'shard1:5432')]
+
+
+def test_no_transaction_across_shards(sharded):
+    app, _ = sharded
+    with app.test_request_context('/'):
+        with Database.transaction():
+            with shards.on_shard(0):
+                pass
+            with pytest.raises(HTTPException):
+                with shards.on_shard(1):
+                    pass
+        with shards.on_shard(1):
+            with Database.transaction():
+                assert where() == 'shard1:5432'
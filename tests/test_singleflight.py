@@ -0,0 +1,91 @@
+import json
+import threading
+import time
+
+import pytest
+
+from api_li3ds import app as app_module
+from api_li3ds.database import Database
+from api_li3ds.cache import thaw
+from api_li3ds.singleflight import SingleFlight, lock_key, dumps, loads
+
+
+def test_do_shares_result():
+    flights = SingleFlight()
+    started = threading.Event()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        started.set()
+        time.sleep(0.1)
+        return 42
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flights.do(('a',), compute)))
+    leader.start()
+    started.wait()
+    followers = [
+        threading.Thread(target=lambda: results.append(flights.do(('a',), compute)))
+        for _ in range(3)
+    ]
+    for thread in followers:
+        thread.start()
+    for thread in [leader] + followers:
+        thread.join()
+
+    assert results == [42] * 4
+    assert len(calls) == 1
+    assert flights.stats() == {'a': 3}
+    # no more call in flight
+    assert flights.do(('a',), lambda: 43) == 43
+
+
+def test_do_shares_error():
+    flights = SingleFlight()
+    with pytest.raises(ValueError):
+        flights.do(('a',), lambda: int('x'))
+    assert flights.calls == {}
+
+
+def test_lock_key():
+    assert lock_key(('sensors', ())) == lock_key(('sensors', ()))
+    assert -2 ** 63 <= lock_key(('sensors', ())) < 2 ** 63
+
+
+def test_shared_results_are_json(api_app):
+    with api_app.test_request_context('/'):
+        value = dumps(([{'id': 1}], 200, {'X-Missing-Ids': '4'}))
+        assert json.loads(value.decode('utf-8'))['status'] == 200
+        resp = thaw(loads(value))
+        assert json.loads(resp.get_data(as_text=True)) == [{'id': 1}]
+        assert resp.headers['X-Missing-Ids'] == '4'
+
+        # responses are stored as they are
+        assert loads(dumps(loads(value))) == loads(value)
+
+
+def test_coalesced_endpoint(api_app, monkeypatch):
+    calls = []
+
+    def query_asjson(query, parameters=None):
+        calls.append(query)
+        time.sleep(0.2)
+        return [{'id': 1, 'type': 'camera'}]
+
+    monkeypatch.setattr(Database, 'query_asjson', query_asjson)
+    monkeypatch.setattr(app_module, 'table_versions', lambda tables: None)
+
+    statuses = []
+
+    def get():
+        statuses.append(api_app.test_client().get('/sensors/').status_code)
+
+    threads = [threading.Thread(target=get) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert statuses == [200] * 4
+    assert len(calls) == 1
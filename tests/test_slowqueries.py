@@ -0,0 +1,88 @@
+import time
+
+import pytest
+
+from api_li3ds import slowqueries
+from api_li3ds.slowqueries import Inspector, read_only, seq_scans, shape
+
+from conftest import API_KEY
+
+PLAN = [{
+    'Plan': {
+        'Node Type': 'Hash Join',
+        'Plans': [
+            {'Node Type': 'Seq Scan', 'Relation Name': 'referential'},
+            {'Node Type': 'Index Scan', 'Relation Name': 'sensor'},
+            {'Node Type': 'Seq Scan', 'Relation Name': 'sensor_type'},
+        ],
+    },
+    'Execution Time': 1234.5,
+}]
+
+QUERY = 'select * from li3ds.referential r where ARRAY[r.id] <@ %s'
+
+
+@pytest.fixture
+def inspector(api_app, fake_connection, monkeypatch):
+    connection = fake_connection()
+    connection.result('explain', [(PLAN,)])
+    # rows of large tables
+    connection.result('', [('referential', 50000)])
+    monkeypatch.setattr(slowqueries, 'connect', lambda dsn: connection)
+    api_app.config.update(SLOW_QUERY_MS=100, SLOW_QUERY_SAMPLING=0)
+    return Inspector(), connection
+
+
+def wait_for(condition):
+    end = time.monotonic() + 5
+    while not condition() and time.monotonic() < end:
+        time.sleep(0.01)
+    assert condition()
+
+
+def test_read_only():
+    assert read_only(' select 1') and read_only('WITH t as (select 1) select * from t')
+    assert not read_only('insert into li3ds.sensor default values')
+    assert not read_only('with d as (delete from li3ds.sensor) select 1')
+    assert not read_only('select pg_try_advisory_lock(%s)')
+    assert not read_only('select nextval(%s)')
+
+
+def test_shape_and_scans():
+    assert shape(([1, 2, 3], 'a')) == ['list[3]', 'str']
+    assert shape({'id': 1}) == {'id': 'int'}
+    assert seq_scans(PLAN[0]['Plan']) == ['referential', 'sensor_type']
+
+
+def test_slow_query_explained(api_app, inspector):
+    inspector, connection = inspector
+    with api_app.test_request_context('/transfotrees/1/dot/'):
+        api_app.preprocess_request()
+        inspector.inspect(None, QUERY, ([1, 2],), 0.05, 'dsn')
+        assert not inspector.queries
+        inspector.inspect(None, 'delete from li3ds.sensor where id = %s', (1,), 2, 'dsn')
+        assert not inspector.queries
+        inspector.inspect(None, QUERY, ([1, 2],), 0.5, 'dsn')
+        wait_for(lambda: inspector.stats()['queries'])
+        # not sampled again
+        inspector.inspect(None, QUERY, ([1, 2, 3],), 2, 'dsn')
+
+    assert connection.queries[:3] == [
+        'set transaction read only',
+        'set local statement_timeout = %s',
+        'explain (analyze, buffers, format json) ' + QUERY,
+    ]
+    assert connection.rolledback
+    query, = inspector.stats()['queries']
+    assert query['endpoint'] == 'transfotree_dot'
+    assert query['parameters'] == ['list[2]']
+    assert query['count'] == 2 and query['duration_ms'] == 500
+    assert query['execution_ms'] == 1234.5 and query['plan'] == PLAN
+    assert query['seq_scans'] == [{'table': 'referential', 'rows': 50000}]
+
+
+def test_slow_queries_endpoint(api_app):
+    client = api_app.test_client()
+    assert client.get('/monitoring/slowqueries/').status_code == 401
+    resp = client.get('/monitoring/slowqueries/', headers={'X-API-KEY': API_KEY})
+    assert resp.status_code == 200
@@ -0,0 +1,45 @@
+import gzip
+import json
+
+from api_li3ds import specs
+from api_li3ds.app import api
+
+
+def test_specs(api_app):
+    client = api_app.test_client()
+    resp = client.get('/swagger.json')
+    assert resp.status_code == 200
+    schema = json.loads(resp.get_data(as_text=True))
+    assert '/sensors/' in schema['paths']
+    etag = resp.headers['ETag']
+
+    resp = client.get('/swagger.json', headers={'If-None-Match': etag})
+    assert resp.status_code == 304
+
+    resp = client.get('/swagger.json', headers={'Accept-Encoding': 'gzip'})
+    assert resp.headers['Content-Encoding'] == 'gzip'
+    assert json.loads(gzip.decompress(resp.get_data()).decode('utf-8')) == schema
+
+
+def test_specs_base_path(api_app):
+    client = api_app.test_client()
+    resp = client.get('/swagger.json')
+    assert json.loads(resp.get_data(as_text=True))['basePath'] == '/'
+    resp = client.get('/swagger.json', base_url='http://localhost/li3ds/')
+    assert json.loads(resp.get_data(as_text=True))['basePath'] == '/li3ds/'
+
+
+def test_validate(api_app):
+    built = specs.build(api_app, api)
+    assert specs.validate(built) == []
+
+    broken = json.dumps({'swagger': '2.0', 'info': {}, 'paths': {
+        '/a/': {'get': {'responses': {'200': {'schema': {'$ref': '#/definitions/A'}}},
+                        'operationId': 'get_a'},
+                'post': {'operationId': 'get_a'}},
+    }}).encode('utf-8')
+    assert specs.validate(specs.Specs(broken, None, None)) == [
+        'unresolved reference #/definitions/A',
+        'no response for post /a/',
+        'duplicate operationId get_a',
+    ]
@@ -0,0 +1,111 @@
+import time
+import socket
+
+import pytest
+from flask import request
+from psycopg2.extensions import QueryCanceledError
+from werkzeug.exceptions import HTTPException
+
+from api_li3ds import timeouts
+from api_li3ds.exc import pgexceptions
+from api_li3ds.timeouts import Watchdog
+
+
+def test_endpoint_budget(api_app):
+    api_app.config.update(STATEMENT_TIMEOUT=1000, STATEMENT_TIMEOUTS={'sensor': 50})
+    with api_app.test_request_context('/sensors/'):
+        api_app.preprocess_request()
+        assert timeouts.budget() == 1000
+    with api_app.test_request_context('/sensors/1/'):
+        api_app.preprocess_request()
+        assert timeouts.budget() == 50
+    with api_app.app_context():
+        assert timeouts.budget() == 1000
+
+
+def test_session_timeout_set_on_change(api_app, fake_connection):
+    connection = fake_connection()
+    api_app.config.update(STATEMENT_TIMEOUTS={'sensor': 50})
+    with api_app.test_request_context('/sensors/'):
+        api_app.preprocess_request()
+        timeouts.apply(connection.cursor())
+    with api_app.test_request_context('/sensors/1/'):
+        api_app.preprocess_request()
+        timeouts.apply(connection.cursor())
+        timeouts.apply(connection.cursor())
+        connection.autocommit = False
+        timeouts.begin(connection)
+        connection.autocommit = True
+    with api_app.test_request_context('/sensors/'):
+        api_app.preprocess_request()
+        timeouts.begin(connection)
+        timeouts.apply(connection.cursor())
+    assert [query % parameters for query, parameters in connection.executed] == [
+        'set statement_timeout = 50',
+        'set local statement_timeout = 0',
+        'set statement_timeout = 0',
+    ]
+
+
+def test_shared_connection_timeout_sent_with_statement(api_app, fake_connection):
+    connection = fake_connection()
+    api_app.config.update(STATEMENT_TIMEOUTS={'sensor': 50})
+    with api_app.test_request_context('/sensors/1/'):
+        api_app.preprocess_request()
+        assert timeouts.apply(connection.cursor(), dedicated=False) == \
+            'set local statement_timeout = 50; '
+    with api_app.test_request_context('/sensors/'):
+        api_app.preprocess_request()
+        assert timeouts.apply(connection.cursor(), dedicated=False) == ''
+    # the session setting is left alone
+    assert connection.queries == []
+    assert connection not in timeouts.settings
+
+
+def test_cancel_after_deadline(api_app, fake_connection):
+    watchdog = Watchdog()
+    connection = fake_connection()
+    api_app.config['REQUEST_TIMEOUT'] = 10
+    with api_app.test_request_context('/sensors/'):
+        timeouts.start_request()
+        with watchdog.watch(connection):
+            watchdog.check()
+            assert not connection.cancelled
+            watchdog.check(time.monotonic() + 11)
+            assert connection.cancelled and watchdog.cancelled == 1
+        assert not watchdog.watched
+
+        # not watched on a connection shared with other threads
+        with watchdog.watch(connection, dedicated=False):
+            assert not watchdog.watched
+
+        # deadline already passed
+        request.environ[timeouts.DEADLINE_KEY] = time.monotonic() - 1
+        with pytest.raises(HTTPException):
+            with watchdog.watch(connection):
+                pass
+
+
+def test_cancel_on_disconnection(api_app, fake_connection):
+    watchdog = Watchdog()
+    connection = fake_connection()
+    server, client = socket.socketpair()
+    with api_app.test_request_context('/sensors/', environ_base={'gunicorn.socket': server}):
+        with watchdog.watch(connection):
+            watchdog.check()
+            assert not connection.cancelled
+            client.close()
+            watchdog.check()
+            assert connection.cancelled
+    server.close()
+
+
+def test_timeout_is_504(api_app):
+    @pgexceptions
+    def query():
+        raise QueryCanceledError('canceling statement due to statement timeout')
+
+    with api_app.test_request_context('/'):
+        with pytest.raises(HTTPException) as error:
+            query()
+    assert error.value.code == 504
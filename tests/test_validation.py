@@ -0,0 +1,56 @@
+import json
+
+import pytest
+from werkzeug.exceptions import BadRequest
+
+from api_li3ds.app import api
+from api_li3ds.validation import validate, validator
+from conftest import API_KEY
+
+
+def test_bulk_errors(api_app):
+    payload = [{'name': 'ok', 'sensor': 1}, {'name': 'ko', 'sensor': 'x'}, {'srid': []}]
+    resp = api_app.test_client().post(
+        '/referentials/bulk/', headers={'X-API-KEY': API_KEY},
+        data=json.dumps(payload), content_type='application/json')
+    assert resp.status_code == 400
+    body = json.loads(resp.get_data(as_text=True))
+    assert '2 invalid items' in body['message']
+    assert set(body['errors']) == {'1.sensor', '2.srid'}
+
+
+def test_same_errors_as_restplus(api_app):
+    model = api.models['Referential Model']
+    with api_app.test_request_context():
+        for data in ({'id': 1, 'name': 'a'}, {'id': 'x', 'srid': 'y'}):
+            try:
+                model.validate(data, api.refresolver, api.format_checker)
+                expected = None
+            except BadRequest as error:
+                expected = error.data
+            try:
+                validate(model, api, data)
+                found = None
+            except BadRequest as error:
+                found = error.data
+            assert found == expected
+
+
+def test_validator_cached(api_app):
+    model = api.models['Referential Model']
+    with api_app.test_request_context():
+        assert validator(model, api)[0] is validator(model, api)[0]
+        with pytest.raises(BadRequest):
+            validate(model, api, {'id': 'x'}, collection=True)
+
+
+@pytest.mark.parametrize('value', [
+    {}, {'name': 'a', 'srid': 4326, 'sensor': 1}, {'srid': True}, {'srid': 1.0},
+    {'name': None}, {'id': 1}, {'id': '1'}, [], 'x',
+])
+def test_compiled_check(api_app, value):
+    with api_app.test_request_context():
+        for model in api.models.values():
+            validator_, check = validator(model, api)
+            if check(value):
+                assert validator_.is_valid(value), model.name
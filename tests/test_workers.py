@@ -0,0 +1,97 @@
+import os
+import threading
+
+import pytest
+
+from api_li3ds import app as app_module
+from api_li3ds import database, workers
+from api_li3ds.cache import cache
+from api_li3ds.database import Database
+
+WORKERS = 4
+THREADS = 4
+REQUESTS = 25
+
+
+@pytest.fixture
+def forked_app(api_app, fake_connection, monkeypatch):
+    def connect(dsn, **kwargs):
+        connection = fake_connection(dsn)
+        connection.result('', [({'id': 1, 'type': 'camera'},)])
+        return connection
+
+    monkeypatch.setattr(database, 'connect', connect)
+    monkeypatch.setattr(app_module, 'table_versions', lambda tables: None)
+    monkeypatch.setattr(Database, 'db', None)
+    monkeypatch.setattr(Database, 'pid', None)
+    monkeypatch.setattr(Database, 'inherited', [])
+    # fake connections do not prepare statements
+    api_app.config['PREPARED_STATEMENTS'] = 0
+    # all requests come from the same address
+    api_app.config['RATE_LIMIT_ADDRESSES'] = {'rate': 0}
+    workers.init_app(api_app)
+    return api_app
+
+
+def hammer(app):
+    '''
+    Send concurrent requests, returns True if all succeeded
+    with a connection of this process
+    '''
+    statuses = []
+
+    def get():
+        client = app.test_client()
+        for _ in range(REQUESTS):
+            statuses.append(client.get('/sensors/').status_code)
+
+    threads = [threading.Thread(target=get) for _ in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    connection = Database.db
+    return (
+        statuses == [200] * THREADS * REQUESTS and
+        connection.pid == os.getpid() and
+        not connection.shared
+    )
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='fork not available')
+def test_forked_workers(forked_app):
+    # the master uses the database before forking
+    with forked_app.app_context():
+        Database.query_asjson('select 1')
+    master = Database.db
+    cache.set(('sensors',), 'cached', 60)
+
+    pids = []
+    for _ in range(WORKERS):
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                fresh = Database.db is None and cache.get(('sensors',)) is None
+                code = 0 if fresh and hammer(forked_app) else 1
+            finally:
+                os._exit(code)
+        pids.append(pid)
+
+    statuses = [os.waitpid(pid, 0)[1] for pid in pids]
+    assert statuses == [0] * WORKERS
+    assert Database.db is master
+    assert not master.shared
+
+
+def test_connection_checks_pid(forked_app, monkeypatch):
+    with forked_app.app_context():
+        connection = Database.connection()
+        monkeypatch.setattr(Database, 'pid', -1)
+        assert Database.connection() is not connection
+        assert Database.inherited == [connection]
+
+
+def test_server(monkeypatch):
+    monkeypatch.setenv('SERVER_SOFTWARE', 'gunicorn/19.7.1')
+    assert workers.server() == 'gunicorn'